@@ -5,75 +5,92 @@ import altair as alt
 from map import *
 import matplotlib.pyplot as plt
 import seaborn as sns
+from render_profile import start_profile
+from deferred_loads import filters_applied, load_requests
+from diagnostics import render_query_diagnostics
 
+# Hidden query diagnostics view, opened as /?diagnostics
+if "diagnostics" in st.query_params:
+    render_query_diagnostics()
+    st.stop()
+
+profile = start_profile("1_vendor_performance_kpi")
+profile.phase("widgets", "sidebar filters")
 st.sidebar.success("Select KPI above.")
 st.markdown("# Vendor Performance KPI")
 st.sidebar.header("Vendor Performance KPI")
 
 # Sidebar inputs
 default_start_date = datetime.datetime.today() - datetime.timedelta(days=7)
-start_date = st.sidebar.date_input("Start date", default_start_date)
-end_date = st.sidebar.date_input("End date", datetime.datetime.today())
+# Nothing is queried until Filter is pressed; editing the dates or the time
+# frame does not rerun the page
+with st.sidebar.form("filters"):
+    start_date = st.date_input("Start date", default_start_date)
+    end_date = st.date_input("End date", datetime.datetime.today())
+    time_frame = st.selectbox("Select time frame", ["Daily", "Weekly", "Monthly", "Yearly"])
+    submitted = st.form_submit_button("Filter")
 start_date = pd.to_datetime(start_date)
 end_date = pd.to_datetime(end_date)
-time_frame = st.sidebar.selectbox("Select time frame", ["Daily", "Weekly", "Monthly", "Yearly"])
-
-# Load data from the database
-orders = get_orders(start_date, end_date)
-products = get_products()
-product_names = get_product_names()
-categories = get_categories()
-vendors = get_vendors()
-
-# Merge products with product names and categories
-product_names = product_names.merge(categories, on='category_id')
-products = products.merge(product_names, on='name_id')
-
-category_sales = calculate_category_sales(orders, products, time_frame)
-# Calculate total sales, order volume, and average order value
-total_sales = calculate_total_sales(orders, products, time_frame)
-order_volume = calculate_order_volume(orders, products, time_frame)
-average_order_value = calculate_average_order_value(orders, products, time_frame)
-
-# Calculate metrics by vendor
-category_sales_vendor=calculate_category_sales_vendors(orders, products, time_frame)
-total_sales_vendor = calculate_total_sales_vendors(orders, products, time_frame)
-order_volume_vendor = calculate_order_volume_vendor(orders, products, time_frame)
-average_order_value_vendor = calculate_average_order_value_vendor(orders, products, time_frame)
-product_portfolio = calculate_product_portfolio(orders, products,time_frame)
-# Product popularity data
-product_sales_data = product_sales(orders, products, time_frame)
-product_sales_data_vendor = product_sales_vendor(orders, products, time_frame)
-
-
-# Summarize the most sold products
-most_sold_products_all = total_sales.groupby('product_name')['total_sales'].sum().reset_index().sort_values(by='total_sales', ascending=False)
-sorted_product_names_all = most_sold_products_all['product_name'].tolist()
-
-# Get unique vendor names for selection
-unique_vendor_names = products['vendor_name'].unique()
-selected_vendors = st.sidebar.multiselect("Select vendors", unique_vendor_names, default=unique_vendor_names)
-
-# Filter the products based on the selected vendors
-if len(selected_vendors) == len(unique_vendor_names):
-    # If all vendors are selected, include all products
-    available_product_names = products['product_name'].unique()
-else:
-    # Otherwise, filter products based on selected vendors
-    filtered_products = products[products['vendor_name'].isin(selected_vendors)]
-    available_product_names = filtered_products['product_name'].unique()
-most_sold_products = total_sales[total_sales['product_name'].isin(available_product_names)] \
-    .groupby('product_name')['total_sales'].sum() \
-    .reset_index() \
-    .sort_values(by='total_sales', ascending=False)
-
-sorted_product_names = most_sold_products['product_name'].tolist()
-# Use a single multiselect for product selection
-selected_products = st.sidebar.multiselect("Select products", sorted_product_names, default=sorted_product_names)
-
-if st.sidebar.button("Filter"):
+applied = filters_applied("1_vendor_performance_kpi", submitted)
+
+if applied:
+    # Load data from the database
+    profile.phase("fetch", "product catalog and vendor metrics")
+    loaded = load_requests("1_vendor_performance_kpi", {
+        "products": (get_product_catalog,),
+        "metrics": (get_vendor_metrics, start_date, end_date, time_frame),
+        "vendors": (get_vendors,),
+    }, submitted)
+    products = loaded["products"]
+    metrics = loaded["metrics"]
+
+    profile.phase("transform", "vendor and product options")
+    category_sales = metrics["category_sales"]
+    # Total sales, order volume, and average order value
+    total_sales = metrics["total_sales"]
+    order_volume = metrics["order_volume"]
+    average_order_value = metrics["average_order_value"]
+
+    # Metrics by vendor
+    category_sales_vendor = metrics["category_sales_vendor"]
+    total_sales_vendor = metrics["total_sales_vendor"]
+    order_volume_vendor = metrics["order_volume_vendor"]
+    average_order_value_vendor = metrics["average_order_value_vendor"]
+    product_portfolio = metrics["product_portfolio"]
+    # Product popularity data
+    product_sales_data = metrics["product_sales"]
+    product_sales_data_vendor = metrics["product_sales_vendor"]
+
+
+    # Summarize the most sold products
+    most_sold_products_all = total_sales.groupby('product_name')['total_sales'].sum().reset_index().sort_values(by='total_sales', ascending=False)
+    sorted_product_names_all = most_sold_products_all['product_name'].tolist()
+
+    # Get unique vendor names for selection
+    unique_vendor_names = products['vendor_name'].unique()
+    profile.phase("widgets", "vendor and product filters")
+    selected_vendors = st.sidebar.multiselect("Select vendors", unique_vendor_names, default=unique_vendor_names)
+
+    # Filter the products based on the selected vendors
+    if len(selected_vendors) == len(unique_vendor_names):
+        # If all vendors are selected, include all products
+        available_product_names = products['product_name'].unique()
+    else:
+        # Otherwise, filter products based on selected vendors
+        filtered_products = products[products['vendor_name'].isin(selected_vendors)]
+        available_product_names = filtered_products['product_name'].unique()
+    most_sold_products = total_sales[total_sales['product_name'].isin(available_product_names)] \
+        .groupby('product_name')['total_sales'].sum() \
+        .reset_index() \
+        .sort_values(by='total_sales', ascending=False)
+
+    sorted_product_names = most_sold_products['product_name'].tolist()
+    # Use a single multiselect for product selection
+    selected_products = st.sidebar.multiselect("Select products", sorted_product_names, default=sorted_product_names)
+
    
     # Filter data based on selected vendors and products
+    profile.phase("transform", "filter by vendor and product")
     category_sales['category_sales'] = pd.to_numeric(category_sales['category_sales'], errors='coerce')
     total_sales = total_sales[total_sales['vendor_name'].isin(selected_vendors) & total_sales['product_name'].isin(selected_products)]
     total_sales['total_sales'] = pd.to_numeric(total_sales['total_sales'], errors='coerce')
@@ -95,6 +112,7 @@ if st.sidebar.button("Filter"):
     # Streamlit dashboard
 
     # Summary section
+    profile.phase("widgets", "summary")
     st.subheader("Summary")
     st.markdown(f"**Total Sales:** {total_sales['total_sales'].sum():,.2f}")
     st.markdown(f"**Total Orders:** {order_volume['order_count'].sum()}")
@@ -106,6 +124,7 @@ if st.sidebar.button("Filter"):
         st.markdown(f"- {row['product_name']}: {row['total_sales']:,.2f}")
 
     # Define a custom color palette
+    profile.phase("chart", "vendor charts")
     custom_colors = [
         '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
         '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf',
@@ -298,6 +317,7 @@ if st.sidebar.button("Filter"):
     ### Number of New Vendors
     This metric tracks the number of vendors added to your system within the specified date range. 
     """)
+    vendors = loaded["vendors"]
     new_vendors = vendors[(vendors['created_at'].between(start_date, end_date))]
     new_vendor_count = new_vendors['vendor_id'].nunique()
     new_vendor_names = new_vendors['vendor_name'].tolist()
@@ -362,3 +382,7 @@ if st.sidebar.button("Filter"):
     ).interactive().properties(title='Category Sales Comparison by Vendor')
     st.altair_chart(kpi_comparison_chart, use_container_width=True)
 
+else:
+    st.info("Choose a date range and time frame and press Filter to load the vendor KPIs.")
+
+profile.finish()
@@ -0,0 +1,50 @@
+import struct
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+
+# Shared by main.py and the Streamlit pages so both ends agree on the wire
+# format: a sequence of Arrow IPC streams, one per named DataFrame, each
+# preceded by its byte length.
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+_LENGTH = struct.Struct("<Q")
+
+def _to_arrow(df: pd.DataFrame) -> pa.Table:
+    df = df.copy()
+    df.columns = [str(col).strip() for col in df.columns]
+    for col in df.columns:
+        # NUMERIC sums come back from asyncpg as Decimal objects; ship them
+        # as floats like the JSON path does.
+        if df[col].dtype == object:
+            first = df[col].dropna().head(1)
+            if not first.empty and isinstance(first.iloc[0], Decimal):
+                df[col] = df[col].astype(float)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def encode_frames(frames: dict) -> bytes:
+    chunks = []
+    for name, df in frames.items():
+        table = _to_arrow(df)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"frame": name.encode()})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        body = sink.getvalue().to_pybytes()
+        chunks.append(_LENGTH.pack(len(body)))
+        chunks.append(body)
+    return b"".join(chunks)
+
+def decode_frames(payload: bytes) -> dict:
+    frames = {}
+    offset = 0
+    while offset < len(payload):
+        (size,) = _LENGTH.unpack_from(payload, offset)
+        offset += _LENGTH.size
+        table = pa.ipc.open_stream(payload[offset:offset + size]).read_all()
+        offset += size
+        name = table.schema.metadata[b"frame"].decode()
+        # date32 columns (order_date) come back as datetime64 directly.
+        frames[name] = table.to_pandas(date_as_object=False)
+    return frames
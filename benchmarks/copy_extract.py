@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_fetch import copy_frame, fetch_frame
+
+# Rows/sec of the three ways the pages can load a result: fetchall() into
+# pd.DataFrame (the old path), db_fetch.fetch_frame (server-side cursor) and
+# db_fetch.copy_frame (COPY ... TO STDOUT). The rows are generated into a
+# temporary table shaped like the heavy extracts (date, product name, counts,
+# prices, timestamps), so only the transfer is timed and no real tables are
+# needed.
+#
+#   python benchmarks/copy_extract.py [--rows 1000000] [--dsn postgresql://...]
+
+ROWS_SQL = """
+CREATE TEMPORARY TABLE copy_extract_rows AS
+SELECT
+    DATE '2024-08-01' + mod(g, 365) AS date,
+    'product ' || mod(g, 500) AS product_name,
+    gen_random_uuid() AS group_deal_id,
+    (mod(g, 12) + 2)::int AS max_group_member,
+    CASE WHEN mod(g, 10) > 0 THEN mod(g, 97) END AS total_quantity,
+    (mod(g, 1000))::numeric / 7 AS group_price,
+    TIMESTAMP '2024-08-01' + g * interval '1 minute' AS created_at
+FROM generate_series(1, %s) g
+"""
+
+QUERY = "SELECT * FROM copy_extract_rows"
+
+def fetchall_frame(conn, query, params=None):
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        data = cur.fetchall()
+        colnames = [desc[0] for desc in cur.description]
+        return pd.DataFrame(data, columns=colnames)
+
+LOADERS = {
+    "fetchall": fetchall_frame,
+    "fetch_frame": fetch_frame,
+    "copy_frame": copy_frame,
+}
+
+def best_of(conn, loader, repeat):
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        frame = loader(conn, QUERY)
+        timings.append(time.perf_counter() - began)
+        conn.rollback()
+    return min(timings), frame
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark fetchall, cursor and COPY result transfer.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dsn", help="defaults to the url in .streamlit/secrets.toml")
+    args = parser.parse_args()
+
+    if args.dsn:
+        dsn = args.dsn
+    else:
+        import streamlit as st
+        dsn = st.secrets["url"]
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(ROWS_SQL, (args.rows,))
+        conn.commit()
+        print(f"{args.rows} rows")
+        baseline = None
+        for name, loader in LOADERS.items():
+            elapsed, frame = best_of(conn, loader, args.repeat)
+            # Same shape and values, apart from NUMERIC arriving as float64
+            # from COPY instead of Decimal objects
+            frame["group_price"] = frame["group_price"].astype(float)
+            frame = frame.drop(columns="group_deal_id")
+            if baseline is None:
+                baseline = elapsed
+                reference = frame
+            else:
+                pd.testing.assert_frame_equal(reference, frame)
+            print(f"{name:<12} {elapsed:7.2f} s  {args.rows / elapsed:12,.0f} rows/s  "
+                  f"{baseline / elapsed:5.1f}x")
+    finally:
+        conn.close()
@@ -0,0 +1,316 @@
+import argparse
+import ast
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import asyncpg
+import pandas as pd
+import psycopg2
+import streamlit as st
+
+from synthetic_dataset import SCHEMA, bench_dsn
+
+# Times every data-loading function of the dashboard (map.py, users_kpi.py,
+# main.load_frames and the fetch functions of pages/*) plus the pandas
+# transforms the pages run on their results, against the synthetic dataset
+# from synthetic_dataset.py. Each fetch runs with the Streamlit caches
+# cleared, so every run pays for the queries. The JSON report (timings,
+# result row counts and the rows/bytes each function read, per query_metrics)
+# has sorted keys so reports from two commits diff cleanly; --baseline
+# prints the ratios against an earlier report.
+#
+#   python benchmarks/synthetic_dataset.py --orders 1m
+#   python benchmarks/fetch_suite.py [--range-days 30] [--output report.json] [--baseline old.json]
+
+FREQUENCIES = ["Daily", "Weekly", "Monthly"]
+
+def load_page(name):
+    # The pages build their UI at module level, so only the imports, the
+    # functions and the literal constants (columns_dict, ...) are executed.
+    path = os.path.join(REPO, "pages", name + ".py")
+    with open(path) as file:
+        tree = ast.parse(file.read(), path)
+    body = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.AsyncFunctionDef)):
+            body.append(node)
+        elif isinstance(node, ast.Assign) and all(isinstance(target, ast.Name) for target in node.targets):
+            try:
+                ast.literal_eval(node.value)
+            except ValueError:
+                continue
+            body.append(node)
+    namespace = {"__name__": name, "__file__": path}
+    exec(compile(ast.Module(body=body, type_ignores=[]), path, "exec"), namespace)
+    return namespace
+
+def row_count(result):
+    # Rows of a frame, or summed over a tuple/dict of frames; other
+    # containers (driver names, JSON records) count their items
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    if isinstance(result, dict):
+        result = list(result.values())
+    if isinstance(result, (tuple, list)):
+        if result and all(isinstance(value, (pd.DataFrame, dict, list, tuple)) for value in result):
+            return sum(row_count(value) for value in result)
+        return len(result)
+    return 0
+
+def source_totals(snapshot):
+    totals = {}
+    for query in snapshot["queries"]:
+        source = totals.setdefault(query["source"], {"executions": 0, "errors": 0, "rows": 0, "bytes": 0})
+        for key in source:
+            source[key] += query[key]
+    return totals
+
+class Suite:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def time(self, name, func, *args, clear_cache=False, copy=False):
+        from query_metrics import query_stats
+        timings = []
+        before = source_totals(query_stats.snapshot())
+        for _ in range(self.repeat):
+            if clear_cache:
+                st.cache_data.clear()
+            # Transforms that modify their input get a fresh copy each run
+            call_args = [arg.copy() if copy and isinstance(arg, pd.DataFrame) else arg for arg in args]
+            began = time.perf_counter()
+            result = func(*call_args)
+            timings.append(time.perf_counter() - began)
+        after = source_totals(query_stats.snapshot())
+        entry = {
+            "best_seconds": round(min(timings), 4),
+            "median_seconds": round(statistics.median(timings), 4),
+            "rows": row_count(result),
+        }
+        # Rows and bytes read from the database in one run, from the
+        # per-query counters
+        read = {key: 0 for key in ("executions", "errors", "rows", "bytes")}
+        for source, totals in after.items():
+            for key in read:
+                read[key] += totals[key] - before.get(source, {}).get(key, 0)
+        if read["executions"]:
+            entry["db"] = {key: value // self.repeat for key, value in read.items()}
+        self.results[name] = entry
+        errors = f"  {entry['db']['errors']} query errors" if read["errors"] >= self.repeat else ""
+        print(f"{name:<48} {entry['best_seconds']:8.3f} s {entry['rows']:>10,} rows{errors}")
+        return result
+
+def bench_map(suite, run):
+    import map
+    for frequency in FREQUENCIES + ["Yearly"]:
+        facts = suite.time(f"map.get_vendor_facts[{frequency}]", map.get_vendor_facts,
+                           run.start, run.end, frequency, clear_cache=True)
+    products = suite.time("map.get_product_catalog", map.get_product_catalog, clear_cache=True)
+    suite.time("map.get_vendors", map.get_vendors, clear_cache=True)
+    suite.time("map.calculate_vendor_metrics[Yearly]", map.calculate_vendor_metrics, facts, products)
+
+def bench_users_kpi(suite, run):
+    import users_kpi
+    suite.time("users_kpi.get_user_kpis", users_kpi.get_user_kpis, run.start, run.end, clear_cache=True)
+
+def bench_main(suite, run):
+    import main
+
+    async def load_frames():
+        main.async_pool = await asyncpg.create_pool(dsn=run.dsn, min_size=1, max_size=8)
+        try:
+            return await main.load_frames(run.start.date(), run.end.date(), 600)
+        finally:
+            await main.async_pool.close()
+    run.frames = suite.time("main.load_frames", lambda: asyncio.run(load_frames()))
+    suite.time("main.df_to_json", lambda frames: {name: main.df_to_json(df.copy()) for name, df in frames.items()},
+               run.frames)
+    suite.time("main.encode_frames", main.encode_frames, run.frames)
+
+def bench_order_analysis(suite, run):
+    page = load_page("1_order_analysis")
+    suite.time("1_order_analysis.fetch_data", page["fetch_data"], clear_cache=True)
+
+def bench_orders_kpi(suite, run):
+    # The page reads main.load_frames through the API; time its transforms
+    # on the same frames
+    page = load_page("2_orders_kpi")
+    if run.frames is None:
+        raise RuntimeError("needs the main.load_frames result")
+    aggregated = run.frames["aggregated_data"].copy()
+    aggregated["order_date"] = pd.to_datetime(aggregated["order_date"])
+    revenue = run.frames["total_revenue_data"].copy()
+    revenue["order_date"] = pd.to_datetime(revenue["order_date"])
+    filtered = suite.time("2_orders_kpi.apply_filters", page["apply_filters"],
+                          aggregated, run.start, run.end, "ALL", "ALL", copy=True)
+    for frequency in FREQUENCIES:
+        suite.time(f"2_orders_kpi.aggregate_by_frequency[{frequency}]", page["aggregate_by_frequency"],
+                   filtered, frequency, copy=True)
+        suite.time(f"2_orders_kpi.aggregate_by_payment_method[{frequency}]", page["aggregate_by_payment_method"],
+                   filtered, frequency, copy=True)
+        suite.time(f"2_orders_kpi.aggregate_metrics_by_frequency[{frequency}]",
+                   page["aggregate_metrics_by_frequency"], revenue, frequency, "total_revenue", copy=True)
+
+def bench_group_kpi(suite, run):
+    page = load_page("3_group_kpi")
+    leaders = suite.time("3_group_kpi.fetch_aggregated_data", page["fetch_aggregated_data"],
+                         run.start, run.end, clear_cache=True)
+    suite.time("3_group_kpi.get_aggregated_data", page["get_aggregated_data"], clear_cache=True)
+    suite.time("3_group_kpi.fetch_all_data", page["fetch_all_data"], clear_cache=True)
+    suite.time("3_group_kpi.daily_GLAC_data", page["daily_GLAC_data"], run.start, run.end, clear_cache=True)
+    for frequency in FREQUENCIES:
+        suite.time(f"3_group_kpi.fetch_data[{frequency}]", page["fetch_data"],
+                   run.start, run.end, frequency, [], [], clear_cache=True)
+        suite.time(f"3_group_kpi.resample_data[{frequency.lower()}]", page["resample_data"],
+                   leaders, frequency.lower(), copy=True)
+
+def bench_logistic(suite, run):
+    page = load_page("5_logistic")
+    drivers = suite.time("5_logistic.fetch_driver_names_and_ids", page["fetch_driver_names_and_ids"],
+                         clear_cache=True)
+    driver_metrics, top_locations = suite.time("5_logistic.fetch_aggregated_data", page["fetch_aggregated_data"],
+                                               run.start, run.end, [], clear_cache=True)
+    suite.time("5_logistic.fetch_report_data", page["fetch_report_data"], run.start, run.end, clear_cache=True)
+    locations = suite.time("5_logistic.location_totals", page["location_totals"], top_locations)
+    suite.time("5_logistic.aggregate_locations", page["aggregate_locations"], locations, copy=True)
+
+    def metric_frames(frequency):
+        # The page's per-metric pipeline: slice, name drivers, bucket,
+        # convert and aggregate each metric frame
+        aggregated = {}
+        for name, params in page["aggregation_params"].items():
+            df = page["metric_frame"](driver_metrics, page["columns_dict"][name])
+            df = page["map_driver_id"](df, drivers)
+            df = page["process_dataframe"](df, frequency)
+            df = page["convert_columns_to_numeric"](df, page["columns_dict"][name])
+            aggregated[name] = page["aggregate_and_index"](df, **params)
+        return aggregated
+
+    for frequency in FREQUENCIES:
+        suite.time(f"5_logistic.fetch_delivery_data[{frequency}]", page["fetch_delivery_data"],
+                   run.start, run.end, [], frequency, clear_cache=True)
+        suite.time(f"5_logistic.fetch_summary_data[{frequency}]", page["fetch_summary_data"],
+                   run.start, run.end, [], frequency, clear_cache=True)
+        suite.time(f"5_logistic.metric_frames[{frequency}]", metric_frames, frequency)
+
+def bench_product_kpi(suite, run):
+    page = load_page("6_product_kpi")
+    for frequency in FREQUENCIES:
+        suite.time(f"6_product_kpi.fetch_aggregated_data[{frequency}]", page["fetch_aggregated_data"],
+                   run.start, run.end, frequency, clear_cache=True)
+
+def bench_group_failurity(suite, run):
+    page = load_page("7_group_failurity")
+    suite.time("7_group_failurity.get_kpi_data", page["get_kpi_data"], run.start, run.end, clear_cache=True)
+
+# In run order; bench_orders_kpi reuses the frames from bench_main
+BENCHMARKS = {
+    "map": bench_map,
+    "users_kpi": bench_users_kpi,
+    "main": bench_main,
+    "1_order_analysis": bench_order_analysis,
+    "2_orders_kpi": bench_orders_kpi,
+    "3_group_kpi": bench_group_kpi,
+    "5_logistic": bench_logistic,
+    "6_product_kpi": bench_product_kpi,
+    "7_group_failurity": bench_group_failurity,
+}
+
+class Run:
+    def __init__(self, dsn, start_date, end_date):
+        self.dsn = dsn
+        self.start = pd.Timestamp(start_date)
+        self.end = pd.Timestamp(end_date)
+        self.frames = None
+
+def run_benchmarks(suite, run, names):
+    skipped = {}
+    for name in names:
+        try:
+            BENCHMARKS[name](suite, run)
+        except Exception as e:
+            # e.g. an optional page dependency that does not import here;
+            # reported so a diff shows the missing entries were skipped
+            skipped[name] = f"{type(e).__name__}: {e}"
+            print(f"{name:<48} skipped: {skipped[name]}")
+    return skipped
+
+def git_commit():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO, capture_output=True, text=True).stdout.strip()
+    commit = git("rev-parse", "--short", "HEAD")
+    return commit + "-dirty" if git("status", "--porcelain", "--untracked-files=no") else commit
+
+def dataset_info(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT orders, days, seed, generated_at FROM dataset_info")
+            orders, days, seed, generated_at = cur.fetchone()
+    finally:
+        conn.close()
+    return {"orders": orders, "days": days, "seed": seed, "generated_at": generated_at.isoformat()}
+
+def compare(report, baseline):
+    print(f"\n{'':<48} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for name, entry in report["timings"].items():
+        old = baseline["timings"].get(name)
+        if old is None:
+            continue
+        ratio = entry["best_seconds"] / old["best_seconds"] if old["best_seconds"] else float("inf")
+        rows = "" if entry["rows"] == old["rows"] else f"  rows {old['rows']:,} -> {entry['rows']:,}"
+        print(f"{name:<48} {old['best_seconds']:10.3f} {entry['best_seconds']:10.3f} {ratio:6.2f}x{rows}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the dashboard's fetch functions and transforms.")
+    parser.add_argument("--range-days", type=int, default=30, help="date range ending on the dataset's last day")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS),
+                        help="run only these modules/pages")
+    parser.add_argument("--schema", default=SCHEMA)
+    parser.add_argument("--output", help="write the JSON report here (default: stdout summary only)")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--dsn", help="defaults to the url in .streamlit/secrets.toml")
+    args = parser.parse_args()
+
+    dsn = bench_dsn(args.dsn or st.secrets["url"], args.schema)
+    # db_pool and main connect through KPI_DATABASE_URL; config.json is
+    # read from the working directory
+    os.environ["KPI_DATABASE_URL"] = dsn
+    output, baseline = [os.path.abspath(path) if path else None for path in (args.output, args.baseline)]
+    os.chdir(REPO)
+
+    info = dataset_info(dsn)
+    end_date = datetime.fromisoformat(info["generated_at"]).date()
+    start_date = end_date - timedelta(days=args.range_days)
+    print(f"{info['orders']:,} orders, {start_date} to {end_date}, best of {args.repeat}")
+
+    suite = Suite(args.repeat)
+    skipped = run_benchmarks(suite, Run(dsn, start_date, end_date), args.only)
+
+    report = {
+        "commit": git_commit(),
+        "dataset": info,
+        "range": {"start_date": start_date.isoformat(), "end_date": end_date.isoformat()},
+        "repeat": args.repeat,
+        "skipped": skipped,
+        "ran_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "timings": suite.results,
+    }
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+            file.write("\n")
+    if baseline:
+        with open(baseline) as file:
+            compare(report, json.load(file))
@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from group_leaders import RESAMPLE_RULES, leader_kpis
+
+# Compares group_leaders.leader_kpis with the per-bucket apply it replaced on
+# pages/3_group_kpi.py, on synthetic daily_group_stats-shaped rows.
+#
+#   python benchmarks/group_leader_kpis.py [--rows 200000] [--days 365]
+
+def calculate_kpis(df):
+    # The old per-bucket KPI function, kept here as the reference
+    total_group_leader = df['group_leader'].count()
+    total_unique_group_leader = df['group_leader'].nunique()
+    total_New_group_leader = df[df['is_new_group_leader'] == 1]['group_leader'].nunique()
+    return pd.Series({
+        'Total Group Leader': total_group_leader,
+        'Total Unique Group Leader': total_unique_group_leader,
+        'Total New Group Leaders': total_New_group_leader
+    })
+
+def apply_kpis(df, freq):
+    return df.resample(RESAMPLE_RULES[freq], on='group_created_date').apply(calculate_kpis).reset_index()
+
+def synthetic_groups(rows, days, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2024-01-01')
+    return pd.DataFrame({
+        'group_created_date': start + pd.to_timedelta(rng.integers(0, days, rows), unit='D'),
+        'group_leader': rng.integers(0, max(rows // 5, 1), rows).astype(str),
+        'is_new_group_leader': (rng.random(rows) < 0.1).astype(int),
+        'status': rng.choice(['COMPLETED', 'FAILED', 'ACTIVE'], rows),
+    })
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - began)
+    return min(timings), result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the group leader KPI aggregation.")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = synthetic_groups(args.rows, args.days)
+    print(f"{args.rows} rows over {args.days} days")
+    for freq in RESAMPLE_RULES:
+        old_time, old = best_of(lambda: apply_kpis(df, freq), args.repeat)
+        new_time, new = best_of(lambda: leader_kpis(df, freq), args.repeat)
+        pd.testing.assert_frame_equal(old, new)
+        print(f"{freq:<8} apply {old_time * 1000:9.1f} ms   vectorized {new_time * 1000:7.1f} ms   "
+              f"{old_time / new_time:6.1f}x")
@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from deferred_loads import results_key
+from fetch_suite import dataset_info, git_commit
+from synthetic_dataset import SCHEMA, bench_dsn
+
+# Drives the dashboard pages headlessly with Streamlit's AppTest against the
+# synthetic dataset (see synthetic_dataset.py) and times whole-script
+# reruns, which is what a user waits for after touching a widget. Each page
+# goes through the same interactions in order: first load, a longer date
+# range, a frequency switch and its Filter / Generate Report button.
+#
+# Every interaction is timed twice:
+#   cold  - Streamlit data caches, the API's result cache and the results
+#           the page keeps in session state (deferred_loads.py) cleared first
+#   warm  - the same interaction applied again with the caches filled
+# and for each run the report lists the query_metrics sources that went to
+# the database, so a warm rerun that still queries shows up by name. The
+# connection pool stays open across runs, as it would in a live server.
+# pages/2_orders_kpi.py reads through the API, which is started in-process
+# unless --api-url is given.
+#
+#   python benchmarks/page_reruns.py [--range-days 30] [--output pages.json] [--baseline old.json]
+
+# page -> (frequency selectbox label, button label)
+PAGES = {
+    "1_vendor_performance_kpi.py": ("Select time frame", "Filter"),
+    "pages/2_orders_kpi.py": ("Frequency", "Filter"),
+    "pages/3_group_kpi.py": ("Select Frequency", "Filter"),
+    "pages/4_users_kpi.py": ("Frequency", "Filter"),
+    "pages/5_logistic.py": ("Frequency", "Filter"),
+    "pages/6_product_kpi.py": ("Frequency", None),
+    "pages/7_group_failurity.py": (None, "Generate Report"),
+}
+
+def widget(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise LookupError(f"no widget labelled {label!r}")
+
+def interactions(frequency_label, button_label, start_date):
+    # (name, apply) pairs; applying one twice leaves the same widget state,
+    # except for buttons, which are pressed again
+    steps = [
+        ("first load", lambda at: None),
+        ("date range", lambda at: widget(at.date_input, "Start date").set_value(start_date)),
+    ]
+    if frequency_label:
+        def switch_frequency(at):
+            selectbox = widget(at.selectbox, frequency_label)
+            selectbox.set_value(selectbox.options[1])
+        steps.append(("frequency", switch_frequency))
+    if button_label:
+        steps.append((button_label, lambda at: widget(at.button, button_label).click()))
+    return steps
+
+def db_reads():
+    from query_metrics import query_stats
+    snapshot = query_stats.snapshot()
+    reads = {}
+    for query in snapshot["queries"]:
+        reads[query["source"]] = reads.get(query["source"], 0) + query["executions"]
+    misses = {source["source"]: source["cache_misses"] for source in snapshot["sources"]}
+    return reads, misses
+
+def difference(after, before):
+    return {key: value - before.get(key, 0) for key, value in after.items() if value != before.get(key, 0)}
+
+class PageRuns:
+    def __init__(self, dsn, api_url, timeout, repeat, clear_api_cache):
+        self.dsn = dsn
+        self.api_url = api_url
+        self.timeout = timeout
+        self.repeat = repeat
+        self.clear_api_cache = clear_api_cache
+        self.results = {}
+
+    def new_app(self, page):
+        at = AppTest.from_file(os.path.join(REPO, page), default_timeout=self.timeout)
+        at.secrets["url"] = self.dsn
+        if self.api_url:
+            at.secrets["fastapi"] = {"url": self.api_url}
+        return at
+
+    def timed_run(self, at, name, apply, cold):
+        if cold:
+            st.cache_data.clear()
+            self.clear_api_cache()
+            # Results the deferred-loading pages keep in session state
+            if results_key(name) in at.session_state:
+                del at.session_state[results_key(name)]
+        apply(at)
+        reads_before, misses_before = db_reads()
+        began = time.perf_counter()
+        at.run()
+        seconds = time.perf_counter() - began
+        reads_after, misses_after = db_reads()
+        return seconds, {
+            "queries": difference(reads_after, reads_before),
+            "cache_misses": difference(misses_after, misses_before),
+            "exceptions": [exception.value.splitlines()[0] for exception in at.exception],
+        }
+
+    def measure(self, at, name, apply, cold):
+        timings = []
+        for _ in range(self.repeat):
+            seconds, details = self.timed_run(at, name, apply, cold)
+            timings.append(seconds)
+        return {
+            "best_seconds": round(min(timings), 4),
+            "median_seconds": round(statistics.median(timings), 4),
+            # What the last of the runs read; the runs are identical
+            **details,
+        }
+
+    def run_page(self, page, start_date):
+        frequency_label, button_label = PAGES[page]
+        name = os.path.splitext(os.path.basename(page))[0]
+        at = self.new_app(page)
+        for step, apply in interactions(frequency_label, button_label, start_date):
+            if step == "first load":
+                # A new session each time, like another user opening the page
+                cold = self.measure(self.new_app(page), name, apply, cold=True)
+                warm = self.measure(self.new_app(page), name, apply, cold=False)
+                at.run()
+            else:
+                cold = self.measure(at, name, apply, cold=True)
+                warm = self.measure(at, name, apply, cold=False)
+            self.results[f"{name}:{step}"] = {"cold": cold, "warm": warm}
+            print(f"{name + ': ' + step:<44} cold {cold['best_seconds']:7.3f} s {sum(cold['queries'].values()):>4} queries"
+                  f"   warm {warm['best_seconds']:7.3f} s {sum(warm['queries'].values()):>4} queries"
+                  + (f"   {cold['exceptions'][0]}" if cold["exceptions"] else ""))
+            if warm["queries"]:
+                print(f"{'':<44} warm rerun queried: {', '.join(sorted(warm['queries']))}")
+
+def start_api():
+    # main.py under uvicorn in a daemon thread, on a free local port
+    import uvicorn
+    import main
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def clear_api_cache():
+        main.result_cache = main.ResultCache(**main.load_config().get("result_cache", {}))
+    return f"http://127.0.0.1:{port}/fetch_aggregated_data/", server, clear_api_cache
+
+def compare(report, baseline):
+    print(f"\n{'':<44} {'cold':>17} {'warm':>17}")
+    for name, entry in report["interactions"].items():
+        old = baseline["interactions"].get(name)
+        if old is None:
+            continue
+        cells = []
+        for kind in ("cold", "warm"):
+            ratio = entry[kind]["best_seconds"] / old[kind]["best_seconds"] if old[kind]["best_seconds"] else float("inf")
+            cells.append(f"{old[kind]['best_seconds']:6.2f} -> {ratio:5.2f}x")
+        print(f"{name:<44} {cells[0]:>17} {cells[1]:>17}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time headless page reruns per interaction.")
+    parser.add_argument("--range-days", type=int, default=30, help="start date the date-range step switches to")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds a single page run may take")
+    parser.add_argument("--pages", nargs="+", choices=PAGES, default=list(PAGES))
+    parser.add_argument("--schema", default=SCHEMA)
+    parser.add_argument("--api-url", help="fetch_aggregated_data URL of a running API; default starts one in-process")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--dsn", help="defaults to the url in .streamlit/secrets.toml")
+    args = parser.parse_args()
+
+    dsn = bench_dsn(args.dsn or st.secrets["url"], args.schema)
+    # db_pool and main connect through KPI_DATABASE_URL; config.json and
+    # render profiles are relative to the working directory
+    os.environ["KPI_DATABASE_URL"] = dsn
+    output, baseline = [os.path.abspath(path) if path else None for path in (args.output, args.baseline)]
+    os.chdir(REPO)
+
+    info = dataset_info(dsn)
+    end_date = datetime.fromisoformat(info["generated_at"]).date()
+    start_date = end_date - timedelta(days=args.range_days)
+
+    server = None
+    api_url, clear_api_cache = args.api_url, lambda: None
+    if api_url is None and "pages/2_orders_kpi.py" in args.pages:
+        api_url, server, clear_api_cache = start_api()
+
+    print(f"{info['orders']:,} orders, date range step from {start_date}, best of {args.repeat}")
+    runs = PageRuns(dsn, api_url, args.timeout, args.repeat, clear_api_cache)
+    try:
+        for page in args.pages:
+            runs.run_page(page, start_date)
+    finally:
+        if server is not None:
+            server.should_exit = True
+
+    report = {
+        "commit": git_commit(),
+        "dataset": info,
+        "range_days": args.range_days,
+        "repeat": args.repeat,
+        "ran_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "interactions": runs.results,
+    }
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+            file.write("\n")
+    if baseline:
+        with open(baseline) as file:
+            compare(report, json.load(file))
@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+import asyncpg
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_indexes
+import payments_sync
+import rollups
+import user_firsts
+
+# Generates a synthetic, ChipChip-shaped dataset for benchmarking: the source
+# tables the pages and the API query, sized from a number of orders, plus
+# the derived tables (payments lookup, user firsts, rollups) and indexes the
+# app expects. Everything goes into its own schema (kpi_bench by default),
+# which is dropped and recreated, so it can share a database with real data;
+# bench_dsn() gives a DSN whose search_path points at it.
+#
+# Row ids are derived from the row number and the random values come from a
+# seeded generator, so the same --orders and --seed give the same data
+# (dates are relative to the day it is generated).
+#
+#   python benchmarks/synthetic_dataset.py [--orders 1m] [--days 365] [--dsn postgresql://...]
+
+SCHEMA = "kpi_bench"
+SCALES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+TABLES_SQL = """
+CREATE TABLE vendors (id uuid, name text, created_at timestamp);
+CREATE TABLE categories (id uuid, name text, short_description text, long_description text);
+CREATE TABLE product_names (id uuid, category_id uuid, name text, measuring_unit text);
+CREATE TABLE products (id uuid, vendor_id uuid, name_id uuid, stock_alert int, weight numeric);
+CREATE TABLE single_deals (id uuid, product_id uuid, original_price numeric);
+CREATE TABLE group_deals (id uuid, product_id uuid, group_price numeric, max_group_member int, lead_time text,
+                          created_at timestamp);
+CREATE TABLE users (id uuid, name text, phone text, user_status text, gender text, user_birthday date,
+                    created_at timestamp);
+CREATE TABLE devices (id uuid, user_id uuid, os text, created_at timestamp);
+CREATE TABLE groups (id uuid, group_deals_id uuid, created_by uuid, status text, created_at timestamp,
+                     updated_at timestamp);
+CREATE TABLE groups_carts (id uuid, group_id uuid, user_id uuid, quantity int, status text, created_at timestamp,
+                           deleted_at timestamp);
+CREATE TABLE carts (id uuid, user_id uuid);
+CREATE TABLE personal_cart_items (id uuid, cart_id uuid, product_id uuid, quantity int);
+CREATE TABLE delivery_location (id uuid, name text, location point);
+CREATE TABLE orders (id uuid, groups_carts_id uuid, personal_cart_id uuid, total_amount numeric, discount numeric,
+                     discount_type text, discount_rule_id uuid, payment_method text, status text, response text,
+                     location_id uuid, created_at timestamp, updated_at timestamp, deleted_at timestamp);
+CREATE TABLE drivers (id uuid, user_id uuid);
+CREATE TABLE vehicles (id uuid, driver_id uuid, size numeric);
+CREATE TABLE routes (id uuid, start_time timestamp, distance numeric, location_ids text, weight numeric);
+CREATE TABLE driver_rating (id uuid, route_id uuid, rating numeric);
+CREATE TABLE delivery_tracks (id uuid, group_cart_id uuid, personal_cart_id uuid, route_id uuid, driver_id uuid,
+                              status text, return_reason text, created_at timestamp, assigned timestamp,
+                              in_transit timestamp, delivered timestamp);
+CREATE TABLE product_ratings (id uuid, product_id uuid, rating int, created_at timestamp, deleted_at timestamp);
+CREATE TABLE dataset_info (orders bigint, days int, seed float8, generated_at timestamptz DEFAULT now());
+"""
+
+# Id prefix per table (discount_rules only appears as orders.discount_rule_id)
+TABLE_NUMBERS = {
+    "vendors": 1, "categories": 2, "product_names": 3, "products": 4, "single_deals": 5, "group_deals": 6,
+    "users": 7, "devices": 8, "groups": 9, "groups_carts": 10, "carts": 11, "personal_cart_items": 12,
+    "delivery_location": 13, "orders": 14, "drivers": 15, "vehicles": 16, "routes": 17, "driver_rating": 18,
+    "delivery_tracks": 19, "product_ratings": 20, "order_payment_methods": 21, "discount_rules": 22,
+}
+
+def uid(table, row):
+    return f"('{TABLE_NUMBERS[table]:08x}' || lpad(to_hex({row}), 24, '0'))::uuid"
+
+def pick(table, count):
+    # A random row id of a table with `count` rows
+    return uid(table, f"1 + floor(random() * {count})::bigint")
+
+def scale_counts(orders):
+    group_orders = orders * 7 // 10
+    return {
+        "orders": orders,
+        "vendors": max(10, orders // 50_000),
+        "categories": 12,
+        "products": max(50, min(5_000, orders // 2_000)),
+        "users": max(500, orders // 5),
+        "groups_carts": group_orders,
+        "groups": max(1, group_orders // 3),
+        "delivery_location": max(200, orders // 1_000),
+        "drivers": max(10, orders // 20_000),
+        "routes": max(100, orders // 15),
+        "product_ratings": max(100, orders // 5),
+    }
+
+def load_statements(c, days):
+    # One INSERT ... SELECT per table; `span` is the generated date range.
+    start = f"(CURRENT_DATE - {days})::timestamp"
+    span = f"random() * interval '{days} days'"
+    deals = c["products"] * 4
+    return [
+        ("vendors", f"""
+            INSERT INTO vendors
+            SELECT {uid('vendors', 'i')}, 'Vendor ' || i, {start} - interval '30 days'
+            FROM generate_series(1, {c['vendors']}) i"""),
+        ("categories", f"""
+            INSERT INTO categories
+            SELECT {uid('categories', 'i')}, 'Category ' || i, 'Short description ' || i, 'Long description ' || i
+            FROM generate_series(1, {c['categories']}) i"""),
+        ("product_names", f"""
+            INSERT INTO product_names
+            SELECT {uid('product_names', 'i')}, {uid('categories', f"1 + mod(i, {c['categories']})")},
+                   'Product ' || i, (ARRAY['kg', 'piece', 'litre'])[1 + mod(i, 3)]
+            FROM generate_series(1, {c['products']}) i"""),
+        ("products", f"""
+            INSERT INTO products
+            SELECT {uid('products', 'i')}, {uid('vendors', f"1 + mod(i * 7, {c['vendors']})")},
+                   {uid('product_names', 'i')}, 5 + mod(i, 20), round((0.5 + random() * 20)::numeric, 2)
+            FROM generate_series(1, {c['products']}) i"""),
+        ("single_deals", f"""
+            INSERT INTO single_deals
+            SELECT {uid('single_deals', 'i')}, {uid('products', 'i')}, round((20 + random() * 480)::numeric, 2)
+            FROM generate_series(1, {c['products']}) i"""),
+        ("group_deals", f"""
+            INSERT INTO group_deals
+            SELECT {uid('group_deals', 'i')}, {uid('products', f"1 + mod(i - 1, {c['products']})")},
+                   round((15 + random() * 400)::numeric, 2), 2 + mod(i, 6),
+                   (ARRAY['24h', '48h', '72h'])[1 + mod(i, 3)], {start} + {span}
+            FROM generate_series(1, {deals}) i"""),
+        ("users", f"""
+            INSERT INTO users
+            SELECT {uid('users', 'i')}, 'User ' || i, '+2519' || lpad(i::text, 8, '0'),
+                   CASE WHEN r < 0.9 THEN 'VERIFIED' ELSE 'PENDING' END,
+                   CASE WHEN random() < 0.55 THEN 'MALE' ELSE 'FEMALE' END,
+                   DATE '1965-01-01' + floor(random() * 14000)::int, {start} + {span}
+            FROM (SELECT i, random() AS r FROM generate_series(1, {c['users']}) i) s"""),
+        ("devices", f"""
+            INSERT INTO devices
+            SELECT {uid('devices', 'i')}, {uid('users', 'i')},
+                   CASE WHEN random() < 0.8 THEN 'ANDROID' ELSE 'IOS' END, {start} + {span}
+            FROM generate_series(1, {c['users']}) i"""),
+        ("groups", f"""
+            INSERT INTO groups
+            SELECT {uid('groups', 'i')}, {pick('group_deals', deals)}, {pick('users', c['users'])},
+                   CASE WHEN r < 0.65 THEN 'COMPLETED' WHEN r < 0.9 THEN 'FAILED' ELSE 'ACTIVE' END,
+                   created_at, created_at + random() * interval '48 hours'
+            FROM (SELECT i, random() AS r, {start} + {span} AS created_at
+                  FROM generate_series(1, {c['groups']}) i) s"""),
+        # Cart i joins group 1 + (i - 1) mod groups; the first cart of each
+        # group belongs to its leader.
+        ("groups_carts", f"""
+            INSERT INTO groups_carts
+            SELECT {uid('groups_carts', 'i')}, g.id,
+                   CASE WHEN i <= {c['groups']} THEN g.created_by ELSE {pick('users', c['users'])} END,
+                   1 + floor(random() * 4)::int, 'COMPLETED',
+                   g.created_at + CASE WHEN i <= {c['groups']} THEN interval '0' ELSE random() * interval '24 hours' END,
+                   CASE WHEN random() < 0.01 THEN g.updated_at END
+            FROM generate_series(1, {c['groups_carts']}) i
+            JOIN groups g ON g.id = {uid('groups', f"1 + mod(i - 1, {c['groups']})")}"""),
+        ("carts", f"""
+            INSERT INTO carts
+            SELECT {uid('carts', 'i')}, {uid('users', 'i')}
+            FROM generate_series(1, {c['users']}) i"""),
+        ("personal_cart_items", f"""
+            INSERT INTO personal_cart_items
+            SELECT {uid('personal_cart_items', 'i')}, {uid('carts', f"1 + mod(i - 1, {c['users']})")},
+                   {pick('products', c['products'])}, 1 + floor(random() * 5)::int
+            FROM generate_series(1, {c['users'] * 2}) i"""),
+        ("delivery_location", f"""
+            INSERT INTO delivery_location
+            SELECT {uid('delivery_location', 'i')}, 'Location ' || i,
+                   point(38.70 + random() * 0.15, 8.95 + random() * 0.12)
+            FROM generate_series(1, {c['delivery_location']}) i"""),
+        # Group orders first (one per group cart), then personal orders
+        ("orders", f"""
+            INSERT INTO orders
+            SELECT {uid('orders', 'i')}, gc.id, NULL, round((50 + random() * 1950)::numeric, 2),
+                   CASE WHEN d THEN round((10 + random() * 90)::numeric, 2) ELSE 0 END,
+                   CASE WHEN d THEN 'FIXED' END, CASE WHEN d THEN {uid('discount_rules', '1')} END,
+                   (ARRAY['CASH', 'TELEBIRR', 'CHAPA'])[1 + floor(random() * 3)::int],
+                   CASE WHEN r < 0.85 THEN 'COMPLETED' WHEN r < 0.95 THEN 'PENDING' ELSE 'CANCELED' END,
+                   NULL, {pick('delivery_location', c['delivery_location'])},
+                   gc.created_at, gc.created_at + interval '1 hour', CASE WHEN r > 0.995 THEN gc.created_at END
+            FROM (SELECT i, random() AS r, random() < 0.2 AS d FROM generate_series(1, {c['groups_carts']}) i) s
+            JOIN groups_carts gc ON gc.id = {uid('groups_carts', 'i')};
+            INSERT INTO orders
+            SELECT {uid('orders', 'i')}, NULL, {pick('carts', c['users'])}, round((50 + random() * 1950)::numeric, 2),
+                   0, NULL, NULL, (ARRAY['CASH', 'TELEBIRR', 'CHAPA'])[1 + floor(random() * 3)::int],
+                   CASE WHEN r < 0.85 THEN 'COMPLETED' WHEN r < 0.95 THEN 'PENDING' ELSE 'CANCELED' END,
+                   NULL, {pick('delivery_location', c['delivery_location'])},
+                   created_at, created_at + interval '1 hour', NULL
+            FROM (SELECT i, random() AS r, {start} + {span} AS created_at
+                  FROM generate_series({c['groups_carts'] + 1}, {c['orders']}) i) s"""),
+        ("drivers", f"""
+            INSERT INTO drivers
+            SELECT {uid('drivers', 'i')}, {uid('users', 'i')}
+            FROM generate_series(1, {c['drivers']}) i"""),
+        ("vehicles", f"""
+            INSERT INTO vehicles
+            SELECT {uid('vehicles', 'i')}, {uid('drivers', 'i')}, (ARRAY[500, 1000, 3000])[1 + mod(i, 3)]
+            FROM generate_series(1, {c['drivers']}) i"""),
+        ("routes", f"""
+            INSERT INTO routes
+            SELECT {uid('routes', 'i')}, {start} + {span}, round((5 + random() * 75)::numeric, 2),
+                   (SELECT jsonb_agg(k)::text FROM generate_series(1, 1 + mod(i, 8)) k),
+                   round((50 + random() * 1950)::numeric, 2)
+            FROM generate_series(1, {c['routes']}) i"""),
+        ("driver_rating", f"""
+            INSERT INTO driver_rating
+            SELECT {uid('driver_rating', 'i')}, {uid('routes', 'i')}, 1 + floor(random() * 5)
+            FROM generate_series(1, {c['routes']}) i"""),
+        # About 90% of orders get a delivery track
+        ("delivery_tracks", f"""
+            INSERT INTO delivery_tracks
+            SELECT {uid('delivery_tracks', 'i')}, o.groups_carts_id, o.personal_cart_id,
+                   {pick('routes', c['routes'])}, {pick('drivers', c['drivers'])}, t.status,
+                   CASE WHEN t.status = 'RETURNED'
+                        THEN (ARRAY['Customer not available', 'Wrong address', 'Damaged'])[1 + floor(random() * 3)::int]
+                   END,
+                   o.created_at + interval '1 hour',
+                   CASE WHEN t.status <> 'PENDING' THEN o.created_at + interval '2 hours' END,
+                   CASE WHEN t.status IN ('IN_TRANSIT', 'DELIVERED', 'RETURNED') THEN o.created_at + interval '4 hours' END,
+                   CASE WHEN t.status IN ('DELIVERED', 'RETURNED')
+                        THEN o.created_at + interval '5 hours' + random() * interval '150 hours' END
+            FROM (SELECT i, CASE WHEN r < 0.75 THEN 'DELIVERED' WHEN r < 0.83 THEN 'RETURNED'
+                                 WHEN r < 0.88 THEN 'REJECTED_BY_VENDOR' WHEN r < 0.95 THEN 'IN_TRANSIT'
+                                 ELSE 'PENDING' END AS status
+                  FROM (SELECT i, random() AS r FROM generate_series(1, {c['orders']}) i) s
+                  WHERE random() < 0.9) t
+            JOIN orders o ON o.id = {uid('orders', 'i')}"""),
+        ("product_ratings", f"""
+            INSERT INTO product_ratings
+            SELECT {uid('product_ratings', 'i')}, {pick('products', c['products'])}, 1 + floor(random() * 5)::int,
+                   created_at, CASE WHEN random() < 0.03 THEN created_at + interval '1 day' END
+            FROM (SELECT i, {start} + {span} AS created_at FROM generate_series(1, {c['product_ratings']}) i) s"""),
+        # The local payments lookup that payments_sync.py normally fills over
+        # dblink: one completed transaction for about 60% of the orders
+        ("order_payment_methods", f"""
+            INSERT INTO order_payment_methods (transaction_id, order_id, status, name, updated_at)
+            SELECT {uid('order_payment_methods', 'i')}::text, o.id::text,
+                   CASE WHEN random() < 0.95 THEN 'COMPLETED' ELSE 'FAILED' END,
+                   (ARRAY['TELEBIRR', 'CHAPA', 'CBE Birr'])[1 + floor(random() * 3)::int], o.updated_at
+            FROM generate_series(1, {c['orders']}) i
+            JOIN orders o ON o.id = {uid('orders', 'i')}
+            WHERE random() < 0.6"""),
+    ]
+
+def bench_dsn(dsn, schema=SCHEMA):
+    # Same server and database, with the dataset's schema as search_path.
+    # Works for both psycopg2 and asyncpg, which take the DSN in URL form.
+    parts = urlsplit(dsn)
+    if parts.scheme not in ("postgres", "postgresql"):
+        raise ValueError("expected a postgresql:// URL")
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "options"]
+    query.append(("options", f"-c search_path={schema}"))
+    return urlunsplit(parts._replace(query=urlencode(query, quote_via=quote)))
+
+async def build_derived_tables(dsn):
+    pool = await asyncpg.create_pool(dsn=dsn, min_size=1, max_size=2)
+    try:
+        await user_firsts.ensure_schema(pool)
+        await rollups.ensure_schema(pool)
+        # No watermark yet, so both build everything
+        await user_firsts.refresh_user_firsts(pool)
+        await rollups.refresh_rollups(pool)
+    finally:
+        await pool.close()
+
+def generate(dsn, orders, days=365, seed=0.42, schema=SCHEMA, log=print):
+    counts = scale_counts(orders)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {schema}")
+            cur.execute(f"SET search_path = {schema}")
+            cur.execute(TABLES_SQL)
+            cur.execute(payments_sync.SCHEMA_SQL)
+            # random() is only reproducible from one seed in a single process
+            cur.execute("SET max_parallel_workers_per_gather = 0")
+            cur.execute("SELECT setseed(%s)", (seed,))
+            for table, sql in load_statements(counts, days):
+                began = time.perf_counter()
+                for statement in sql.split(";\n"):
+                    cur.execute(statement)
+                if table != "order_payment_methods":
+                    cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id)")
+                log(f"{table:<22} {time.perf_counter() - began:7.1f} s")
+            cur.execute("INSERT INTO dataset_info (orders, days, seed) VALUES (%s, %s, %s)", (orders, days, seed))
+        conn.commit()
+
+        began = time.perf_counter()
+        db_indexes.create_indexes(conn)
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+        log(f"{'indexes':<22} {time.perf_counter() - began:7.1f} s")
+    finally:
+        conn.close()
+
+    began = time.perf_counter()
+    asyncio.run(build_derived_tables(bench_dsn(dsn, schema)))
+    log(f"{'derived tables':<22} {time.perf_counter() - began:7.1f} s")
+    return counts
+
+def parse_orders(value):
+    return SCALES.get(value.lower()) or int(value)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the synthetic benchmark dataset.")
+    parser.add_argument("--orders", type=parse_orders, default="10k",
+                        help="number of orders, or one of " + ", ".join(SCALES))
+    parser.add_argument("--days", type=int, default=365, help="days of history, ending today")
+    parser.add_argument("--seed", type=float, default=0.42)
+    parser.add_argument("--schema", default=SCHEMA)
+    parser.add_argument("--dsn", help="defaults to the url in .streamlit/secrets.toml")
+    args = parser.parse_args()
+
+    if args.dsn:
+        dsn = args.dsn
+    else:
+        import streamlit as st
+        dsn = st.secrets["url"]
+
+    print(f"{args.orders:,} orders over {args.days} days into schema {args.schema}")
+    generate(dsn, args.orders, args.days, args.seed, args.schema)
+    print(f"KPI_DATABASE_URL={bench_dsn(dsn, args.schema)}")
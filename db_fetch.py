@@ -0,0 +1,120 @@
+import io
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from psycopg2 import extensions
+from pyarrow import csv
+
+# Loading a result with cur.fetchall() and then pd.DataFrame(rows) holds the
+# full list of row tuples and the finished frame at the same time.
+# fetch_frame streams the result through a server-side (named) cursor
+# instead. Each batch of ITERSIZE rows becomes typed column arrays, and the
+# batch's tuples are freed before the next one is fetched, so peak memory
+# stays close to the size of the final frame.
+
+ITERSIZE = 10_000
+
+def _combine(pieces) -> pd.Series:
+    if len({piece.dtype for piece in pieces}) == 1:
+        return pd.concat(pieces, ignore_index=True)
+    # Typed differently between batches (e.g. all NULL in one of them):
+    # re-infer over all of the values, as a single DataFrame(rows) would.
+    return pd.Series(np.concatenate([piece.to_numpy(dtype=object) for piece in pieces])).infer_objects()
+
+def fetch_frame(conn, query, params=None, itersize=ITERSIZE) -> pd.DataFrame:
+    # The query must be a single SELECT; it runs as DECLARE ... CURSOR FOR
+    # inside the connection's current transaction.
+    with conn.cursor() as cur:
+        # Cursors are planned for fetching only the first 10% of rows by
+        # default; every row is read here, so plan as a plain query would.
+        cur.execute("SET LOCAL cursor_tuple_fraction = 1.0")
+    with conn.cursor(name=f"fetch_{uuid.uuid4().hex}") as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        columns = None
+        pieces = []
+        while True:
+            rows = cur.fetchmany(cur.itersize)
+            if columns is None:
+                # Only known once the first batch has been fetched
+                columns = [desc[0] for desc in cur.description]
+            if not rows:
+                break
+            batch = pd.DataFrame.from_records(rows, columns=range(len(columns)))
+            del rows
+            pieces.append([batch[i] for i in range(len(columns))])
+
+    if not pieces:
+        return pd.DataFrame(columns=columns)
+    if len(pieces) == 1:
+        frame = pd.concat(pieces[0], axis=1)
+        frame.columns = columns
+        return frame
+
+    data = {}
+    for i, column in enumerate(columns):
+        column_pieces = [batch.pop(0) for batch in pieces]
+        data[i] = _combine(column_pieces)
+    frame = pd.DataFrame(data, copy=False)
+    frame.columns = columns
+    return frame
+
+# copy_frame skips the per-row tuple protocol altogether: the result is
+# sent with COPY (query) TO STDOUT as CSV into a memory buffer and parsed by
+# Arrow's multi-threaded CSV reader. Column types come from a LIMIT 0 probe
+# of the same query; NUMERIC arrives as float64 rather than Decimal objects,
+# and types without an Arrow equivalent (uuid, intervals, ...) stay text.
+
+COPY_NULL = r"\N"
+
+ARROW_TYPES = {
+    16: pa.bool_(),                 # bool
+    20: pa.int64(),                 # int8
+    21: pa.int64(),                 # int2
+    23: pa.int64(),                 # int4
+    700: pa.float64(),              # float4
+    701: pa.float64(),              # float8
+    1700: pa.float64(),             # numeric
+    1082: pa.date32(),              # date
+    1114: pa.timestamp("us"),       # timestamp
+}
+TIMESTAMPTZ_TYPE = 1184
+
+def copy_frame(conn, query, params=None) -> pd.DataFrame:
+    query = query.strip().rstrip(";")
+    with conn.cursor() as cur:
+        # COPY takes no bind parameters, so they are interpolated client-side
+        query = cur.mogrify(query, params).decode(extensions.encodings[conn.encoding])
+        cur.execute(f"SELECT * FROM ({query}\n) AS q LIMIT 0")
+        columns = [desc[0] for desc in cur.description]
+        types = [desc[1] for desc in cur.description]
+
+        buffer = io.BytesIO()
+        cur.copy_expert(f"COPY ({query}\n) TO STDOUT WITH (FORMAT csv, NULL '{COPY_NULL}')", buffer)
+    if not buffer.getbuffer().nbytes:
+        return pd.DataFrame(columns=columns)
+    buffer.seek(0)
+
+    # Positional names, since a result may repeat a column name
+    names = [str(i) for i in range(len(columns))]
+    table = csv.read_csv(
+        buffer,
+        read_options=csv.ReadOptions(column_names=names),
+        convert_options=csv.ConvertOptions(
+            column_types={name: ARROW_TYPES.get(oid, pa.string()) for name, oid in zip(names, types)},
+            null_values=[COPY_NULL],
+            strings_can_be_null=True,
+            true_values=["t"],
+            false_values=["f"],
+        ),
+    )
+    del buffer
+    # Dates as datetime.date objects and nanosecond timestamps, as fetchall gives
+    frame = table.to_pandas(date_as_object=True, coerce_temporal_nanoseconds=True)
+    for name, oid in zip(names, types):
+        if oid == TIMESTAMPTZ_TYPE:
+            frame[name] = pd.to_datetime(frame[name], format="ISO8601", utc=True)
+    frame.columns = columns
+    return frame
@@ -0,0 +1,188 @@
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+
+import psycopg2
+import streamlit as st
+
+# Indexes behind the dashboard's date-range filters (see sql_filters.date_range),
+# the rollup refreshes, which filter the same source columns by day, and the
+# per-user lookups in user_firsts.py.
+#
+#   python db_indexes.py migrate   create any missing index (CONCURRENTLY)
+#   python db_indexes.py check     run the pages' fetch functions and the API
+#                                  queries over the last --days days, EXPLAIN
+#                                  every SELECT they send; exit 1 if any date
+#                                  filter falls back to a full scan
+INDEXES = [
+    ("orders_status_created_at_idx", "orders", "status, created_at"),
+    ("delivery_tracks_created_at_idx", "delivery_tracks", "created_at"),
+    ("delivery_tracks_assigned_idx", "delivery_tracks", "assigned"),
+    ("delivery_tracks_in_transit_idx", "delivery_tracks", "in_transit"),
+    ("delivery_tracks_driver_id_in_transit_idx", "delivery_tracks", "driver_id, in_transit"),
+    ("routes_start_time_idx", "routes", "start_time"),
+    ("groups_created_at_idx", "groups", "created_at"),
+    ("groups_status_created_at_idx", "groups", "status, created_at"),
+    ("groups_carts_created_at_idx", "groups_carts", "created_at"),
+    # Per-user lookups when user_firsts.py recomputes a user's firsts
+    ("groups_carts_user_id_created_at_idx", "groups_carts", "user_id, created_at"),
+    ("groups_created_by_created_at_idx", "groups", "created_by, created_at"),
+    ("orders_groups_carts_id_idx", "orders", "groups_carts_id"),
+    ("product_ratings_created_at_idx", "product_ratings", "created_at"),
+    ("users_created_at_idx", "users", "created_at"),
+    ("devices_created_at_idx", "devices", "created_at"),
+]
+
+# Columns with an index, per table. A full scan that filters one of them by
+# range (or driver_id = ANY) is a dashboard filter that missed its index;
+# a full scan without such a filter is a read that needs every row anyway.
+INDEXED_COLUMNS = {}
+for _name, _table, _columns in INDEXES:
+    INDEXED_COLUMNS.setdefault(_table, set()).update(column.strip() for column in _columns.split(","))
+
+# What db_fetch wraps a page query in; the check EXPLAINs the query itself.
+WRAPPERS = [
+    re.compile(r"^DECLARE\s+\S+\s+CURSOR\s.*?\bFOR\s+(.*)$", re.S),
+    re.compile(r"^COPY \((.*)\n\) TO STDOUT .*$", re.S),
+    re.compile(r"^SELECT \* FROM \((.*)\n\) AS q LIMIT 0$", re.S),
+]
+
+def create_indexes(conn):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for name, table, columns in INDEXES:
+            print(f"{name} on {table} ({columns})")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+
+def full_scans(plan):
+    # (table, node type, filter) of the scans in an EXPLAIN (FORMAT JSON)
+    # plan that read the whole table, a Seq Scan or an index scan without an
+    # Index Cond (with seq scans off, the planner walks the primary key
+    # instead), while filtering an indexed column by range.
+    found = []
+    table = plan.get("Relation Name")
+    node = plan.get("Node Type")
+    full = node == "Seq Scan" or node in ("Index Scan", "Index Only Scan") and "Index Cond" not in plan
+    if full and table in INDEXED_COLUMNS:
+        condition = plan.get("Filter", "")
+        for column in INDEXED_COLUMNS[table]:
+            if re.search(rf"\b{column}\)?(?:::[\w ]+?)?\s*(?:>=|<=|<|>|= ANY)", condition):
+                found.append((table, node, condition))
+                break
+    for child in plan.get("Plans", []):
+        found.extend(full_scans(child))
+    return found
+
+def unwrap(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8")
+    query = query.strip().rstrip(";")
+    for wrapper in WRAPPERS:
+        match = wrapper.match(query)
+        if match:
+            return match.group(1).strip()
+    return query
+
+def page_statements(dsn, start_date, end_date):
+    # Runs every fetch function of the dashboard once, as benchmarks/fetch_suite.py
+    # does, and returns the distinct reads they sent, with their parameters
+    # bound: (fetch function, PREPARE it needs or None, SELECT or EXECUTE).
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+    import fetch_suite
+    import query_metrics
+
+    os.environ["KPI_DATABASE_URL"] = dsn
+    query_metrics.statement_log = []
+    try:
+        fetch_suite.run_benchmarks(fetch_suite.Suite(1), fetch_suite.Run(dsn, start_date, end_date),
+                                   list(fetch_suite.BENCHMARKS))
+        log = query_metrics.statement_log
+    finally:
+        query_metrics.statement_log = None
+    prepared = {}
+    statements = {}
+    for source, query in log:
+        query = unwrap(query)
+        keyword, name = (query.split(None, 2) + ["", ""])[:2]
+        keyword = keyword.upper()
+        if keyword == "PREPARE":
+            prepared[name] = query
+        elif keyword in ("SELECT", "WITH") or keyword == "EXECUTE" and name in prepared:
+            setup = prepared[name] if keyword == "EXECUTE" else None
+            statements.setdefault((source, query_metrics.fingerprint(query)[0]), (setup, query))
+    return [(f"{source}:{key}", setup, query) for (source, key), (setup, query) in statements.items()]
+
+def api_statements(start_date, end_date):
+    # main.load_frames' queries as they read the source tables when the
+    # rollups are stale (the rollup refreshes filter the same columns by
+    # day), prepared as asyncpg runs them with $1/$2.
+    import main
+
+    return [(f"main.load_frames:{name}", f"PREPARE plan_check AS {query.strip().rstrip(';')}",
+             f"EXECUTE plan_check ('{start_date}', '{end_date}')")
+            for name, query in main.build_queries(set(), start_date, end_date).items()]
+
+def check_plans(dsn, days=7):
+    end_date = datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=days)
+    statements = page_statements(dsn, start_date, end_date) + api_statements(start_date, end_date)
+    print(f"\nEXPLAIN {len(statements)} statements, {start_date} to {end_date}")
+
+    failures = []
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            # With seq scans priced out, the planner only picks one when no
+            # index can serve the filter, so the check does not depend on
+            # table sizes.
+            cur.execute("SET LOCAL enable_seqscan = off")
+            for name, setup, query in statements:
+                cur.execute("SAVEPOINT plan_check")
+                try:
+                    if setup:
+                        cur.execute(setup)
+                    cur.execute(f"EXPLAIN (FORMAT JSON) {query}")
+                    plan = cur.fetchone()[0]
+                except psycopg2.Error as e:
+                    failures.append(name)
+                    print(f"FAIL {name}: {str(e).strip()}")
+                    continue
+                finally:
+                    # Also drops the PREPARE, which a rollback does not
+                    cur.execute("ROLLBACK TO SAVEPOINT plan_check")
+                    cur.execute("DEALLOCATE ALL")
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scans = full_scans(plan[0]["Plan"])
+                if scans:
+                    failures.append(name)
+                    for table, node, condition in scans:
+                        print(f"FAIL {name}: {node} over all of {table}, Filter: {condition}")
+                else:
+                    print(f"ok   {name}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or check the dashboard indexes.")
+    parser.add_argument("command", choices=["migrate", "check"])
+    parser.add_argument("--days", type=int, default=7, help="date range the check fetches, ending today")
+    parser.add_argument("--dsn", help="defaults to the url in .streamlit/secrets.toml")
+    args = parser.parse_args()
+
+    dsn = args.dsn or st.secrets["url"]
+    if args.command == "check":
+        if check_plans(dsn, args.days):
+            sys.exit(1)
+    else:
+        conn = psycopg2.connect(dsn)
+        try:
+            create_indexes(conn)
+        finally:
+            conn.close()
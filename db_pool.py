@@ -1,18 +1,257 @@
-# db_pool.py
+import os
+import threading
+import time
+from collections import deque
+
 import psycopg2
-from psycopg2 import pool
+from psycopg2 import extensions, pool
 import streamlit as st
 
-# Initialize connection pool with a maximum of 4 connections
+import derived_tables
+from query_metrics import InstrumentedCursor, cache_data, caller_source, query_stats, SNAPSHOT_FILE
+
+
+class PoolTimeout(pool.PoolError):
+    pass
+
+
+class BoundedConnectionPool:
+    """Thread-safe psycopg2 pool with a hard upper bound.
+
+    Callers that find the pool exhausted wait (up to ``timeout`` seconds) for a
+    connection to be returned instead of failing immediately. Idle connections
+    are health-checked before reuse and recycled once they exceed
+    ``max_lifetime``.
+    """
+
+    def __init__(self, minconn, maxconn, dsn, timeout=30.0, max_idle=300.0,
+                 max_lifetime=1800.0, health_check_after=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("expected 0 <= minconn <= maxconn and maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.dsn = dsn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()      # (conn, created_at, idle_since)
+        self._in_use = {}         # id(conn) -> (conn, created_at)
+        self._opening = 0
+        self._closed = False
+
+        self._waiters = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._created = 0
+        self._recycled = 0
+        self._health_check_failures = 0
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=InstrumentedCursor)
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _is_usable(self, conn, created_at, idle_since):
+        now = time.monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if now - idle_since < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._health_check_failures += 1
+            return False
+
+    def _discard(self, conn):
+        self._recycled += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _record_wait(self, started):
+        waited = time.monotonic() - started
+        self._checkouts += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            candidate = None
+            open_new = False
+            with self._cond:
+                if self._closed:
+                    raise pool.PoolError("connection pool is closed")
+                while not self._idle and self._size() >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"no connection available within {timeout:.1f}s "
+                            f"({len(self._in_use)} in use, max {self.maxconn})"
+                        )
+                    self._waiters += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiters -= 1
+
+                if self._idle:
+                    # LIFO keeps the warmest connections in rotation and lets
+                    # surplus ones age out.
+                    candidate = self._idle.pop()
+                    self._in_use[id(candidate[0])] = (candidate[0], candidate[1])
+                else:
+                    self._opening += 1
+                    open_new = True
+
+            if open_new:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._opening -= 1
+                    self._in_use[id(conn)] = (conn, time.monotonic())
+                    self._record_wait(started)
+                return conn
+
+            # Health check outside the lock so a slow server does not block
+            # every other checkout.
+            conn, created_at, idle_since = candidate
+            if self._is_usable(conn, created_at, idle_since):
+                with self._cond:
+                    self._record_wait(started)
+                return conn
+
+            with self._cond:
+                self._in_use.pop(id(conn), None)
+                self._discard(conn)
+                self._cond.notify()
+
+    def putconn(self, conn, close=False):
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+            if entry is None:
+                raise pool.PoolError("trying to put unkeyed connection")
+            created_at = entry[1]
+            expired = time.monotonic() - created_at > self.max_lifetime
+
+            if close or conn.closed or expired or self._closed:
+                self._discard(conn)
+            else:
+                try:
+                    status = conn.info.transaction_status
+                    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                        self._discard(conn)
+                    else:
+                        if status != extensions.TRANSACTION_STATUS_IDLE:
+                            conn.rollback()
+                        self._idle.append((conn, created_at, time.monotonic()))
+                except psycopg2.Error:
+                    self._discard(conn)
+
+            self._prune_idle()
+            self._cond.notify()
+
+    def _prune_idle(self):
+        # Close connections that sat idle too long, but keep the floor warm.
+        now = time.monotonic()
+        while len(self._idle) > self.minconn and now - self._idle[0][2] > self.max_idle:
+            conn = self._idle.popleft()[0]
+            self._discard(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.popleft()[0])
+            for conn, _ in list(self._in_use.values()):
+                self._discard(conn)
+            self._in_use.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "size": self._size(),
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiters": self._waiters,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_seconds_total": self._wait_total,
+                "wait_seconds_max": self._wait_max,
+                "wait_seconds_avg": self._wait_total / self._checkouts if self._checkouts else 0.0,
+                "connections_created": self._created,
+                "connections_recycled": self._recycled,
+                "health_check_failures": self._health_check_failures,
+            }
+
+
+# How long page query results cached with @st.cache_data stay fresh; matches
+# the API's rollup refresh interval, so a cached page is never much staler
+# than the rollups it reads.
+QUERY_CACHE_TTL = 300
+
+def database_url():
+    # KPI_DATABASE_URL overrides the url in secrets.toml, e.g. to point the
+    # pages and the API at the synthetic benchmark dataset.
+    return os.environ.get("KPI_DATABASE_URL") or st.secrets["url"]
+
+# Pool sizing can be tuned under a [pool] table in secrets.toml; the defaults
+# match the previous fixed 1..4 pool.
 @st.cache_resource
 def get_connection_pool():
-    return pool.SimpleConnectionPool(1, 4, dsn=st.secrets["url"])
+    # secrets.toml may be absent altogether when KPI_DATABASE_URL is set
+    settings = st.secrets.get("pool", {}) if st.secrets.load_if_toml_exists() else {}
+    return BoundedConnectionPool(
+        int(settings.get("minconn", 1)),
+        int(settings.get("maxconn", 4)),
+        dsn=database_url(),
+        timeout=float(settings.get("timeout", 30)),
+        max_idle=float(settings.get("max_idle", 300)),
+        max_lifetime=float(settings.get("max_lifetime", 1800)),
+        health_check_after=float(settings.get("health_check_after", 30)),
+    )
 
 conn_pool = get_connection_pool()
 
+# The API reads the Streamlit process's query metrics from the snapshot file
+if st.runtime.exists():
+    query_stats.snapshot_file = SNAPSHOT_FILE
+
 def get_conn():
     try:
+        started = time.perf_counter()
         conn = conn_pool.getconn()
+        query_stats.record_pool_wait(caller_source(), time.perf_counter() - started)
         if conn:
             return conn
     except Exception as e:
@@ -26,4 +265,16 @@ def release_conn(conn):
     except Exception as e:
         st.error(f"Error releasing connection: {e}")
 
+def get_pool_stats():
+    return conn_pool.stats()
 
+# Derived tables (derived_tables.py) fresh enough for the pages to read;
+# looked up once a minute rather than before every query.
+@cache_data(ttl=60)
+def fresh_derived_tables():
+    conn = get_conn()
+    try:
+        return derived_tables.fresh_tables(conn) if conn else set()
+    finally:
+        if conn:
+            release_conn(conn)
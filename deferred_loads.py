@@ -0,0 +1,54 @@
+import copy
+
+import streamlit as st
+
+# Deferred loading for the pages whose report sits behind a Filter /
+# Generate Report button. The inputs that drive the queries live in a
+# sidebar form, so editing a date does not rerun the page at all; nothing
+# is queried until the form has been submitted once in the session. Every
+# submit runs the declared requests again through their cached functions,
+# so their TTLs apply; other reruns reuse the stored results as long as
+# the arguments are unchanged:
+#
+#     with st.sidebar.form("filters"):
+#         start_date = st.date_input("Start date", default_start_date)
+#         end_date = st.date_input("End date", datetime.today())
+#         submitted = st.form_submit_button("Filter")
+#     applied = filters_applied("4_users_kpi", submitted)
+#     if applied:
+#         user_kpis = load_requests("4_users_kpi", {
+#             "user_kpis": (get_user_kpis, start_date, end_date),
+#         }, submitted)["user_kpis"]
+#
+# Results are kept in session state, so reruns caused by widgets outside the
+# form (vendor selection, tabs, ...) reuse them without going through the
+# data caches or the database. A page left open only picks up new data on
+# the next submit.
+
+def _key(page, name):
+    return f"deferred_loads:{page}:{name}"
+
+def results_key(page):
+    # Session state key of a page's stored results
+    return _key(page, "results")
+
+def filters_applied(page, submitted):
+    # True from the first submit of the page's filter form on
+    if submitted:
+        st.session_state[_key(page, "applied")] = True
+    return st.session_state.get(_key(page, "applied"), False)
+
+def load_requests(page, requests, submitted=False):
+    # requests maps a name to (function, *args); returns name -> result.
+    # submitted: the filter form was just submitted, so call every function
+    # again instead of reusing what is stored
+    stored = st.session_state.setdefault(results_key(page), {})
+    results = {}
+    for name, (func, *args) in requests.items():
+        entry = stored.get(name)
+        if submitted or entry is None or entry[0] != args:
+            entry = stored[name] = (args, func(*args))
+        # The pages modify their frames in place, so each rerun gets a copy
+        # and the stored results stay as loaded
+        results[name] = copy.deepcopy(entry[1])
+    return results
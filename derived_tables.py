@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import json
+import logging
+
+import payments_sync
+import rollups
+import user_firsts
+
+logger = logging.getLogger(__name__)
+
+# The tables the dashboard derives from the source data: the local payment
+# methods (payments_sync.py), the per-user firsts (user_firsts.py) and the
+# daily rollups (rollups.py). The API keeps them fresh in the background;
+# wherever it is not running, refresh them on their own, e.g. from cron or
+# next to Streamlit:
+#
+#   python derived_tables.py              refresh once
+#   python derived_tables.py --loop       refresh every refresh_interval seconds
+#   python derived_tables.py --rebuild    rebuild every rollup from scratch and
+#                                         re-sync every payment transaction
+#
+# Advisory locks keep the API workers and a separate refresher from running
+# the same refresh twice.
+#
+# Readers never depend on a refresher being up: fresh_tables() tells which
+# derived tables were refreshed recently, and source() swaps any other one
+# for a subquery over the source tables.
+
+ROLLUPS = {rollup["table"]: rollup for rollup in rollups.ROLLUPS}
+
+# A derived table counts as stale once three refreshes in a row were missed.
+FRESH_SQL = """
+SELECT rollup FROM rollup_state
+WHERE refreshed_at > now() - make_interval(secs => {max_age})
+"""
+
+def load_config():
+    with open("config.json", "r") as file:
+        return json.load(file)
+
+def fresh_sql():
+    return FRESH_SQL.format(max_age=3 * load_config().get("refresh_interval", 300))
+
+async def ensure_schema(pool):
+    await payments_sync.ensure_schema(pool)
+    await user_firsts.ensure_schema(pool)
+    await rollups.ensure_schema(pool)
+
+async def refresh(pool, config, rebuild=False):
+    # Payments first: the order rollups join the synced payment methods.
+    try:
+        await payments_sync.sync_payment_methods(pool, config["dbname"], full=rebuild)
+    except Exception as e:
+        logger.error(f"Error syncing payment methods: {e}")
+    try:
+        await user_firsts.refresh_user_firsts(pool)
+    except Exception as e:
+        logger.error(f"Error refreshing user firsts: {e}")
+    try:
+        await rollups.refresh_rollups(
+            pool,
+            config.get("rollup_lookback_days", 2),
+            0 if rebuild else config.get("rollup_rebuild_interval", 86400),
+        )
+    except Exception as e:
+        logger.error(f"Error refreshing rollups: {e}")
+
+async def run_periodic(pool, config):
+    while True:
+        await refresh(pool, config)
+        await asyncio.sleep(config.get("refresh_interval", 300))
+
+def fresh_tables(conn) -> set:
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('rollup_state') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return set()
+        cur.execute(fresh_sql())
+        return {row[0] for row in cur.fetchall()}
+
+async def fresh_tables_async(conn) -> set:
+    if not await conn.fetchval("SELECT to_regclass('rollup_state') IS NOT NULL"):
+        return set()
+    return {row["rollup"] for row in await conn.fetch(fresh_sql())}
+
+def source(table, fresh, start_date=None, end_date=None) -> str:
+    # What a query should read a derived table from: the table itself while
+    # it is fresh, otherwise a subquery computing the same rows from the
+    # source tables (only the days start_date..end_date of a rollup, if given).
+    if table in fresh:
+        return table
+    logger.warning(f"{table} is missing or stale; reading it from the source tables.")
+    if table == "user_firsts":
+        return f"({user_firsts.ALL_FIRSTS_SQL})"
+    rollup = ROLLUPS[table]
+    days = "TRUE"
+    if start_date is not None:
+        column = rollup["day_source"]
+        days = f"({column} >= '{start_date:%Y-%m-%d}'::date AND {column} < '{end_date:%Y-%m-%d}'::date + 1)"
+    select = rollup["select"]
+    if "FROM user_firsts uf" in select:
+        # daily_group_stats reads the first group of each leader from user_firsts
+        select = select.replace("FROM user_firsts uf", f"FROM {source('user_firsts', fresh)} uf")
+    return f"({select.format(days=days)})"
+
+async def main(dsn, loop, rebuild):
+    import asyncpg
+
+    config = load_config()
+    pool = await asyncpg.create_pool(dsn=dsn, min_size=1, max_size=2)
+    try:
+        await ensure_schema(pool)
+        if loop:
+            await run_periodic(pool, config)
+        else:
+            await refresh(pool, config, rebuild)
+    finally:
+        await pool.close()
+
+if __name__ == "__main__":
+    import os
+
+    import streamlit as st
+
+    parser = argparse.ArgumentParser(description="Create and refresh the dashboard's derived tables.")
+    parser.add_argument("--loop", action="store_true", help="keep refreshing every refresh_interval seconds")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild every rollup from scratch and re-sync all payments")
+    parser.add_argument("--dsn", help="defaults to KPI_DATABASE_URL or the url in .streamlit/secrets.toml")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Same precedence as db_pool.database_url, without opening the page pool
+    dsn = args.dsn or os.environ.get("KPI_DATABASE_URL") or st.secrets["url"]
+    asyncio.run(main(dsn, args.loop, args.rebuild))
@@ -0,0 +1,49 @@
+import pandas as pd
+import streamlit as st
+
+from db_pool import get_pool_stats
+from query_metrics import query_stats
+
+# Query diagnostics for this Streamlit process. Not listed in the sidebar;
+# the root page renders it instead of the vendor KPIs when opened as
+# /?diagnostics. The same counters are exported by the API at /metrics.
+
+QUERY_COLUMNS = ["source", "query", "executions", "errors", "seconds", "avg_ms", "max_ms", "rows", "bytes"]
+SOURCE_COLUMNS = ["source", "cache_hits", "cache_misses", "cache_hit_rate",
+                  "checkouts", "pool_wait_seconds", "pool_wait_max"]
+
+def query_frame(snapshot):
+    df = pd.DataFrame(snapshot["queries"], columns=QUERY_COLUMNS[:5] + ["max_seconds", "rows", "bytes", "text"])
+    df["avg_ms"] = df["seconds"] / df["executions"].where(df["executions"] > 0) * 1000
+    df["max_ms"] = df["max_seconds"] * 1000
+    return df.sort_values("seconds", ascending=False, ignore_index=True)
+
+def source_frame(snapshot):
+    df = pd.DataFrame(snapshot["sources"], columns=[c for c in SOURCE_COLUMNS if c != "cache_hit_rate"])
+    lookups = df["cache_hits"] + df["cache_misses"]
+    df["cache_hit_rate"] = df["cache_hits"] / lookups.where(lookups > 0)
+    return df[SOURCE_COLUMNS].sort_values("pool_wait_seconds", ascending=False, ignore_index=True)
+
+def render_query_diagnostics():
+    st.markdown("# Query diagnostics")
+    snapshot = query_stats.snapshot()
+    since = pd.Timestamp(snapshot["started_at"], unit="s", tz="UTC")
+    st.caption(f"Process {snapshot['pid']}, counting since {since:%Y-%m-%d %H:%M:%S} UTC")
+    if st.button("Reset counters"):
+        query_stats.reset()
+        st.rerun()
+
+    queries = query_frame(snapshot)
+    st.header("Hot queries")
+    st.write("Ranked by total wall time (execute plus fetch). Bytes are exact for COPY and estimated from the first row otherwise.")
+    st.dataframe(queries[QUERY_COLUMNS], use_container_width=True)
+    if not queries.empty:
+        labels = queries["source"] + ":" + queries["query"]
+        selected = st.selectbox("Query text", labels)
+        st.code(queries.loc[labels == selected, "text"].iloc[0], language="sql")
+
+    st.header("Cache and pool wait by function")
+    st.dataframe(source_frame(snapshot), use_container_width=True)
+
+    st.header("Connection pool")
+    st.json(get_pool_stats())
@@ -0,0 +1,69 @@
+import numpy as np
+from geopy.distance import geodesic
+from sklearn.neighbors import BallTree
+
+# Greedy "everything within max_distance_km of a seed" clustering, as used for
+# the delivery-location maps. Seeds are taken in input order; each seed claims
+# every still-unclaimed point within range, exactly like the old loop that
+# called geodesic() on every remaining row.
+#
+# A haversine BallTree finds each point's candidates up front, and the
+# distances are checked with vectorized haversine math. Haversine and the
+# WGS-84 geodesic differ by well under 1%, so only candidates that land inside
+# that margin of max_distance_km are re-checked with geodesic().
+
+EARTH_RADIUS_KM = 6371.0088
+TOLERANCE = 0.01
+
+def _haversine_km(lat, lon, lats, lons):
+    dlat = lats - lat
+    dlon = lons - lon
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def cluster_labels(latitudes, longitudes, max_distance_km=3) -> np.ndarray:
+    # Cluster number per point; clusters are numbered in seed order.
+    lat_deg = np.asarray(latitudes, dtype=float)
+    lon_deg = np.asarray(longitudes, dtype=float)
+    labels = np.full(len(lat_deg), -1, dtype=int)
+    if len(lat_deg) == 0:
+        return labels
+
+    lat = np.radians(lat_deg)
+    lon = np.radians(lon_deg)
+    tree = BallTree(np.column_stack([lat, lon]), metric="haversine")
+    neighbours = tree.query_radius(
+        np.column_stack([lat, lon]),
+        r=max_distance_km * (1 + TOLERANCE) / EARTH_RADIUS_KM,
+    )
+
+    cluster = 0
+    for seed in range(len(lat)):
+        if labels[seed] != -1:
+            continue
+        candidates = neighbours[seed]
+        candidates = candidates[labels[candidates] == -1]
+
+        distance = _haversine_km(lat[seed], lon[seed], lat[candidates], lon[candidates])
+        inside = distance <= max_distance_km * (1 - TOLERANCE)
+        for i in np.flatnonzero(~inside & (distance <= max_distance_km * (1 + TOLERANCE))):
+            point = candidates[i]
+            inside[i] = geodesic(
+                (lat_deg[seed], lon_deg[seed]), (lat_deg[point], lon_deg[point])
+            ).km <= max_distance_km
+
+        labels[candidates[inside]] = cluster
+        # The seed always belongs to its own cluster, even for a zero radius
+        labels[seed] = cluster
+        cluster += 1
+
+    return labels
+
+def heat_grid(df, cell_deg=0.01, weight_column="delivery_count"):
+    # Sum the weights per lat/lon grid cell (0.01 deg is roughly 1 km), so the
+    # heat layer scales with the covered area rather than the number of rows.
+    cells = df.assign(
+        latitude=(df["latitude"] / cell_deg).round() * cell_deg,
+        longitude=(df["longitude"] / cell_deg).round() * cell_deg,
+    )
+    return cells.groupby(["latitude", "longitude"], as_index=False)[weight_column].sum()
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+# Resample rule for each frequency option of the group KPI page
+RESAMPLE_RULES = {"daily": "D", "weekly": "W-Mon", "monthly": "ME"}
+
+KPI_COLUMNS = ['Total Group Leader', 'Total Unique Group Leader', 'Total New Group Leaders']
+
+def leader_kpis(df, freq) -> pd.DataFrame:
+    # Total / unique / new group leaders per bucket of group_created_date.
+    # Leaders are factorized to integer codes (NaN for missing), and new
+    # leaders are the same codes masked to NaN on every other row, so all
+    # three KPIs are plain resampled count/nunique calls on numbers instead of
+    # a Python function filtering each bucket.
+    codes, _ = pd.factorize(df['group_leader'])
+    leader = np.where(codes >= 0, codes, np.nan)
+    new_leader = np.where(df['is_new_group_leader'].to_numpy() == 1, leader, np.nan)
+    # Sort once up front; resample skips its own sort on a monotonic index
+    dates = pd.to_datetime(df['group_created_date']).to_numpy()
+    order = np.argsort(dates, kind='stable')
+    leaders = pd.DataFrame(
+        {'group_leader': leader[order], 'new_group_leader': new_leader[order]},
+        index=pd.DatetimeIndex(dates[order], name='group_created_date'),
+    )
+    resampled = leaders.resample(RESAMPLE_RULES[freq])
+    kpis = pd.DataFrame({
+        'Total Group Leader': resampled['group_leader'].count(),
+        'Total Unique Group Leader': resampled['group_leader'].nunique(),
+        'Total New Group Leaders': resampled['new_group_leader'].nunique(),
+    })
+    return kpis.reset_index()
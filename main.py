@@ -1,12 +1,18 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 import pandas as pd
 import json
 import logging
 import asyncio
+import asyncpg
+from collections import OrderedDict
 from datetime import date
 import time
-from db_pool import get_conn, release_conn
+from db_pool import database_url, get_conn, release_conn
+from arrow_frames import ARROW_MEDIA_TYPE, encode_frames
+from query_metrics import PROMETHEUS_CONTENT_TYPE, estimate_bytes, fingerprint, load_snapshot, prometheus_text, query_stats
+import derived_tables
 
 app = FastAPI()
 
@@ -14,6 +20,10 @@ app = FastAPI()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# asyncpg pool used by the aggregation endpoint; created on startup
+async_pool = None
+refresh_task = None
+
 class DateRange(BaseModel):
     start_date: date
     end_date: date
@@ -21,6 +31,100 @@ class DateRange(BaseModel):
 def load_config():
     with open("config.json", "r") as file:
         return json.load(file)
+
+class ResultCache:
+    # LRU cache of endpoint results, bounded by the DataFrames' memory
+    # footprint. Ranges that end before today cannot change any more and
+    # get the long TTL; ranges that include today get the short one.
+    def __init__(self, max_bytes=256 * 1024 * 1024, closed_ttl=24 * 3600, open_ttl=60):
+        self.max_bytes = max_bytes
+        self.closed_ttl = closed_ttl
+        self.open_ttl = open_ttl
+        self._entries = OrderedDict()  # key -> (frames, size, expires_at)
+        self._pending = {}             # key -> task loading that key
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(start_date: date, end_date: date, dbname: str):
+        return (start_date.isoformat(), end_date.isoformat(), dbname)
+
+    def ttl_for(self, end_date: date) -> float:
+        return self.closed_ttl if end_date < date.today() else self.open_ttl
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            self._drop(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, frames: dict, ttl: float):
+        size = int(sum(df.memory_usage(deep=True).sum() for df in frames.values()))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (frames, size, time.monotonic() + ttl)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def get_or_load(self, key, ttl: float, loader):
+        frames = self.get(key)
+        if frames is not None:
+            self.hits += 1
+            return frames
+
+        # Identical requests that arrive while the first one is still
+        # querying wait for its result instead of running the queries again.
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+
+        async def load():
+            try:
+                result = await loader()
+                self.put(key, result, ttl)
+                return result
+            finally:
+                self._pending.pop(key, None)
+
+        task = asyncio.ensure_future(load())
+        self._pending[key] = task
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+result_cache = ResultCache(**load_config().get("result_cache", {}))
 def initialize_db(conn, retries=3, delay=1):
     try:
         with conn.cursor() as cur:
@@ -41,12 +145,38 @@ def initialize_db(conn, retries=3, delay=1):
         logger.error(f"Error ensuring dblink is installed: {e}")
 @app.on_event("startup")
 async def startup_event():
+    global async_pool, refresh_task
     conn = get_conn()
     if conn is not None:
         try:
             initialize_db(conn)  # Ensure dblink is installed during startup
         finally:
             release_conn(conn)
+
+    config = load_config()
+    pool_config = config.get("async_pool", {})
+    async_pool = await asyncpg.create_pool(
+        dsn=database_url(),
+        min_size=pool_config.get("min_size", 1),
+        max_size=pool_config.get("max_size", 8),
+    )
+
+    # Create the derived tables, then bring them up to date in the
+    # background: a first full-history refresh must not hold up startup,
+    # and until it is done the queries read from the source tables.
+    try:
+        await derived_tables.ensure_schema(async_pool)
+    except Exception as e:
+        logger.error(f"Error creating derived tables on startup: {e}")
+    refresh_task = asyncio.create_task(derived_tables.run_periodic(async_pool, config))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if refresh_task is not None:
+        refresh_task.cancel()
+    if async_pool is not None:
+        await async_pool.close()
+
 def df_to_json(df: pd.DataFrame) -> list:
     if df.empty:
         logger.warning("Empty DataFrame received.")
@@ -54,9 +184,10 @@ def df_to_json(df: pd.DataFrame) -> list:
 
     # Clean column names
     df.columns = df.columns.str.strip()
-    
-    logger.info(f"DataFrame columns: {df.columns}")
-    logger.info(f"DataFrame head:\n{df.head()}")
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"DataFrame columns: {df.columns}")
+        logger.debug(f"DataFrame head:\n{df.head()}")
 
     if 'order_date' not in df.columns:
         logger.error("The 'order_date' column is missing from the DataFrame.")
@@ -67,159 +198,163 @@ def df_to_json(df: pd.DataFrame) -> list:
         if pd.api.types.is_datetime64_any_dtype(df[col]):
             df[col] = df[col].dt.strftime('%Y-%m-%d')
     return json.loads(df.to_json(orient='records'))
-def fetch_query_sync(query: str, params: tuple) -> pd.DataFrame:
-    conn = get_conn()
-    
-    if conn is None:
-        logger.error("No available connection from the pool.")
-        return pd.DataFrame()
 
+class QueryFailed(Exception):
+    def __init__(self, name, cause):
+        super().__init__(f"{name}: {cause!r}")
+        self.name = name
+        self.cause = cause
+
+async def fetch_query(name: str, query: str, params: tuple, timeout: float) -> pd.DataFrame:
+    # Each query checks out its own connection so the four statements run in
+    # parallel; the timeout covers both the pool wait and the statement.
+    query_id, text = fingerprint(query)
+    key = (f"main.{name}", query_id)
+    started = time.perf_counter()
     try:
-        # initialize_db(conn)  # Ensure dblink is installed
+        async with async_pool.acquire(timeout=timeout) as conn:
+            acquired = time.perf_counter()
+            query_stats.record_pool_wait(key[0], acquired - started)
+            try:
+                records = await conn.fetch(query, *params, timeout=timeout)
+            except Exception:
+                query_stats.record_query(key, text, time.perf_counter() - acquired,
+                                         executions=1, errors=1)
+                raise
+    except Exception as e:
+        raise QueryFailed(name, e) from e
+    query_stats.record_query(key, text, time.perf_counter() - acquired,
+                             rows=len(records), nbytes=estimate_bytes(records), executions=1)
 
-        with conn.cursor() as cur:
-            cur.execute(query, params)
-            data = cur.fetchall()
-            if not data:
-                logger.warning(f"No data returned for query: {query}")
-                return pd.DataFrame()
+    if not records:
+        logger.warning(f"No data returned for query: {name}")
+        return pd.DataFrame()
 
-            columns_ = [desc[0] for desc in cur.description]
-            if 'order_date' not in columns_:
-                logger.error("The 'order_date' column is missing from the query result.")
-                return pd.DataFrame()
+    columns_ = list(records[0].keys())
+    if 'order_date' not in columns_:
+        logger.error(f"The 'order_date' column is missing from the result of {name}.")
+        return pd.DataFrame()
 
-            df = pd.DataFrame(data, columns=columns_)
+    df = pd.DataFrame.from_records(records, columns=columns_)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Query result head ({name}):\n{df.head()}")
+    return df
 
-            logger.info(f"Query result head:\n{df.head()}")
-            return df
+def build_queries(fresh: set, start_date: date, end_date: date) -> dict:
+    # All four read the daily rollup tables maintained by rollups.py, so the
+    # cost follows the number of days requested rather than raw order rows.
+    # A rollup that is missing or stale is computed from the source tables
+    # instead (see derived_tables.source).
+    payment_facts, order_totals, product_sales = (
+        derived_tables.source(table, fresh, start_date, end_date)
+        for table in ("daily_order_payment_facts", "daily_order_totals", "daily_product_sales")
+    )
+    return {
+        "aggregated_data": f"""
+        SELECT
+            f.order_date,
+            f.total_orders,
+            f.group_order_count,
+            f.completed_group_order_count,
+            f.personal_order_count,
+            f.payment_method,
+            COALESCE(t.total_accepted_orders, 0) AS total_accepted_orders
+        FROM {payment_facts} f
+        LEFT JOIN {order_totals} t ON t.order_date = f.order_date
+        WHERE f.order_date BETWEEN $1::date AND $2::date
+        ORDER BY f.order_date;
+        """,
+        "total_volume_sold_data": f"""
+        SELECT s.order_date, s.product_name,
+               s.personal_volume_sold,
+               s.group_volume_sold,
+               s.personal_volume_sold + s.group_volume_sold AS total_volume_sold
+        FROM {product_sales} s
+        WHERE s.personal_volume_sold IS NOT NULL
+        AND s.order_date BETWEEN $1::date AND $2::date;
+        """,
+        "total_revenue_data": f"""
+        SELECT s.order_date, s.product_name,
+               s.personal_revenue,
+               s.group_revenue,
+               s.personal_revenue + s.group_revenue AS total_revenue
+        FROM {product_sales} s
+        WHERE s.personal_revenue IS NOT NULL
+        AND s.order_date BETWEEN $1::date AND $2::date;
+        """,
+        "received_orders_data": f"""
+        SELECT t.order_date, t.total_received_orders,
+               t.group_order_recieved,
+               t.personal_order_recieved
+        FROM {order_totals} t
+        WHERE t.order_date BETWEEN $1::date AND $2::date;
+        """,
+    }
+
+async def load_frames(start_date: date, end_date: date, query_timeout: float) -> dict:
+    try:
+        async with async_pool.acquire(timeout=query_timeout) as conn:
+            fresh = await derived_tables.fresh_tables_async(conn)
     except Exception as e:
-        logger.error(f"Error fetching data with query '{query}': {e}")
-        return pd.DataFrame()
-    finally:
-        release_conn(conn)
+        logger.error(f"Error checking the derived tables: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching data from the database.")
+    queries = build_queries(fresh, start_date, end_date)
+    params = (start_date, end_date)
+
+    results = await asyncio.gather(
+        *(fetch_query(name, query, params, query_timeout) for name, query in queries.items()),
+        return_exceptions=True,
+    )
+
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if failures:
+        for failure in failures:
+            logger.error(f"Error fetching query {failure}")
+        failed_names = ", ".join(getattr(f, "name", type(f).__name__) for f in failures)
+        timed_out = all(isinstance(getattr(f, "cause", f), asyncio.TimeoutError) for f in failures)
+        if timed_out:
+            raise HTTPException(status_code=504, detail=f"Timed out fetching: {failed_names}.")
+        raise HTTPException(status_code=500, detail=f"Error fetching data from the database: {failed_names}.")
+
+    return dict(zip(queries, results))
 
 @app.post("/fetch_aggregated_data/")
-async def fetch_aggregated_data(date_range: DateRange):
+async def fetch_aggregated_data(date_range: DateRange, request: Request):
     start_date = date_range.start_date
     end_date = date_range.end_date
     config = load_config()
     dbname = config["dbname"]
-    
-    queries = [
-        
-        f"""
-        WITH total_accepted_orders_cte AS (
-            SELECT 
-                DATE(o.created_at) AS order_date,
-                COUNT(DISTINCT o.id) AS total_accepted_orders -- Count each order only once
-            FROM 
-                orders o
-            INNER JOIN 
-                delivery_tracks dt ON (o.groups_carts_id = dt.group_cart_id OR o.personal_cart_id = dt.personal_cart_id)
-            WHERE 
-                o.status = 'COMPLETED'
-                AND dt.created_at IS NOT NULL -- Make sure the order has at least one delivery track event
-                
-            GROUP BY 
-                DATE(o.created_at)
-        )
-        SELECT 
-            DATE(o.created_at) AS order_date,
-            COUNT(*) AS total_orders,
-            COUNT(CASE WHEN o.groups_carts_id IS NOT NULL THEN 1 END) AS group_order_count,
-            COUNT(CASE WHEN o.groups_carts_id IS NOT NULL AND g.status = 'COMPLETED' THEN 1 END) AS completed_group_order_count,
-            COUNT(CASE WHEN o.personal_cart_id IS NOT NULL THEN 1 END) AS personal_order_count,
-            COALESCE(payments.name, o.payment_method) AS payment_method,
-            COALESCE(tao.total_accepted_orders, 0) AS total_accepted_orders
-        FROM 
-            orders o
-        LEFT JOIN 
-            groups_carts gc ON o.groups_carts_id = gc.id
-        LEFT JOIN 
-            groups g ON gc.group_id = g.id
-        LEFT JOIN 
-            dblink(
-                'dbname={dbname}',
-                'SELECT pi2.third_party_payment_id AS order_id, t.status, pm.name
-                FROM payment_intents pi2
-                JOIN transactions t ON t.payment_intent_id = pi2.id
-                JOIN payment_methods pm ON pm.id = t.payment_method_id'
-            ) AS payments(order_id VARCHAR, status VARCHAR, name VARCHAR) 
-            ON o.id::VARCHAR = payments.order_id AND payments.status = 'COMPLETED'
-        LEFT JOIN 
-            total_accepted_orders_cte tao ON DATE(o.created_at) = tao.order_date -- Bring in total accepted orders from the CTE
-        WHERE 
-            o.status = 'COMPLETED'
-            AND DATE(o.created_at) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-        GROUP BY 
-            DATE(o.created_at), COALESCE(payments.name, o.payment_method), tao.total_accepted_orders
-        ORDER BY 
-            order_date;
+    query_timeout = config.get("query_timeout", 60)
 
-        """,
-        f"""
-        SELECT DATE(o.created_at) AS order_date, pn.name AS product_name,
-               COALESCE(SUM(pci.quantity * p.weight), 0) AS personal_volume_sold,
-               COALESCE(SUM(gc.quantity * p.weight), 0) AS group_volume_sold,
-               COALESCE(SUM(pci.quantity * p.weight), 0) + COALESCE(SUM(gc.quantity * p.weight), 0) AS total_volume_sold
-        FROM orders o
-        LEFT JOIN personal_cart_items pci ON o.personal_cart_id = pci.cart_id
-        LEFT JOIN groups_carts gc ON o.groups_carts_id = gc.id
-        LEFT JOIN groups g ON gc.group_id = g.id
-        LEFT JOIN group_deals gd ON g.group_deals_id = gd.id
-        LEFT JOIN products p ON COALESCE(pci.product_id, gd.product_id) = p.id 
-        JOIN product_names pn ON p.name_id = pn.id
-        WHERE o.status = 'COMPLETED'
-        AND DATE(o.created_at) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-        GROUP BY DATE(o.created_at), product_name;
-        """,
-        f"""
-        SELECT DATE(o.created_at) AS order_date, pn.name AS product_name,
-               COALESCE(SUM(pci.quantity * sd.original_price), 0) AS personal_revenue,
-               COALESCE(SUM(gc.quantity * gd.group_price), 0) AS group_revenue,
-               COALESCE(SUM(pci.quantity * sd.original_price), 0) + COALESCE(SUM(gc.quantity * gd.group_price), 0) AS total_revenue
-        FROM orders o
-        LEFT JOIN personal_cart_items pci ON o.personal_cart_id = pci.cart_id
-        LEFT JOIN groups_carts gc ON o.groups_carts_id = gc.id
-        LEFT JOIN groups g ON gc.group_id = g.id
-        LEFT JOIN group_deals gd ON g.group_deals_id = gd.id
-        LEFT JOIN products p ON COALESCE(pci.product_id, gd.product_id) = p.id
-        LEFT JOIN single_deals sd ON p.id = sd.product_id
-        JOIN product_names pn ON p.name_id = pn.id
-        WHERE o.status = 'COMPLETED'
-        AND DATE(o.created_at) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-        GROUP BY DATE(o.created_at), pn.name;
-        """,
-        f"""
-        SELECT DATE(o.created_at) AS order_date, COUNT(*) AS total_received_orders,
-               COUNT(CASE WHEN o.groups_carts_id IS NOT NULL THEN 1 END) AS group_order_recieved,
-               COUNT(CASE WHEN o.personal_cart_id IS NOT NULL THEN 1 END) AS personal_order_recieved 
-        FROM orders o
-        WHERE o.status = 'COMPLETED'
-        AND DATE(o.created_at) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-        GROUP BY DATE(o.created_at);
-        """
-    ]
-    
-   
-    params = (start_date, end_date)
+    frames = await result_cache.get_or_load(
+        ResultCache.make_key(start_date, end_date, dbname),
+        result_cache.ttl_for(end_date),
+        lambda: load_frames(start_date, end_date, query_timeout),
+    )
 
     try:
-        results = await asyncio.to_thread(lambda: [fetch_query_sync(query, params) for query in queries])
+        # Clients that ask for Arrow get typed columns without the JSON
+        # round trip; JSON stays the default.
+        if ARROW_MEDIA_TYPE in request.headers.get("accept", ""):
+            return Response(content=encode_frames(frames), media_type=ARROW_MEDIA_TYPE)
+        # df_to_json rewrites columns in place, so leave the cached frames alone
+        return {name: df_to_json(df.copy()) for name, df in frames.items()}
     except Exception as e:
-        logger.error(f"Error fetching queries: {e}")
-        raise HTTPException(status_code=500, detail="Error fetching data from the database.")
+        logger.error(f"Error processing DataFrames: {e}")
+        raise HTTPException(status_code=500, detail="Error processing data.")
 
-    df_, df_total_volume_sold, df_total_revenue, df_received_orders = results
+@app.get("/cache_stats/")
+async def cache_stats():
+    return result_cache.stats()
 
-    try: 
-        return {
-            "aggregated_data": df_to_json(df_),
-            "total_volume_sold_data": df_to_json(df_total_volume_sold),
-            "received_orders_data": df_to_json(df_received_orders),
-            "total_revenue_data": df_to_json(df_total_revenue),
-        }
-    except Exception as e:
-        logger.error(f"Error processing DataFrames: {e}")
-        raise HTTPException(status_code=500, detail="Error processing data.")
\ No newline at end of file
+@app.get("/metrics")
+async def metrics():
+    # Per-query timings of this process and of the Streamlit pages (from the
+    # snapshot they write), plus the endpoint's result cache.
+    text = prometheus_text({"api": query_stats.snapshot(), "streamlit": load_snapshot()})
+    lines = []
+    for field, value in result_cache.stats().items():
+        kind = "counter" if field in ("hits", "misses", "coalesced", "evictions", "expirations") else "gauge"
+        name = f"kpi_api_result_cache_{field}{'_total' if kind == 'counter' else ''}"
+        lines += [f"# TYPE {name} {kind}", f"{name} {value}"]
+    return PlainTextResponse(text + "\n".join(lines) + "\n", media_type=PROMETHEUS_CONTENT_TYPE)
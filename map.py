@@ -1,57 +1,67 @@
 import streamlit as st
 import pandas as pd
+from db_fetch import fetch_frame
 from db_pool import get_conn, release_conn
-
-@st.cache_data
-def get_orders(start_date, end_date):
+from query_metrics import cache_data
+from sql_filters import date_range
+
+# SQL expression for each time frame; weeks start on Monday like pandas' 'W' periods
+TIME_BUCKETS = {
+    "Daily": "DATE(o.created_at)",
+    "Weekly": "date_trunc('week', o.created_at)",
+    "Monthly": "date_trunc('month', o.created_at)",
+    "Yearly": "date_trunc('year', o.created_at)",
+}
+
+@cache_data
+def get_vendor_facts(start_date, end_date, time_frame):
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            # Define the query
-            query = """
-            SELECT
-                o.id AS order_id,
-                o.groups_carts_id,
-                o.total_amount,
-                o.discount,
-                o.created_at,
-                o.status,
-                o.response,
-                o.updated_at,
-                gd.product_id,
-                gd.group_price,
-                gc.quantity
-            FROM
-                orders o
-            JOIN
-                groups_carts gc ON o.groups_carts_id = gc.id
-            JOIN
-                groups g ON gc.group_id = g.id
-            JOIN
-                group_deals gd ON g.group_deals_id = gd.id
-            WHERE
-                o.created_at BETWEEN %(start_date)s AND %(end_date)s + interval '1 day' - interval '1 second'
-                
-            """
-
-            # Execute the query with parameters
-            cur.execute(query, {"start_date": start_date, "end_date": end_date})
-
-            # Fetch results
-            results = cur.fetchall()
-            col = [desc[0] for desc in cur.description]
-
-            # Close the cursor and connection
-            cur.close()
-            conn.close()
-
-            # Create a DataFrame from the results
-            df = pd.DataFrame(results, columns=col)
-            return df
+        # Completed group orders already grouped by vendor, product, category
+        # and time bucket, so the result scales with the number of groups
+        # rather than the number of orders
+        query = f"""
+        SELECT
+            v.name AS vendor_name,
+            p.id AS product_id,
+            pn.name AS product_name,
+            c.name AS category_name,
+            {TIME_BUCKETS[time_frame]} AS time_frame,
+            COUNT(*) AS order_count,
+            COALESCE(SUM(gd.group_price * gc.quantity), 0)::float8 AS sales,
+            COUNT(gd.group_price * gc.quantity) AS priced_order_count,
+            COALESCE(SUM(o.total_amount - o.discount), 0)::float8 AS net_sales
+        FROM
+            orders o
+        JOIN
+            groups_carts gc ON o.groups_carts_id = gc.id
+        JOIN
+            groups g ON gc.group_id = g.id
+        JOIN
+            group_deals gd ON g.group_deals_id = gd.id
+        JOIN
+            products p ON gd.product_id = p.id
+        JOIN
+            vendors v ON p.vendor_id = v.id
+        JOIN
+            product_names pn ON p.name_id = pn.id
+        JOIN
+            categories c ON pn.category_id = c.id
+        WHERE
+            o.status = 'COMPLETED'
+            AND {date_range('o.created_at', '%(start_date)s', '%(end_date)s')}
+        GROUP BY
+            v.name, p.id, pn.name, c.name, {TIME_BUCKETS[time_frame]}
+        """
+
+        df = fetch_frame(conn, query, {"start_date": start_date, "end_date": end_date})
+        if time_frame != "Daily":
+            df['time_frame'] = pd.to_datetime(df['time_frame'])
+        return df
     finally:
         if conn:
             release_conn(conn)
-@st.cache_data
+@cache_data
 def get_products():
     conn = get_conn()
     # Execute a query
@@ -78,7 +88,7 @@ def get_products():
     finally:
             if conn:
                 release_conn(conn)
-@st.cache_data
+@cache_data
 def get_product_names():
     conn = get_conn()
     # Execute a query
@@ -129,7 +139,7 @@ def get_categories():
         if conn:
             release_conn(conn)
     
-@st.cache_data
+@cache_data
 def get_vendors():
   
     conn = get_conn()
@@ -147,161 +157,75 @@ def get_vendors():
             # Fetch results
             results = cur.fetchall()
             col = [desc[0] for desc in cur.description]
-            # Close the cursor and connection
-            cur.close()
-            conn.close()
-
             df=pd.DataFrame(results, columns=col)
             return df
     finally:
         if conn:
             release_conn(conn)
 
-def aggregate_data(df, time_frame, date_column='created_at'):
-    df[date_column] = pd.to_datetime(df[date_column])
-    if time_frame == "Daily":
-        df['time_frame'] = df[date_column].dt.date
-    elif time_frame == "Weekly":
-        df['time_frame'] = df[date_column].dt.to_period('W').apply(lambda r: r.start_time)
-    elif time_frame == "Monthly":
-        df['time_frame'] = df[date_column].dt.to_period('M').apply(lambda r: r.start_time)
-    elif time_frame == "Yearly":
-        df['time_frame'] = df[date_column].dt.to_period('Y').apply(lambda r: r.start_time)
-    return df
-
-def calculate_category_sales(orders, products, time_frame):
-    # Filter completed orders
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    
-    # Merge completed orders with products on product_id
-    merged_data = completed_orders.merge(products, on='product_id')
-    
-    # Calculate total sales for each order
-    merged_data['total_sales'] = merged_data['total_amount'] - merged_data['discount']
-    
-    # Aggregate the data by time frame
-    merged_data = aggregate_data(merged_data, time_frame)
-    
-    # Calculate category sales
-    category_sales = merged_data.groupby(['category_name', 'time_frame'])['total_sales'].sum().reset_index()
-    category_sales.columns = ['category_name', 'time_frame', 'category_sales']
-    
-    # Calculate number of completed orders per category
-    orders_per_category = merged_data.groupby(['category_name']).size().reset_index(name='num_completed_orders')
-    
-    # Calculate number of unique products per category
+@cache_data
+def get_product_catalog():
+    # Products with their vendor, name and category, as used by the vendor page
+    product_names = get_product_names().merge(get_categories(), on='category_id')
+    return get_products().merge(product_names, on='name_id')
+
+def calculate_vendor_metrics(facts, products):
+    # Every vendor metric comes from one grouped aggregation per grain over
+    # the pre-grouped facts, instead of one filter/merge/bucket pass each.
+    by_product = facts.groupby(['vendor_name', 'product_name', 'time_frame']).agg(
+        total_sales=('sales', 'sum'),
+        order_count=('order_count', 'sum'),
+        priced_order_count=('priced_order_count', 'sum'),
+    ).reset_index()
+    by_product['average_order_value'] = by_product['total_sales'] / by_product['priced_order_count']
+
+    by_vendor = facts.groupby(['vendor_name', 'time_frame']).agg(
+        total_sales=('sales', 'sum'),
+        order_count=('order_count', 'sum'),
+        priced_order_count=('priced_order_count', 'sum'),
+        sold_product_count=('product_id', 'nunique'),
+    ).reset_index()
+    by_vendor['average_order_value'] = by_vendor['total_sales'] / by_vendor['priced_order_count']
+
+    by_vendor_category = facts.groupby(['vendor_name', 'category_name', 'time_frame']).agg(
+        category_sales=('sales', 'sum'),
+    ).reset_index()
+
+    by_category = facts.groupby(['category_name', 'time_frame']).agg(
+        category_sales=('net_sales', 'sum'),
+    ).reset_index()
+
+    # Number of completed orders and of catalogue products per category
+    orders_per_category = facts.groupby('category_name')['order_count'].sum().reset_index(name='num_completed_orders')
     products_per_category = products.groupby('category_name').size().reset_index(name='num_products')
-    
-    # Merge the calculated data
-    result = category_sales.merge(orders_per_category, on=['category_name'], how='left')
-    result = result.merge(products_per_category, on='category_name', how='left')
-    
-    # Create a new column for category names with numbers in brackets
-    result['category_name_with_numbers'] = result.apply(lambda row: f"{row['category_name']} ({row['num_completed_orders']} orders, {row['num_products']} products)", axis=1)
-    
-    return result
-def calculate_category_sales_vendors(orders, products, time_frame):
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    merged_data = completed_orders.merge(products, on='product_id')
-    merged_data['total_sales'] = merged_data['group_price'] * merged_data['quantity']
-    merged_data = aggregate_data(merged_data, time_frame)
-    category_sales = merged_data.groupby(['vendor_name','category_name', 'time_frame'])['total_sales'].sum().reset_index()
-    category_sales.columns = ['vendor_name','category_name', 'time_frame', 'category_sales']
-    return category_sales
-def calculate_total_sales(orders, products, time_frame):
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    merged_data = completed_orders.merge(products, on='product_id')
-    merged_data['sales'] = merged_data['group_price'] * merged_data['quantity']
-    merged_data = aggregate_data(merged_data, time_frame)
-    total_sales = merged_data.groupby(['vendor_name', 'product_name', 'time_frame'])['sales'].sum().reset_index()
-    total_sales.columns = ['vendor_name', 'product_name','time_frame', 'total_sales']
-    return total_sales
-
-
-def calculate_total_sales_vendors(orders, products, time_frame):
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    merged_data = completed_orders.merge(products, on='product_id')
-    merged_data['sales'] = merged_data['group_price'] * merged_data['quantity']
-    merged_data = aggregate_data(merged_data, time_frame)
-    total_sales = merged_data.groupby(['vendor_name',  'time_frame'])['sales'].sum().reset_index()
-    total_sales.columns = ['vendor_name','time_frame', 'total_sales']
-    return total_sales
-
-def calculate_order_volume(orders, products, time_frame):
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    merged_data = completed_orders.merge(products, on='product_id')
-    merged_data = aggregate_data(merged_data, time_frame)
-    order_volume = merged_data.groupby(['vendor_name','product_name','time_frame']).size().reset_index(name='order_count')
-    order_volume.columns = ['vendor_name','product_name', 'time_frame', 'order_count']
-    return order_volume
-
-def calculate_order_volume_vendor(orders, products, time_frame):
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    merged_data = completed_orders.merge(products, on='product_id')
-    merged_data = aggregate_data(merged_data, time_frame)
-    order_volume = merged_data.groupby(['vendor_name','time_frame']).size().reset_index(name='order_count')
-    order_volume.columns = ['vendor_name', 'time_frame', 'order_count']
-    return order_volume
-def calculate_average_order_value(orders, products, time_frame):
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    merged_data = completed_orders.merge(products, on='product_id')
-    merged_data['order_value'] = merged_data['group_price'] * merged_data['quantity']
-    merged_data = aggregate_data(merged_data, time_frame)
-    average_order_value = merged_data.groupby(['vendor_name', 'product_name', 'time_frame'])['order_value'].mean().reset_index()
-    average_order_value.columns = ['vendor_name','product_name', 'time_frame', 'average_order_value']
-    return average_order_value
-
-def calculate_average_order_value_vendor(orders, products, time_frame):
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    merged_data = completed_orders.merge(products, on='product_id')
-    merged_data['order_value'] = merged_data['group_price'] * merged_data['quantity']
-    merged_data = aggregate_data(merged_data, time_frame)
-    average_order_value = merged_data.groupby(['vendor_name', 'time_frame'])['order_value'].mean().reset_index()
-    average_order_value.columns = ['vendor_name','time_frame', 'average_order_value']
-    return average_order_value
-
-def product_sales(orders, products, time_frame):
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    merged_data = completed_orders.merge(products, on='product_id')
-    merged_data = aggregate_data(merged_data, time_frame)
-    merged_data['sales'] = merged_data['group_price'] * merged_data['quantity']
-    product_sales = merged_data.groupby(['vendor_name', 'product_name','time_frame'])['sales'].sum().reset_index()
-    product_sales.columns = ['vendor_name','product_name', 'time_frame',  'product_sales']
-    return product_sales
+    category_sales = by_category.merge(orders_per_category, on='category_name', how='left')
+    category_sales = category_sales.merge(products_per_category, on='category_name', how='left')
+    category_sales['category_name_with_numbers'] = category_sales.apply(lambda row: f"{row['category_name']} ({row['num_completed_orders']} orders, {row['num_products']} products)", axis=1)
 
-def product_sales_vendor(orders, products, time_frame):
-    # merged_data = orders.merge(products, on='product_id')
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    merged_data = completed_orders.merge(products, on='product_id')
-    merged_data = aggregate_data(merged_data, time_frame)
-    merged_data['sales'] = merged_data['group_price'] * merged_data['quantity']
-    product_sales = merged_data.groupby(['vendor_name','time_frame'])['sales'].sum().reset_index()
-    product_sales.columns = ['vendor_name','time_frame',  'product_sales']
-    return product_sales
-
-def calculate_product_portfolio(orders, products, time_frame):
-    # Filter completed orders
-    completed_orders = orders[orders['status'] == 'COMPLETED']
-    
-    # Merge completed orders with products on product_id
-    merged_data = completed_orders.merge(products, on='product_id')
-    
-    merged_data = aggregate_data(merged_data, time_frame)
-        
-    # Calculate the number of sold products per vendor
-    sold_products_per_vendor = merged_data.groupby(['vendor_name','time_frame'])['product_id'].nunique().reset_index()
-    sold_products_per_vendor.columns = ['vendor_name','time_frame', 'sold_product_count']
-    
-    # Calculate the total number of products per vendor
-    total_products_per_vendor = products.groupby(['vendor_name'])['product_id'].nunique().reset_index()
-    total_products_per_vendor.columns = ['vendor_name', 'total_product_count']
-    
-    # Merge the two dataframes
-    product_portfolio = sold_products_per_vendor.merge(total_products_per_vendor, on='vendor_name')
-    
+    # Sold products per vendor against the vendor's whole catalogue
+    total_products_per_vendor = products.groupby('vendor_name')['product_id'].nunique().reset_index(name='total_product_count')
+    product_portfolio = by_vendor[['vendor_name', 'time_frame', 'sold_product_count']].merge(total_products_per_vendor, on='vendor_name')
     product_portfolio['vendor_name_with_total'] = product_portfolio.apply(
         lambda row: f"{row['vendor_name']} ({row['total_product_count']} products)", axis=1)
-    
-    return product_portfolio
-
 
+    product_keys = ['vendor_name', 'product_name', 'time_frame']
+    vendor_keys = ['vendor_name', 'time_frame']
+    return {
+        "category_sales": category_sales,
+        "total_sales": by_product[product_keys + ['total_sales']],
+        "order_volume": by_product[product_keys + ['order_count']],
+        "average_order_value": by_product[product_keys + ['average_order_value']],
+        "category_sales_vendor": by_vendor_category,
+        "total_sales_vendor": by_vendor[vendor_keys + ['total_sales']],
+        "order_volume_vendor": by_vendor[vendor_keys + ['order_count']],
+        "average_order_value_vendor": by_vendor[vendor_keys + ['average_order_value']],
+        "product_portfolio": product_portfolio,
+        "product_sales": by_product[product_keys + ['total_sales']].rename(columns={'total_sales': 'product_sales'}),
+        "product_sales_vendor": by_vendor[vendor_keys + ['total_sales']].rename(columns={'total_sales': 'product_sales'}),
+    }
+
+@cache_data
+def get_vendor_metrics(start_date, end_date, time_frame):
+    # Memoized per (date range, time frame) so reruns of the page (vendor or
+    # product selection, the Filter button) reuse the computed frames
+    return calculate_vendor_metrics(get_vendor_facts(start_date, end_date, time_frame), get_product_catalog())
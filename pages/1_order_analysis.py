@@ -1,6 +1,9 @@
 import pandas as pd
 import streamlit as st 
+from db_fetch import copy_frame
 from db_pool import get_conn, release_conn
+from query_metrics import cache_data
+from render_profile import start_profile
 from statsmodels.formula.api import ols
 import numpy as np 
 import matplotlib.pyplot as plt
@@ -8,90 +11,87 @@ import seaborn as sns
 from sklearn.preprocessing import LabelEncoder
 import json
 # Step 1: Fetch Data from SQL Query
-@st.cache_data
+@cache_data
 def fetch_data():
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            query = """
-            WITH order_view AS (
-                SELECT
-                    gd.product_id,
-                    pn."name" AS product_name,
-                    pn.measuring_unit,
-                    gc.id AS group_cart_id,
-                    gd.id AS group_deal_id,
-                    gd.group_price,
-                    gd.max_group_member,
-                    COALESCE(gd.lead_time, '24h') AS lead_time,
-                    gc.user_id,
-                    gc.quantity,
-                    o.id AS order_id,
-                    o.created_at::date AS ordered_at
-                FROM
-                    orders o
-                JOIN groups_carts gc ON
-                    gc.id = o.groups_carts_id
-                    AND o.status = 'COMPLETED'
-                    AND o.deleted_at IS NULL
-                JOIN "groups" g ON g.id = gc.group_id
-                JOIN group_deals gd ON gd.id = g.group_deals_id
-                JOIN products p ON p.id = gd.product_id
-                JOIN product_names pn ON pn.id = p.name_id
-            ),
-            time_series AS (
-                SELECT t
-                FROM generate_series(
-                    date_trunc('DAY', '2024-08-01'::TIMESTAMP),
-                    date_trunc('DAY', NOW()::TIMESTAMP),
-                    INTERVAL '1 DAY'
-                ) AS t
-            ),
-            active_customers AS (
-                SELECT
-                    ordered_at,
-                    COUNT(DISTINCT user_id) AS active_customers,
-                    COUNT(DISTINCT order_id) AS total_orders
-                FROM order_view
-                GROUP BY ordered_at
-            ),
-            active_ordering_customers AS (
-                SELECT
-                    ordered_at,
-                    group_deal_id,
-                    group_price,
-                    max_group_member,
-                    lead_time,
-                    product_name,
-                    measuring_unit,
-                    COUNT(DISTINCT user_id) AS active_customer_ordered_product,
-                    COUNT(DISTINCT order_id) AS product_order
-                FROM order_view
-                WHERE product_name = 'Red Onion B'
-                GROUP BY
-                    ordered_at, group_deal_id, product_name, measuring_unit, group_price, max_group_member, lead_time
-            )
+        query = """
+        WITH order_view AS (
             SELECT
-                ts.t AS sys_date,
-                aoc.product_name,
-                aoc.measuring_unit,
-                aoc.group_deal_id,
-                aoc.group_price,
-                aoc.max_group_member,
-                aoc.lead_time,
-                ac.active_customers,
-                aoc.active_customer_ordered_product,
-                ac.total_orders,
-                aoc.product_order
-            FROM time_series ts
-            LEFT JOIN active_ordering_customers aoc ON aoc.ordered_at = ts.t
-            LEFT JOIN active_customers ac ON ac.ordered_at = ts.t;
-            """
-            cur.execute(query)
-            data = cur.fetchall()
-            colnames = [desc[0] for desc in cur.description]
-            df = pd.DataFrame(data, columns=colnames)
-            return df
+                gd.product_id,
+                pn."name" AS product_name,
+                pn.measuring_unit,
+                gc.id AS group_cart_id,
+                gd.id AS group_deal_id,
+                gd.group_price,
+                gd.max_group_member,
+                COALESCE(gd.lead_time, '24h') AS lead_time,
+                gc.user_id,
+                gc.quantity,
+                o.id AS order_id,
+                o.created_at::date AS ordered_at
+            FROM
+                orders o
+            JOIN groups_carts gc ON
+                gc.id = o.groups_carts_id
+                AND o.status = 'COMPLETED'
+                AND o.deleted_at IS NULL
+            JOIN "groups" g ON g.id = gc.group_id
+            JOIN group_deals gd ON gd.id = g.group_deals_id
+            JOIN products p ON p.id = gd.product_id
+            JOIN product_names pn ON pn.id = p.name_id
+        ),
+        time_series AS (
+            SELECT t
+            FROM generate_series(
+                date_trunc('DAY', '2024-08-01'::TIMESTAMP),
+                date_trunc('DAY', NOW()::TIMESTAMP),
+                INTERVAL '1 DAY'
+            ) AS t
+        ),
+        active_customers AS (
+            SELECT
+                ordered_at,
+                COUNT(DISTINCT user_id) AS active_customers,
+                COUNT(DISTINCT order_id) AS total_orders
+            FROM order_view
+            GROUP BY ordered_at
+        ),
+        active_ordering_customers AS (
+            SELECT
+                ordered_at,
+                group_deal_id,
+                group_price,
+                max_group_member,
+                lead_time,
+                product_name,
+                measuring_unit,
+                COUNT(DISTINCT user_id) AS active_customer_ordered_product,
+                COUNT(DISTINCT order_id) AS product_order
+            FROM order_view
+            WHERE product_name = 'Red Onion B'
+            GROUP BY
+                ordered_at, group_deal_id, product_name, measuring_unit, group_price, max_group_member, lead_time
+        )
+        SELECT
+            ts.t AS sys_date,
+            aoc.product_name,
+            aoc.measuring_unit,
+            aoc.group_deal_id,
+            aoc.group_price,
+            aoc.max_group_member,
+            aoc.lead_time,
+            ac.active_customers,
+            aoc.active_customer_ordered_product,
+            ac.total_orders,
+            aoc.product_order
+        FROM time_series ts
+        LEFT JOIN active_ordering_customers aoc ON aoc.ordered_at = ts.t
+        LEFT JOIN active_customers ac ON ac.ordered_at = ts.t;
+        """
+        # Whole time series in one go, so it is sent with COPY
+        df = copy_frame(conn, query)
+        return df
         
     finally:
         if conn:
@@ -103,6 +103,8 @@ def load_config():
         return json.load(file)
 
 # Load the configuration
+profile = start_profile("1_order_analysis")
+profile.phase("fetch", "price CSVs and order data")
 config = load_config()
 # Retrieve the file path from the config
 csv_path = config["files"]["updated_price_diff_csv"]
@@ -112,6 +114,7 @@ csv_data = pd.read_csv(csv_path)
 df = fetch_data()
 
 # Step 3: Convert Date Formats
+profile.phase("transform", "price and active user analysis")
 df['sys_date'] = pd.to_datetime(df['sys_date'])
 csv_data['Date'] = pd.to_datetime(csv_data['Date'])
 
@@ -188,6 +191,7 @@ merged_data['active_user'].fillna(0, inplace=True)
 
 # Drop the unnecessary `percentage_diff` column after merging
 merged_data = merged_data.drop(columns=['percentage_diff'])
+profile.phase("widgets", "description")
 st.subheader('Order Analysis from August 1 to October 17, 2024 for Red Onion B')
 # General Description of Metrics
 # Expandable section for General Description of Metrics
@@ -231,6 +235,7 @@ with st.expander("General Description of Metrics"):
 
 # Step 2: Define Conditions and Create Classes
 # print(f"Rows before dropping NaN in 'percentage_diff': {len(merged_data)}")
+profile.phase("transform", "grouped analysis")
 merged_data.dropna(subset=['rounded_percentage_diff'], inplace=True)
 
 # Debug: Check how many rows were dropped
@@ -323,6 +328,7 @@ grouped_discount_category['duration_days'] = grouped_discount_category['duration
 grouped_discount_category = grouped_discount_category.sort_values(by='total_orders', ascending=False)
 # Plotting - Visualizing the effects of each subcategory
 
+profile.phase("chart", "charts")
 # 1. Max Group Member
 st.markdown("""
 #### 1. Average Total Orders, Active Customers, and Active Users by Max Group Member
@@ -678,4 +684,4 @@ plt.xticks(rotation=45)
 plt.legend(title=' Delivery Time')
 st.pyplot(fig)
 
-
+profile.finish()
@@ -4,6 +4,9 @@ import streamlit as st
 import datetime
 import altair as alt
 import plotly.express as px
+from arrow_frames import ARROW_MEDIA_TYPE, decode_frames
+from render_profile import start_profile
+from time_buckets import bucket_start
 
 FASTAPI_URL = st.secrets["fastapi"]["url"]
 def fetch_data_from_api(start_date, end_date):
@@ -12,7 +15,7 @@ def fetch_data_from_api(start_date, end_date):
             "start_date": start_date.strftime('%Y-%m-%d'),
             "end_date": end_date.strftime('%Y-%m-%d'),
             
-        })
+        }, headers={"Accept": f"{ARROW_MEDIA_TYPE}, application/json;q=0.9"})
 
         # Check if the request was successful
         if response.status_code != 200:
@@ -20,19 +23,25 @@ def fetch_data_from_api(start_date, end_date):
             st.error(f"Response content: {response.content}")
             return None, None, None, None
 
-        # Check if the response content is valid JSON
-        try:
-            data = response.json()
-        except ValueError:
-            st.error("Failed to decode JSON from the response")
-            st.error(f"Response content: {response.content}")
-            return None, None, None, None
-
-        # Convert JSON data to DataFrames
-        df = pd.DataFrame(data['aggregated_data'])
-        df_total_volume_sold = pd.DataFrame(data['total_volume_sold_data'])
-        df_received_orders = pd.DataFrame(data['received_orders_data'])
-        df_total_revenue = pd.DataFrame(data['total_revenue_data'])
+        if response.headers.get("content-type", "").startswith(ARROW_MEDIA_TYPE):
+            # Columnar payload decodes straight into typed DataFrames
+            frames = decode_frames(response.content)
+        else:
+            # Check if the response content is valid JSON
+            try:
+                data = response.json()
+            except ValueError:
+                st.error("Failed to decode JSON from the response")
+                st.error(f"Response content: {response.content}")
+                return None, None, None, None
+
+            # Convert JSON data to DataFrames
+            frames = {name: pd.DataFrame(records) for name, records in data.items()}
+
+        df = frames['aggregated_data']
+        df_total_volume_sold = frames['total_volume_sold_data']
+        df_received_orders = frames['received_orders_data']
+        df_total_revenue = frames['total_revenue_data']
 
         # Ensure 'order_date' column exists before converting to datetime
         if 'order_date' in df.columns:
@@ -67,10 +76,8 @@ def aggregate_by_payment_method(data, frequency):
     if data is None or data.empty:
         st.warning("No data available for the selected date range.")
     else:
-        if frequency == 'Weekly':
-            data['frequency'] = data['order_date'].dt.to_period('W').apply(lambda r: r.start_time)
-        elif frequency == 'Monthly':
-            data['frequency'] = data['order_date'].dt.to_period('M').apply(lambda r: r.start_time)
+        if frequency in ('Weekly', 'Monthly'):
+            data['frequency'] = bucket_start(data['order_date'], frequency)
         else:
             data['frequency'] = data['order_date'].dt.date  # Show only the date for daily frequency
         
@@ -133,10 +140,8 @@ def aggregate_by_frequency(data, frequency):
     if data is None or data.empty:
         st.warning("No data available for the selected date range.")
     else:
-        if frequency == 'Weekly':
-            data['frequency'] = data['order_date'].dt.to_period('W').apply(lambda r: r.start_time)
-        elif frequency == 'Monthly':
-            data['frequency'] = data['order_date'].dt.to_period('M').apply(lambda r: r.start_time)
+        if frequency in ('Weekly', 'Monthly'):
+            data['frequency'] = bucket_start(data['order_date'], frequency)
         else:
             data['frequency'] = data['order_date'].dt.date  # Show only the date for daily frequency
         
@@ -318,6 +323,8 @@ def show_trend_view(metric_name, metric_data, frequency,start_date, end_date):
         st.plotly_chart(fig)
 
 # Sidebar for user inputs
+profile = start_profile("2_orders_kpi")
+profile.phase("widgets", "sidebar filters")
 st.sidebar.title("Filters")
 
 # Date range filter
@@ -335,9 +342,11 @@ frequency = st.sidebar.selectbox("Frequency", ["Daily", "Weekly", "Monthly"])
 
 
 # Fetch the aggregated data
+profile.phase("fetch", "orders API")
 aggregated_data, total_volume_sold_data, received_orders_data, total_revenue_data = fetch_data_from_api(start_date, end_date)
 
 # Payment Method filter 
+profile.phase("widgets", "payment filter and tabs")
 if aggregated_data is not None and not aggregated_data.empty:
     payment_method_filter = st.sidebar.selectbox(
         "Payment Method", options=['ALL'] + list(aggregated_data['payment_method'].unique())
@@ -347,6 +356,7 @@ tab1, tab2 = st.tabs(["Live Order Overview", "Order Weekly Report"])
 # Apply filters button
 if st.sidebar.button("Filter"):
 
+    profile.phase("transform", "order metrics")
     # Ensure the dataframes are not None and contain data before proceeding
     if total_volume_sold_data is not None and not total_volume_sold_data.empty:
         total_volume_sold_data.loc[:, 'order_date'] = pd.to_datetime(total_volume_sold_data['order_date'])
@@ -403,6 +413,7 @@ if st.sidebar.button("Filter"):
     }
 
     
+    profile.phase("chart", "order weekly report")
     with tab2:
         st.markdown(f"""
         <div style="background-color: #e0f7fa; padding: 20px; border-radius: 5px;">
@@ -453,6 +464,7 @@ if st.sidebar.button("Filter"):
     
         with st.expander("Total Volume Sold Trend"):
             show_trend_view('total_volume_sold', total_volume_sold_data,frequency,start_date, end_date)
+    profile.phase("chart", "live order overview")
     with tab1:
         # Live Order Overview
         # Check if payment_method_filter is defined, if not set a default
@@ -490,4 +502,6 @@ if st.sidebar.button("Filter"):
                 'completed_group_order_count': 'Completed Group Order Count',
                 'personal_order_count': 'Personal Order Count'
             
-            }).set_index('Date'), height=400, width=1000)
\ No newline at end of file
+            }).set_index('Date'), height=400, width=1000)
+
+profile.finish()
@@ -6,121 +6,85 @@ import plotly.express as px
 import plotly.graph_objects as go
 import seaborn as sns
 import matplotlib.pyplot as plt
-from db_pool import get_conn, release_conn
+from db_fetch import copy_frame, fetch_frame
+from db_pool import QUERY_CACHE_TTL, fresh_derived_tables, get_conn, release_conn
+from derived_tables import source
+from query_metrics import cache_data
+from group_leaders import KPI_COLUMNS, RESAMPLE_RULES, leader_kpis
+from render_profile import start_profile
+from sql_filters import date_range
+from time_buckets import bucket_start
 import numpy as np
 
 # Function to fetch and aggregate data
-@st.cache_data
+@cache_data
 def fetch_aggregated_data(start_date, end_date):
     conn = get_conn()
     
     try:
-        with conn.cursor() as cur:
-            
-            query_first = """
-           WITH aggregated_groups AS (
-    SELECT
-        DATE(g.created_at) AS group_created_date,
-        g.id AS group_id,
-        g.created_by AS group_leader,
-        gd.max_group_member AS max_group_member,
-        g.status,
-        LEAST(GREATEST(EXTRACT(EPOCH FROM (g.updated_at - g.created_at)) / 3600, 0), 24) AS completion_duration_hours
-    FROM
-        groups g
-    JOIN
-        group_deals gd ON g.group_deals_id = gd.id
-    WHERE
-        g.created_at BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-),
-new_group_leaders_cte AS (
-    SELECT 
-        g1.created_by AS group_leader,
-        MIN(g1.created_at)::DATE AS first_group_date
-    FROM 
-        groups g1
-    GROUP BY 
-        g1.created_by
-),
-group_stats AS (
-    SELECT
-        ag.group_created_date,
-        ag.group_leader,
-        ag.status,
-        ag.max_group_member,
-        ag.completion_duration_hours,
-        COUNT(*) FILTER (WHERE ag.status = 'COMPLETED') AS completed_groups,
-        COUNT(*) FILTER (WHERE ag.status = 'FAILED') AS failed_groups,
-        COUNT(DISTINCT ag.group_id) AS number_of_orders,
-        CASE 
-            WHEN ngl.first_group_date = ag.group_created_date THEN 1
-            ELSE 0
-        END AS is_new_group_leader
-    FROM
-        aggregated_groups ag
-    LEFT JOIN
-        new_group_leaders_cte ngl ON ag.group_leader = ngl.group_leader
-    GROUP BY
-        ag.group_created_date, ag.group_leader, ag.status, ag.max_group_member, ag.completion_duration_hours, ngl.first_group_date
+        daily_stats = source("daily_group_stats", fresh_derived_tables(), start_date, end_date)
+        query_first = f"""
+       WITH group_stats AS (
+-- Per-group facts pre-aggregated by rollups.py (daily_group_stats)
+SELECT *
+FROM {daily_stats} s
+WHERE s.group_created_date BETWEEN %s AND %s
 )
 SELECT
-    group_created_date,
-    group_leader,
-    status,
-    is_new_group_leader,
-    COUNT(DISTINCT group_leader) AS unique_group_leaders,
-    SUM(completed_groups) AS completed_groups,
-    SUM(failed_groups) AS failed_groups,
-    SUM(completed_groups) + SUM(failed_groups) AS total_groups,
-    AVG(completion_duration_hours) AS average_completion_duration,
-    AVG(max_group_member) AS average_group_size,
-    SUM(number_of_orders) AS number_of_orders,
-    COUNT(DISTINCT CASE WHEN status = 'COMPLETED' THEN group_leader END) AS unique_group_leaders_completed,
-    COUNT(DISTINCT CASE WHEN status = 'FAILED' THEN group_leader END) AS unique_group_leaders_failed,
-    COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END) AS new_group_leaders,
-    SUM(CASE WHEN is_new_group_leader = 1 AND status = 'COMPLETED' THEN 1 ELSE 0 END) AS new_completed_groups,
-    SUM(CASE WHEN is_new_group_leader = 1 AND status = 'FAILED' THEN 1 ELSE 0 END) AS new_failed_groups,
-    CASE
-        WHEN COUNT(DISTINCT group_leader) > 0 THEN CAST(SUM(completed_groups) AS FLOAT) / COUNT(DISTINCT group_leader)
-        ELSE 0.0
-    END AS unique_group_leaders_success_rate,
-    CASE
-        WHEN COUNT(DISTINCT group_leader) > 0 THEN CAST(SUM(failed_groups) AS FLOAT) / COUNT(DISTINCT group_leader)
-        ELSE 0.0
-    END AS unique_group_leaders_failure_rate,
-    CASE
-        WHEN COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END) > 0 THEN CAST(SUM(CASE WHEN is_new_group_leader = 1 AND status = 'COMPLETED' THEN 1 ELSE 0 END) AS FLOAT) / COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END)
-        ELSE 0.0
-    END AS new_group_leaders_success_rate,
-    CASE
-        WHEN COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END) > 0 THEN CAST(SUM(CASE WHEN is_new_group_leader = 1 AND status = 'FAILED' THEN 1 ELSE 0 END) AS FLOAT) / COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END)
-        ELSE 0.0
-    END AS new_group_leaders_failure_rate,
-    CASE
-        WHEN SUM(completed_groups + failed_groups) > 0 THEN CAST(SUM(completed_groups) AS FLOAT) / (SUM(completed_groups) + SUM(failed_groups))
-        ELSE 0.0
-    END AS success_rate,
-    CASE
-        WHEN SUM(completed_groups + failed_groups) > 0 THEN CAST(SUM(failed_groups) AS FLOAT) / (SUM(completed_groups) + SUM(failed_groups))
-        ELSE 0.0
-    END AS failure_rate
+group_created_date,
+group_leader,
+status,
+is_new_group_leader,
+COUNT(DISTINCT group_leader) AS unique_group_leaders,
+SUM(completed_groups) AS completed_groups,
+SUM(failed_groups) AS failed_groups,
+SUM(completed_groups) + SUM(failed_groups) AS total_groups,
+AVG(completion_duration_hours) AS average_completion_duration,
+AVG(max_group_member) AS average_group_size,
+SUM(number_of_orders) AS number_of_orders,
+COUNT(DISTINCT CASE WHEN status = 'COMPLETED' THEN group_leader END) AS unique_group_leaders_completed,
+COUNT(DISTINCT CASE WHEN status = 'FAILED' THEN group_leader END) AS unique_group_leaders_failed,
+COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END) AS new_group_leaders,
+SUM(CASE WHEN is_new_group_leader = 1 AND status = 'COMPLETED' THEN 1 ELSE 0 END) AS new_completed_groups,
+SUM(CASE WHEN is_new_group_leader = 1 AND status = 'FAILED' THEN 1 ELSE 0 END) AS new_failed_groups,
+CASE
+    WHEN COUNT(DISTINCT group_leader) > 0 THEN CAST(SUM(completed_groups) AS FLOAT) / COUNT(DISTINCT group_leader)
+    ELSE 0.0
+END AS unique_group_leaders_success_rate,
+CASE
+    WHEN COUNT(DISTINCT group_leader) > 0 THEN CAST(SUM(failed_groups) AS FLOAT) / COUNT(DISTINCT group_leader)
+    ELSE 0.0
+END AS unique_group_leaders_failure_rate,
+CASE
+    WHEN COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END) > 0 THEN CAST(SUM(CASE WHEN is_new_group_leader = 1 AND status = 'COMPLETED' THEN 1 ELSE 0 END) AS FLOAT) / COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END)
+    ELSE 0.0
+END AS new_group_leaders_success_rate,
+CASE
+    WHEN COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END) > 0 THEN CAST(SUM(CASE WHEN is_new_group_leader = 1 AND status = 'FAILED' THEN 1 ELSE 0 END) AS FLOAT) / COUNT(DISTINCT CASE WHEN is_new_group_leader = 1 THEN group_leader END)
+    ELSE 0.0
+END AS new_group_leaders_failure_rate,
+CASE
+    WHEN SUM(completed_groups + failed_groups) > 0 THEN CAST(SUM(completed_groups) AS FLOAT) / (SUM(completed_groups) + SUM(failed_groups))
+    ELSE 0.0
+END AS success_rate,
+CASE
+    WHEN SUM(completed_groups + failed_groups) > 0 THEN CAST(SUM(failed_groups) AS FLOAT) / (SUM(completed_groups) + SUM(failed_groups))
+    ELSE 0.0
+END AS failure_rate
 FROM
-    group_stats
+group_stats
 
 GROUP BY
-    group_created_date, group_leader, status,is_new_group_leader;
+group_created_date, group_leader, status,is_new_group_leader;
 
 
-            """
-            cur.execute(query_first,(start_date, end_date))
-            data_first = cur.fetchall()
-            colnames_first = [desc[0] for desc in cur.description]
-            df_first = pd.DataFrame(data_first, columns=colnames_first)
-            
-            # Filter data based on start_date and end_date
-            df_first['group_created_date'] = pd.to_datetime(df_first['group_created_date'])
-            
-            return df_first
+        """
+        df_first = fetch_frame(conn, query_first, (start_date, end_date))
+        
+        # Filter data based on start_date and end_date
+        df_first['group_created_date'] = pd.to_datetime(df_first['group_created_date'])
+        
+        return df_first
     
     except Exception as e:
         st.error(f"Error fetching data: {e}")
@@ -128,101 +92,102 @@ GROUP BY
     finally:
         if conn:
             release_conn(conn)
-@st.cache_data
+@cache_data
 def get_aggregated_data():
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            query = f"""
-            WITH incentivized_groups AS (
-                SELECT g.*,
-                       o.discount_rule_id
-                FROM "groups" g
-                JOIN groups_carts gc ON gc.user_id = g.created_by AND g.id = gc.group_id
+        firsts = source("user_firsts", fresh_derived_tables())
+        query = f"""
+        WITH incentivized_groups AS (
+            -- Each group once, however many discounted orders its leader
+            -- placed in it; a join would repeat its members' rows
+            SELECT g.*
+            FROM "groups" g
+            WHERE EXISTS (
+                SELECT 1
+                FROM groups_carts gc
                 JOIN orders o ON gc.id = o.groups_carts_id
                     AND o.status = 'COMPLETED'
                     AND o.deleted_at IS NULL
                     AND o.discount_rule_id IS NOT NULL
-            ),
-            incentivized_group_members AS (
-                SELECT gc.user_id,
-                       gc.group_id,
-                       gc.id AS group_cart_id,
-                       o.id AS order_id,
-                       ig.status AS group_status,
-                       o.created_at,
-                       gc.quantity,
-                       o.discount,
-                       o.discount_rule_id,
-                       CASE
-                           WHEN ig.created_by = gc.user_id THEN true
-                           ELSE false
-                       END AS is_admin,
-                       ROW_NUMBER() OVER (PARTITION BY gc.user_id ORDER BY gc.created_at ASC) AS rn
-                FROM incentivized_groups ig
-                JOIN groups_carts gc ON gc.group_id = ig.id
-                JOIN orders o ON gc.id = o.groups_carts_id
-                    AND o.status = 'COMPLETED'
-                    AND o.deleted_at IS NULL
-            )
-            SELECT igm.group_status,
-                   igm.created_at::DATE,
-                   COUNT(igm.order_id) AS total_order,
-                   COUNT(igm.order_id) FILTER (WHERE igm.discount_rule_id IS NOT NULL) AS total_order_with_discount,
-                   COUNT(DISTINCT igm.user_id) FILTER (WHERE igm.is_admin = true) AS unique_admins,
-                   COUNT(DISTINCT igm.user_id) FILTER (WHERE igm.is_admin = true AND rn = 1) AS unique_first_time_admins,
-                   COUNT(DISTINCT igm.user_id) FILTER (WHERE rn = 1) AS first_time_ordering_customers,
-                   SUM(igm.discount) FILTER (WHERE igm.discount_rule_id IS NOT NULL) AS total_discounts,
-                   SUM(igm.quantity) AS total_quantity,
-                   SUM(igm.quantity) FILTER (WHERE rn = 1) AS first_time_customer_quantity
-            FROM incentivized_group_members igm
-            GROUP BY igm.group_status, igm.created_at::DATE;
-            """
-            query_2 = f"""
-            WITH discount_usage AS (
-                SELECT
-                    gc.user_id,
-                    COUNT(o.id) AS usage_count
-                FROM
-                    orders o
-                JOIN
-                    groups_carts gc ON gc.id = o.groups_carts_id
-                    AND o.status = 'COMPLETED'
-                    AND o.deleted_at IS NULL
-                JOIN
-                    "groups" g ON g.id = gc.group_id
-                    AND g.status = 'COMPLETED'
-                WHERE
-                    o.discount_rule_id IS NOT NULL
-                GROUP BY
-                    gc.user_id
+                WHERE gc.user_id = g.created_by AND gc.group_id = g.id
             )
+        ),
+        incentivized_group_members AS (
+            SELECT gc.user_id,
+                   gc.group_id,
+                   gc.id AS group_cart_id,
+                   o.id AS order_id,
+                   ig.status AS group_status,
+                   o.created_at,
+                   gc.quantity,
+                   o.discount,
+                   o.discount_rule_id,
+                   CASE
+                       WHEN ig.created_by = gc.user_id THEN true
+                       ELSE false
+                   END AS is_admin,
+                   -- First order in an incentivized group, from user_firsts
+                   o.id = uf.first_incentivized_order_id AS is_first_order
+            FROM incentivized_groups ig
+            JOIN groups_carts gc ON gc.group_id = ig.id
+            JOIN orders o ON gc.id = o.groups_carts_id
+                AND o.status = 'COMPLETED'
+                AND o.deleted_at IS NULL
+            LEFT JOIN {firsts} uf ON uf.user_id = gc.user_id
+        )
+        SELECT igm.group_status,
+               igm.created_at::DATE,
+               COUNT(igm.order_id) AS total_order,
+               COUNT(igm.order_id) FILTER (WHERE igm.discount_rule_id IS NOT NULL) AS total_order_with_discount,
+               COUNT(DISTINCT igm.user_id) FILTER (WHERE igm.is_admin = true) AS unique_admins,
+               COUNT(DISTINCT igm.user_id) FILTER (WHERE igm.is_admin = true AND igm.is_first_order) AS unique_first_time_admins,
+               COUNT(DISTINCT igm.user_id) FILTER (WHERE igm.is_first_order) AS first_time_ordering_customers,
+               SUM(igm.discount) FILTER (WHERE igm.discount_rule_id IS NOT NULL) AS total_discounts,
+               SUM(igm.quantity) AS total_quantity,
+               SUM(igm.quantity) FILTER (WHERE igm.is_first_order) AS first_time_customer_quantity
+        FROM incentivized_group_members igm
+        GROUP BY igm.group_status, igm.created_at::DATE;
+        """
+        query_2 = f"""
+        WITH discount_usage AS (
             SELECT
-                usage_count,
-                COUNT(distinct user_id) AS number_of_users
+                gc.user_id,
+                COUNT(o.id) AS usage_count
             FROM
-                discount_usage
+                orders o
+            JOIN
+                groups_carts gc ON gc.id = o.groups_carts_id
+                AND o.status = 'COMPLETED'
+                AND o.deleted_at IS NULL
+            JOIN
+                "groups" g ON g.id = gc.group_id
+                AND g.status = 'COMPLETED'
+            WHERE
+                o.discount_rule_id IS NOT NULL
             GROUP BY
-                usage_count
-            ORDER BY
-                usage_count;
-
-            """
-            cur.execute(query)
-            data = cur.fetchall()
-            colnames = [desc[0] for desc in cur.description]
-            df = pd.DataFrame(data, columns=colnames)
-            
-            cur.execute(query_2)
-            data_2 = cur.fetchall()
-            colnames_2 = [desc[0] for desc in cur.description]
-            df_2 = pd.DataFrame(data_2, columns=colnames_2)
-            
-            return df,df_2
+                gc.user_id
+        )
+        SELECT
+            usage_count,
+            COUNT(distinct user_id) AS number_of_users
+        FROM
+            discount_usage
+        GROUP BY
+            usage_count
+        ORDER BY
+            usage_count;
+
+        """
+        df = fetch_frame(conn, query)
+        
+        df_2 = fetch_frame(conn, query_2)
+        
+        return df,df_2
     finally:
         if conn:
             release_conn(conn)
-@st.cache_data
+@cache_data
 def fetch_all_data():
     
     query_all = f"""
@@ -244,12 +209,9 @@ def fetch_all_data():
 
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            cur.execute(query_all)
-            data_all = cur.fetchall()
-            colnames_data_all = [desc[0] for desc in cur.description]
-            df_ = pd.DataFrame(data_all, columns=colnames_data_all)
-            return df_
+        # Unfiltered history, so it is sent with COPY
+        df_ = copy_frame(conn, query_all)
+        return df_
     except Exception as e:
         st.error(f"Error fetching data: {e}")
         return pd.DataFrame()
@@ -257,7 +219,11 @@ def fetch_all_data():
         if conn:
             release_conn(conn)
             
-def daily_GLAC_data():
+@cache_data(ttl=QUERY_CACHE_TTL)
+def daily_GLAC_data(start_date, end_date):
+    # Each user's first order and first admin order come from user_firsts
+    # (see derived_tables.py) instead of numbering their whole order history.
+    firsts = source("user_firsts", fresh_derived_tables())
     query_GLAC = f"""
         WITH overall_orders AS (
         SELECT gc.user_id,
@@ -274,42 +240,15 @@ def daily_GLAC_data():
         WHEN g.created_by = gc.user_id THEN true
         ELSE false
         END AS is_admin,
-        ROW_NUMBER() OVER (
-        PARTITION BY gc.user_id
-        ORDER BY o.created_at ASC
-        ) AS rn
+        o.id = uf.first_order_id AS is_first_order,
+        o.id = uf.first_admin_order_id AS is_first_admin_order
         FROM groups_carts gc
         JOIN groups g on g.id = gc.group_id
         JOIN orders o ON gc.id = o.groups_carts_id
         AND o.status = 'COMPLETED'
         AND o.deleted_at IS NULL
-        ),
-        admin_orders AS (
-        SELECT gc.user_id,
-        gc.group_id,
-        gc.id AS group_cart_id,
-        o.id AS order_id,
-        o.created_at,
-        CASE
-        WHEN g.status = 'COMPLETED' THEN 1
-        WHEN g.status = 'FAILED' THEN 2
-        ELSE 3
-        END AS priority,
-        ROW_NUMBER() OVER (
-        PARTITION BY gc.user_id
-        ORDER BY CASE
-        WHEN g.status = 'COMPLETED' THEN 1
-        WHEN g.status = 'FAILED' THEN 2
-        ELSE 3
-        END,
-        o.created_at ASC
-        ) AS admin_number
-        FROM groups g
-        JOIN groups_carts gc ON g.id = gc.group_id
-        JOIN orders o ON gc.id = o.groups_carts_id
-        WHERE o.status = 'COMPLETED'
-        AND o.deleted_at IS NULL
-        AND g.created_by = gc.user_id
+        LEFT JOIN {firsts} uf ON uf.user_id = gc.user_id
+        WHERE {date_range('o.created_at')}
         ),
         group_members as (
         SELECT o.user_id,
@@ -317,37 +256,33 @@ def daily_GLAC_data():
         o.group_cart_id,
         o.order_id,
         o.created_at::DATE AS created_at,
-        COALESCE(a.admin_number, NULL) AS admin_number,
-        o.rn AS order_number,
+        o.is_first_admin_order,
+        o.is_first_order,
         o.group_status,
         o.is_admin,
         o.discount_rule_id,
-        o.rn,
         o.discount_type,
         o.discount
         FROM overall_orders o
-        LEFT JOIN admin_orders a ON o.order_id = a.order_id
-        ORDER BY o.user_id,
-        o.rn ASC
         )
         SELECT created_at::DATE,
         group_status,
         COUNT(DISTINCT group_id) AS total_group,
         COUNT(DISTINCT user_id) FILTER (WHERE is_admin = true) AS total_unique_group_leaders,
-        COUNT(DISTINCT user_id) FILTER (WHERE admin_number = 1) AS total_new_group_leaders,
-        COUNT(DISTINCT user_id) FILTER (WHERE admin_number = 1 AND discount_rule_id IS NOT NULL) AS total_new_group_leaders_with_discount,
-        COUNT(DISTINCT user_id) FILTER (WHERE admin_number = 1 AND rn > 1) AS total_group_leaders_with_first_admin_order,
+        COUNT(DISTINCT user_id) FILTER (WHERE is_first_admin_order) AS total_new_group_leaders,
+        COUNT(DISTINCT user_id) FILTER (WHERE is_first_admin_order AND discount_rule_id IS NOT NULL) AS total_new_group_leaders_with_discount,
+        COUNT(DISTINCT user_id) FILTER (WHERE is_first_admin_order AND NOT is_first_order) AS total_group_leaders_with_first_admin_order,
         sum(discount) FILTER(where discount_type = 'FIXED') total_discounts,
-        sum(discount) FILTER(where discount_type = 'FIXED'and admin_number = 1) total_discounts_for_new_admin,
+        sum(discount) FILTER(where discount_type = 'FIXED'and is_first_admin_order) total_discounts_for_new_admin,
         CASE
                 WHEN COUNT(DISTINCT user_id) FILTER (
-                    WHERE admin_number = 1
+                    WHERE is_first_admin_order
                     AND discount_rule_id IS NOT NULL
                 ) > 0 THEN
                     SUM(discount) FILTER (
                         WHERE discount_type = 'FIXED'
                     ) / COUNT(DISTINCT user_id) FILTER (
-                        WHERE admin_number = 1
+                        WHERE is_first_admin_order
                         AND discount_rule_id IS NOT NULL
                     )
                 ELSE NULL
@@ -363,12 +298,8 @@ def daily_GLAC_data():
     """
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            cur.execute(query_GLAC)
-            data_all = cur.fetchall()
-            colnames_data_all = [desc[0] for desc in cur.description]
-            df_GLAC = pd.DataFrame(data_all, columns=colnames_data_all)
-            return df_GLAC
+        df_GLAC = fetch_frame(conn, query_GLAC, (start_date, end_date))
+        return df_GLAC
     except Exception as e:
         st.error(f"Error fetching data: {e}")
         return pd.DataFrame()
@@ -377,7 +308,7 @@ def daily_GLAC_data():
             release_conn(conn)
 
 # Fetch data with caching
-@st.cache_data
+@cache_data
 def fetch_data(start_date, end_date, frequency, selected_products, selected_group_size):
     date_trunc = {
         'Daily': "DATE_TRUNC('day', gc.created_at)::date",
@@ -399,23 +330,9 @@ def fetch_data(start_date, end_date, frequency, selected_products, selected_grou
         group_size_filter = f"AND gd.max_group_member IN ({group_size_placeholders})"
         params.extend(selected_group_size)
 
+    firsts = source("user_firsts", fresh_derived_tables())
     query = f"""
-        WITH first_order AS (
-            SELECT
-                gc.user_id,
-                gc.group_id,
-                gc.id AS group_cart_id,
-                gc.created_at,
-                ROW_NUMBER() OVER (PARTITION BY gc.user_id ORDER BY gc.created_at ASC) AS rn
-            FROM
-                groups_carts gc
-            JOIN
-                orders o ON gc.id = o.groups_carts_id
-            WHERE
-                o.status = 'COMPLETED'
-                AND o.deleted_at IS NULL
-        ),
-        group_quantity AS (
+        WITH group_quantity AS (
             SELECT
                 g.id,
                 SUM(gc.quantity) AS total_quantity
@@ -429,20 +346,21 @@ def fetch_data(start_date, end_date, frequency, selected_products, selected_grou
                 AND o.status = 'COMPLETED'
                 AND o.deleted_at IS NULL
             WHERE
-                g.created_at BETWEEN %s AND %s + interval '1 day' - interval '1 second'
+                {date_range('g.created_at')}
             GROUP BY
                 g.id
         ),
         first_time_customers AS (
+            -- Customers whose first group cart (from user_firsts) is in the group
             SELECT
-                fo.group_id,
-                COUNT(DISTINCT fo.user_id) AS first_time_customers
+                uf.first_group_id AS group_id,
+                COUNT(DISTINCT uf.user_id) AS first_time_customers
             FROM
-                first_order fo
+                {firsts} uf
             WHERE
-                fo.rn = 1
+                uf.first_group_id IN (SELECT id FROM group_quantity)
             GROUP BY
-                fo.group_id
+                uf.first_group_id
         )
         SELECT
             {date_trunc} AS date,
@@ -488,86 +406,82 @@ def fetch_data(start_date, end_date, frequency, selected_products, selected_grou
 
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            cur.execute(query, params)
-            data = cur.fetchall()
-            
-            if not data:  # Check if no data is returned
-                st.error("No data found for the selected date range.")
-                return pd.DataFrame()
-            
-            colnames_data = [desc[0] for desc in cur.description]
-            df = pd.DataFrame(data, columns=colnames_data)
+        df = fetch_frame(conn, query, params)
+        
+        if df.empty:  # Check if no data is returned
+            st.error("No data found for the selected date range.")
+            return pd.DataFrame()
+        
 
-            # Ensure Arrow compatibility by converting to numeric types where necessary
-            df['max_group_member'] = pd.to_numeric(df['max_group_member'], errors='coerce')
-            df['first_time_customers'] = pd.to_numeric(df['first_time_customers'], errors='coerce')
-            df['customer_created_after_group'] = pd.to_numeric(df['customer_created_after_group'], errors='coerce')
-            df['customer_created_after_group_deal'] = pd.to_numeric(df['customer_created_after_group_deal'], errors='coerce')
-            df['num_of_group_carts'] = pd.to_numeric(df['num_of_group_carts'], errors='coerce')
-            df['total_quantity'] = pd.to_numeric(df['total_quantity'], errors='coerce')
+        # Ensure Arrow compatibility by converting to numeric types where necessary
+        df['max_group_member'] = pd.to_numeric(df['max_group_member'], errors='coerce')
+        df['first_time_customers'] = pd.to_numeric(df['first_time_customers'], errors='coerce')
+        df['customer_created_after_group'] = pd.to_numeric(df['customer_created_after_group'], errors='coerce')
+        df['customer_created_after_group_deal'] = pd.to_numeric(df['customer_created_after_group_deal'], errors='coerce')
+        df['num_of_group_carts'] = pd.to_numeric(df['num_of_group_carts'], errors='coerce')
+        df['total_quantity'] = pd.to_numeric(df['total_quantity'], errors='coerce')
 
-            # Calculate the summary metrics
-            total_num_of_group = df['num_of_group_carts'].count()
+        # Calculate the summary metrics
+        total_num_of_group = df['num_of_group_carts'].count()
 
-            # Calculate the sum for all numeric columns except 'max_group_member'
-            totals = df.sum(numeric_only=True)
+        # Calculate the sum for all numeric columns except 'max_group_member'
+        totals = df.sum(numeric_only=True)
 
-            # Preserve the original value of 'max_group_member'
-            totals['max_group_member'] = df['max_group_member'].iloc[0]
+        # Preserve the original value of 'max_group_member'
+        totals['max_group_member'] = df['max_group_member'].iloc[0]
 
-            # Add a new 'Row Type' column to differentiate between data and summary rows
-            df['Row Type'] = 'Data'
+        # Add a new 'Row Type' column to differentiate between data and summary rows
+        df['Row Type'] = 'Data'
 
-            # Prepare the total row
-            total_row = pd.DataFrame([totals], columns=totals.index)
-            total_row['Row Type'] = 'Total'
-            
-            # Add the CA row (handling division by zero)
-            ca_row = pd.DataFrame([{
-                'date': np.nan,
-                'product_name': np.nan,
-                'max_group_member': np.nan,
-                'first_time_customers': (df['first_time_customers'].sum() / total_num_of_group
-                                        if total_num_of_group > 0 else np.nan),
-                'customer_created_after_group': (df['customer_created_after_group'].sum() / total_num_of_group
+        # Prepare the total row
+        total_row = pd.DataFrame([totals], columns=totals.index)
+        total_row['Row Type'] = 'Total'
+        
+        # Add the CA row (handling division by zero)
+        ca_row = pd.DataFrame([{
+            'date': np.nan,
+            'product_name': np.nan,
+            'max_group_member': np.nan,
+            'first_time_customers': (df['first_time_customers'].sum() / total_num_of_group
+                                    if total_num_of_group > 0 else np.nan),
+            'customer_created_after_group': (df['customer_created_after_group'].sum() / total_num_of_group
+                                            if total_num_of_group > 0 else np.nan),
+            'customer_created_after_group_deal': (df['customer_created_after_group_deal'].sum() / total_num_of_group
                                                 if total_num_of_group > 0 else np.nan),
-                'customer_created_after_group_deal': (df['customer_created_after_group_deal'].sum() / total_num_of_group
-                                                    if total_num_of_group > 0 else np.nan),
-                'num_of_group_carts': np.nan,
-                'total_quantity': np.nan,
-                'Row Type': 'CA'
-            }])
-
-            # Add the per Group Quantity row (handling division by zero)
-            per_group_quantity_row = pd.DataFrame([{
-                'date': np.nan, 'product_name': np.nan, 'max_group_member': np.nan,
-                'first_time_customers': np.nan, 'customer_created_after_group': np.nan,
-                'customer_created_after_group_deal': np.nan, 'num_of_group_carts': np.nan,
-                'total_quantity': (df['total_quantity'].sum() / total_num_of_group
-                                if total_num_of_group > 0 else np.nan),
-                'Row Type': 'per Group Quantity'
-            }])
-
-            # Add the Engagement Ratio row (handling division by zero)
-            s = (total_num_of_group or 0) * df['max_group_member'].max()
-            engagement_ratio = df['total_quantity'].sum() / s if s > 0 else np.nan
-
-            engagement_ratio_row = pd.DataFrame([{
-                'date': np.nan, 'product_name': np.nan, 'max_group_member': np.nan,
-                'first_time_customers': np.nan, 'customer_created_after_group': np.nan,
-                'customer_created_after_group_deal': np.nan, 'num_of_group_carts': np.nan,
-                'total_quantity': engagement_ratio,
-                'Row Type': 'Engagement ratio'
-            }])
-
-            # Concatenate all rows
-            df = pd.concat([df, total_row, ca_row, per_group_quantity_row, engagement_ratio_row], ignore_index=True)
-
-            # Drop 'created_by' as it is not needed
-            df = df.drop(columns=['created_by'], errors='ignore')
-
-            return df
+            'num_of_group_carts': np.nan,
+            'total_quantity': np.nan,
+            'Row Type': 'CA'
+        }])
+
+        # Add the per Group Quantity row (handling division by zero)
+        per_group_quantity_row = pd.DataFrame([{
+            'date': np.nan, 'product_name': np.nan, 'max_group_member': np.nan,
+            'first_time_customers': np.nan, 'customer_created_after_group': np.nan,
+            'customer_created_after_group_deal': np.nan, 'num_of_group_carts': np.nan,
+            'total_quantity': (df['total_quantity'].sum() / total_num_of_group
+                            if total_num_of_group > 0 else np.nan),
+            'Row Type': 'per Group Quantity'
+        }])
+
+        # Add the Engagement Ratio row (handling division by zero)
+        s = (total_num_of_group or 0) * df['max_group_member'].max()
+        engagement_ratio = df['total_quantity'].sum() / s if s > 0 else np.nan
+
+        engagement_ratio_row = pd.DataFrame([{
+            'date': np.nan, 'product_name': np.nan, 'max_group_member': np.nan,
+            'first_time_customers': np.nan, 'customer_created_after_group': np.nan,
+            'customer_created_after_group_deal': np.nan, 'num_of_group_carts': np.nan,
+            'total_quantity': engagement_ratio,
+            'Row Type': 'Engagement ratio'
+        }])
+
+        # Concatenate all rows
+        df = pd.concat([df, total_row, ca_row, per_group_quantity_row, engagement_ratio_row], ignore_index=True)
+
+        # Drop 'created_by' as it is not needed
+        df = df.drop(columns=['created_by'], errors='ignore')
+
+        return df
     finally:
         if conn:
             release_conn(conn)
@@ -926,17 +840,6 @@ def show_metric_trend_weekly(data, selected_frequency, start_date, end_date):
         fig.update_yaxes(title=f"{metric1.replace('_', ' ').title()} and {metric2.replace('_', ' ').title()}")
         st.plotly_chart(fig)
 
-def calculate_kpis(df):
-    total_group_leader = df['group_leader'].count()
-    total_unique_group_leader = df['group_leader'].nunique()
-    total_New_group_leader = df[df['is_new_group_leader'] == 1]['group_leader'].nunique()
-    return pd.Series({
-        'Total Group Leader': total_group_leader,
-        'Total Unique Group Leader': total_unique_group_leader,
-        'Total New Group Leaders':total_New_group_leader
-    })
-
-
 def resample_data(df, freq):
     if not isinstance(df, pd.DataFrame):
         raise ValueError("Expected a DataFrame, got something else.")
@@ -948,17 +851,16 @@ def resample_data(df, freq):
     
     # Check if the temporary DataFrame is empty
     if df.empty:
-        return pd.DataFrame(columns=['group_created_date', 'Total Group Leader', 'Total Unique Group Leader', 'Total New Group Leaders'])
-    
-    
-    if freq == 'daily':
-        return df.resample('D', on='group_created_date').apply(calculate_kpis).reset_index()
-    elif freq == 'weekly':
-        return df.resample('W-Mon', on='group_created_date').apply(calculate_kpis).reset_index()
-    elif freq == 'monthly':
-        return df.resample('M', on='group_created_date').apply(calculate_kpis).reset_index()
+        return pd.DataFrame(columns=['group_created_date'] + KPI_COLUMNS)
+
+    # Any other frequency gives None, as before leader_kpis
+    if freq not in RESAMPLE_RULES:
+        return None
+    return leader_kpis(df, freq)
 
 # Streamlit application
+profile = start_profile("3_group_kpi")
+profile.phase("widgets", "title and sidebar filters")
 st.title('Group Metrics Trend Dashboard')
 
 # Date range filter
@@ -972,10 +874,12 @@ end_date = pd.to_datetime(end_date)
 frequency_options = ['daily', 'weekly', 'monthly']
 selected_frequency = st.sidebar.selectbox('Select Frequency', frequency_options)
 # Fetch aggregated data
+profile.phase("fetch", "group stats and incentivized groups")
 data_first = fetch_aggregated_data(start_date,end_date)
 data_incentivized, data_usage = get_aggregated_data()
 
 # Adding status filter
+profile.phase("widgets", "status filter and tabs")
 status_options = ['all', 'formed', 'COMPLETED', 'FAILED']
 selected_status = st.sidebar.selectbox('Select Status', status_options)
 
@@ -989,6 +893,7 @@ if st.sidebar.button("Filter"):
       
         # data_filtered = data_first[(data_first['group_created_date'].between(start_date, end_date))]
         
+        profile.phase("transform", "weekly report KPIs")
         if selected_status == 'all':
             # data_filtered
             data_first = data_first[(data_first['group_created_date'] >= start_date) & (data_first['group_created_date'] <= end_date)]
@@ -1004,9 +909,11 @@ if st.sidebar.button("Filter"):
       
         kpis_filtered = resample_data(data_first, selected_frequency)
         
+        profile.phase("widgets", "weekly report table")
         st.dataframe(kpis_filtered.set_index('group_created_date'),height=400, width=800)
 
         # Plotting line charts for the KPIs
+        profile.phase("chart", "weekly report trends")
         st.line_chart(kpis_filtered.set_index('group_created_date')[[ 'Total Group Leader', 'Total Unique Group Leader','Total New Group Leaders']])
         with st.expander("Group Metrics Trends"):
             show_metric_trend_weekly(data_first,selected_frequency,start_date,end_date)
@@ -1016,10 +923,12 @@ with tab2:
     end_date = pd.to_datetime(end_date).normalize()
 
     # Fetch all data without group size filters
+    profile.phase("fetch", "group deal products")
     df_1 = fetch_all_data()
     if not df_1.empty:
         # Filter and display group sizes based on actual data in df_1
         st.header("Explore Customer Acquisition by Selecting Products and Group Sizes")
+        profile.phase("transform", "product and group size options")
         most_sold_products = df_1.groupby('product_name')['total_quantity'].sum().reset_index().sort_values(by='total_quantity', ascending=False)
         sorted_product_names = most_sold_products['product_name'].tolist()
         selected_products = st.multiselect("Select products", sorted_product_names)
@@ -1030,8 +939,10 @@ with tab2:
         selected_group_size = st.multiselect("Select group size", group_size)
 
       # Add the new metrics
+    profile.phase("fetch", "customer acquisition")
     df = fetch_data(start_date, end_date, selected_frequency, selected_products, selected_group_size)
     
+    profile.phase("widgets", "customer acquisition table")
     selected_products_str = ', '.join(selected_products) if selected_products else "All Products"
     selected_group_size_str = ', '.join(map(str, selected_group_size)) if selected_group_size else "All Group Sizes"
     
@@ -1094,6 +1005,7 @@ with tab2:
             **Insights**: The heatmap helps identify which metrics move together. For example, if `max_group_member` is highly correlated with `first_time_orders`, it suggests that larger groups are likely to bring in more new customers. This insight can guide strategies, such as focusing on increasing group sizes to boost first-time orders.
             """)
         
+        profile.phase("chart", "correlation heatmap")
         corr_matrix = df[['max_group_member', 'first_time_customers','customer_created_after_group','customer_created_after_group_deal',  'total_quantity']].corr()
         plt.figure(figsize=(10, 8))
         sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', vmin=-1, vmax=1)
@@ -1110,6 +1022,7 @@ with tab2:
             **Insights**: This visualization helps identify patterns and trends. For example, you might see that certain date have higher  values, which correspond to peaks in `first_time_customers`. This can help in understanding seasonal trends or the impact of specific campaigns on group size and customer behavior.
             """)
        
+        profile.phase("transform", "first-time customers by date")
         aggregated_df = df.groupby('date')['first_time_customers'].sum().reset_index()
         
         # Reindex the aggregated DataFrame to include all dates
@@ -1117,6 +1030,7 @@ with tab2:
         aggregated_df.columns = ['date', 'first_time_customers']  # Rename columns
 
         # Create a bar chart for first-time customers over time
+        profile.phase("chart", "first-time customers")
         fig5 = go.Figure()
 
         # Add bar trace
@@ -1137,6 +1051,7 @@ with tab2:
         # Render the chart in Streamlit
         st.plotly_chart(fig5)
       
+        profile.phase("transform", "top first-time products")
         fig4_new = go.Figure()
         # Filter out products with no first-time order values
         df = df[df['first_time_customers'] > 0]
@@ -1149,12 +1064,14 @@ with tab2:
         df = df.merge(product_quantities, on='product_name', suffixes=('', '_total'))
         
         
+        profile.phase("chart", "top first-time products")
         fig = plot_time_series_with_metrics(df, 'first_time_customers')
         st.plotly_chart(fig)
         
 with tab3:
     if start_date == end_date:
             end_date += pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    profile.phase("transform", "incentivized summary")
     metrics = {
     "Total Orders": data_incentivized["total_order"].sum(),
     "Orders with Discount": data_incentivized["total_order_with_discount"].sum(),
@@ -1163,6 +1080,7 @@ with tab3:
     "Total Discounts Given": f"{data_incentivized['total_discounts'].sum():,.2f}Birr",
     }
 
+    profile.phase("widgets", "incentivized metrics and usage")
     st.subheader("Incentivized Groups Summary Metrics")
 
     # Arrange metrics in 2 rows of 4 columns each
@@ -1190,19 +1108,17 @@ with tab4:
         st.error("Start Date cannot be after End Date.")
     else:
         # Fetch and filter data
-        df_GLAC = daily_GLAC_data()
+        profile.phase("fetch", "daily GLAC")
+        df_GLAC = daily_GLAC_data(start_date, end_date)
         if not df_GLAC.empty:
             # Convert the created_at column to datetime
-            df_GLAC['created_at'] = pd.to_datetime(df_GLAC['created_at'])
-            # Apply date filter
-            df_filtered = df_GLAC[(df_GLAC['created_at'] >= pd.Timestamp(start_date)) & 
-                                (df_GLAC['created_at'] <= pd.Timestamp(end_date))]
+            profile.phase("transform", "GLAC aggregation")
+            df_filtered = df_GLAC
+            df_filtered['created_at'] = pd.to_datetime(df_filtered['created_at'])
 
             # Apply aggregation based on the frequency
-            if selected_frequency == "weekly":
-                df_filtered['period'] = df_filtered['created_at'].dt.to_period('W').apply(lambda r: r.start_time)
-            elif selected_frequency == "monthly":
-                df_filtered['period'] = df_filtered['created_at'].dt.to_period('M').apply(lambda r: r.start_time)
+            if selected_frequency in ("weekly", "monthly"):
+                df_filtered['period'] = bucket_start(df_filtered['created_at'], selected_frequency)
             else:
                 df_filtered['period'] = df_filtered['created_at']
 
@@ -1222,10 +1138,12 @@ with tab4:
             }).reset_index()
 
             # Display data
+            profile.phase("widgets", "GLAC table")
             st.subheader("Daily GLAC Data")
             st.dataframe(aggregated_data)
 
        # Filter data for group status = 'COMPLETED'
+            profile.phase("chart", "group leaders summary")
             completed_data = aggregated_data[aggregated_data['group_status'] == 'COMPLETED']
 
             # Plotly Visualization
@@ -1282,4 +1200,6 @@ with tab4:
             # st.line_chart(aggregated_data.set_index('period')[['group_leader_acquisition_cost', 'total_new_group_leaders_with_discount']])
         else:
             st.warning("No data available for the selected period.")
-    
\ No newline at end of file
+    
+
+profile.finish()
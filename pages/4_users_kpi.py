@@ -2,33 +2,28 @@ import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import psycopg2
 import altair as alt
 from datetime import datetime, timedelta
-from db_pool import get_conn, release_conn
-# Function to get data from the database
-@st.cache_data
-def get_data(query):
-    conn = get_conn()
-    if not conn:
-        return pd.DataFrame()
-    try:
-        return pd.read_sql(query, conn)
-    except Exception as e:
-        st.error(f"Error fetching data: {e}")
-        return pd.DataFrame()
-    finally:
-        release_conn(conn)
+from users_kpi import get_user_kpis
+from query_metrics import cache_data
+from deferred_loads import filters_applied, load_requests
+from render_profile import start_profile
 
+profile = start_profile("4_users_kpi")
+profile.phase("widgets", "sidebar filters")
 st.sidebar.success("Select KPI above.")
 st.sidebar.header("Users KPI")
 
 default_start_date = datetime.today() - timedelta(days=7)
-start_date = st.sidebar.date_input("Start date", default_start_date)
-end_date = st.sidebar.date_input("End date", datetime.today())
+# Nothing is queried until Filter is pressed
+with st.sidebar.form("filters"):
+    start_date = st.date_input("Start date", default_start_date)
+    end_date = st.date_input("End date", datetime.today())
+    frequency = st.selectbox("Frequency", ["Daily", "Weekly", "Monthly"])
+    submitted = st.form_submit_button("Filter")
 start_date = pd.to_datetime(start_date)
 end_date = pd.to_datetime(end_date)
-frequency = st.sidebar.selectbox("Frequency", ["Daily", "Weekly", "Monthly"])
+applied = filters_applied("4_users_kpi", submitted)
 
 # Determine SQL date part based on frequency
 if frequency == "Daily":
@@ -49,101 +44,8 @@ The data is filtered to include only verified users and completed orders.
 - **Frequency**: Data aggregation based on the selected frequency (Daily, Weekly, Monthly).
 """)
 
-# SQL Queries with date filter, frequency aggregation, and status filters
-query_loyalty = f"""
-    SELECT 
-        u.id AS user_id, 
-        u.name, 
-        u.phone,
-        u.user_status,
-        SUM(o.total_amount) AS total_spent, 
-        COUNT(o.id) AS total_orders
-    FROM 
-        users u
-    LEFT JOIN 
-        groups_carts gc ON u.id = gc.user_id
-    LEFT JOIN 
-        orders o ON gc.id = o.groups_carts_id
-    WHERE 
-        o.created_at BETWEEN '{start_date}' AND '{end_date}'
-        AND u.user_status = 'VERIFIED'
-        AND o.status = 'COMPLETED'
-    GROUP BY 
-        u.id, u.name, u.phone
-    ORDER BY 
-        total_spent DESC
-    LIMIT 10;
-"""
-
-query_gender = f"""
-    SELECT 
-        gender, 
-        COUNT(*) AS count
-    FROM 
-        users
-    WHERE 
-        created_at BETWEEN '{start_date}' AND '{end_date}'
-        AND user_status = 'VERIFIED'
-    GROUP BY 
-        gender;
-"""
-
-query_age = f"""
-    SELECT 
-        CASE 
-            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, user_birthday)) BETWEEN 18 AND 25 THEN '18-25'
-            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, user_birthday)) BETWEEN 26 AND 35 THEN '26-35'
-            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, user_birthday)) BETWEEN 36 AND 45 THEN '36-45'
-            ELSE '46+'
-        END AS age_bracket,
-        COUNT(*) AS count
-    FROM 
-        users
-    WHERE 
-        created_at BETWEEN '{start_date}' AND '{end_date}'
-        AND user_status = 'VERIFIED'
-    GROUP BY 
-        age_bracket;
-"""
-
-query_gender_age = f"""
-    SELECT 
-        gender,
-        CASE 
-            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, user_birthday)) BETWEEN 18 AND 25 THEN '18-25'
-            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, user_birthday)) BETWEEN 26 AND 35 THEN '26-35'
-            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, user_birthday)) BETWEEN 36 AND 45 THEN '36-45'
-            ELSE '46+'
-        END AS age_bracket,
-        COUNT(*) AS count
-    FROM 
-        users
-    WHERE 
-        created_at BETWEEN '{start_date}' AND '{end_date}'
-        AND user_status = 'VERIFIED'
-    GROUP BY 
-        gender, age_bracket;
-"""
-query_device = f"""
-    SELECT 
-        user_id,
-        os,
-        created_at
-    FROM 
-        devices
-    WHERE 
-        created_at BETWEEN '{start_date}' AND '{end_date}';
-"""
-# Load data
-df_loyalty = get_data(query_loyalty)
-df_gender = get_data(query_gender)
-df_age = get_data(query_age)
-df_gender_age = get_data(query_gender_age)
-df_device = get_data(query_device)
-
-
 # Function to visualize OS distribution
-@st.cache_data
+@cache_data
 def visualize_os_distribution(df, selected_date_range):
     start_date, end_date = selected_date_range
     
@@ -152,7 +54,7 @@ def visualize_os_distribution(df, selected_date_range):
     
     # Filter DataFrame for orders within the selected date range
     filtered_data = df[(df['created_at'] >= start_date) & 
-                       (df['created_at'] <= end_date)]
+                       (df['created_at'] < end_date + pd.Timedelta(days=1))]
     
     if filtered_data.empty:
         st.markdown(f"No data available for the selected date range.")
@@ -174,9 +76,19 @@ def visualize_os_distribution(df, selected_date_range):
     
     # Display the chart
     st.altair_chart(chart, use_container_width=True)
-# Apply filters button
-if st.sidebar.button("Filter"):    
+
+if applied:
+    # Loyalty, gender/age and device data for the date range in one round trip
+    profile.phase("fetch", "user KPIs")
+    user_kpis = load_requests("4_users_kpi", {"user_kpis": (get_user_kpis, start_date, end_date)}, submitted)["user_kpis"]
+    df_loyalty = user_kpis["loyalty"]
+    df_gender = user_kpis["gender"]
+    df_age = user_kpis["age"]
+    df_gender_age = user_kpis["gender_age"]
+    df_device = user_kpis["device"]
+
     # Streamlit App
+    profile.phase("chart", "user charts")
     st.title('User KPIs Dashboard')
     # Drop 'user_id' and 'user_status' columns from the dataframe before displaying
     df_loyalty_display = df_loyalty.drop(columns=['user_id','user_status'])
@@ -215,3 +127,8 @@ if st.sidebar.button("Filter"):
     # Visualizing OS Distribution
     st.header('OS Distribution')
     visualize_os_distribution(df_device, (start_date, end_date))
+
+else:
+    st.info("Choose a date range and press Filter to load the user KPIs.")
+
+profile.finish()
@@ -4,297 +4,192 @@ import streamlit as st
 import altair as alt
 import folium
 from streamlit_folium import folium_static
-from folium.plugins import MarkerCluster
+from folium.plugins import FastMarkerCluster, HeatMap
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 #applying centeralized connection pool
-from db_pool import get_conn, release_conn
+from db_fetch import fetch_frame
+from db_pool import fresh_derived_tables, get_conn, release_conn
+from derived_tables import source
+from deferred_loads import filters_applied, load_requests
+from query_metrics import cache_data
+from sql_filters import date_range
+from time_buckets import bucket_start
 from plotly.subplots import make_subplots
 
 import matplotlib.pyplot as plt
 from st_aggrid import AgGrid, GridOptionsBuilder
-from geopy.distance import geodesic
+from geo_clusters import cluster_labels, heat_grid
+from render_profile import start_profile
 
-@st.cache_data
+@cache_data
 def fetch_aggregated_data(start_date, end_date, driver_ids):
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            # Build the new driver condition based on the selected driver IDs
-            driver_condition = ""
-            params = [start_date, end_date]
-            
-            if driver_ids:
-                driver_condition = "AND d.driver_id = ANY(%s::uuid[])"
-                
-                params.append(driver_ids)
-            
-            # Subquery for pre-aggregating distance traveled and drop-offs
-            query_routes = f"""
-                SELECT 
-                    sub.period,
-                    sub.driver_id,
-                    SUM(sub.total_distance_without_return) AS total_distance_without_return,
-                    SUM(sub.total_drop_offs) AS total_drop_offs,
-                    SUM(sub.total_operational_capacity_utilized) AS total_operational_capacity_utilized
-                FROM (
-                    SELECT 
-                        date_trunc('day', r.start_time) AS period, 
-                        d.driver_id,
-                        r.distance AS total_distance_without_return,
-                        jsonb_array_length(r.location_ids::jsonb) AS total_drop_offs,
-                        r.weight AS total_operational_capacity_utilized
-                    FROM routes r
-                    JOIN delivery_tracks d ON r.id = d.route_id
-                    WHERE date_trunc('day', r.start_time) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-                    {driver_condition}
-                    GROUP BY period, d.driver_id, r.distance, r.location_ids, r.weight
-                ) sub
-                GROUP BY sub.period, sub.driver_id
-                ORDER BY sub.period;
-            """
-            cur.execute(query_routes, params)
-            data_routes = cur.fetchall()
-            colnames_routes = [desc[0] for desc in cur.description]
-
-            df_routes = pd.DataFrame(data_routes, columns=colnames_routes)
-
-            query_orders = f"""
-                SELECT 
-                    sub.period,
-                    sub.driver_id,
-                    COUNT(DISTINCT sub.order_id) AS number_of_orders,
-                    COUNT(DISTINCT sub.group_cart_id) AS number_of_group_orders,
-                    COUNT(DISTINCT sub.personal_cart_id) AS number_of_personal_orders,
-                    SUM( CASE WHEN sub.delivered IS NOT NULL THEN 1 ELSE 0 END) AS number_of_delivered_orders
-                FROM (
-                    SELECT 
-                        date_trunc('day', d.in_transit) AS period, 
-                        d.driver_id,
-                        d.id AS order_id,
-                        d.group_cart_id,
-                        d.personal_cart_id,
-                        d.delivered
-                    FROM delivery_tracks d
-                    WHERE d.in_transit IS NOT NULL
-                    AND date_trunc('day', d.in_transit) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-                    {driver_condition}
-                    GROUP BY period, d.driver_id, d.id, d.group_cart_id, d.personal_cart_id, d.delivered
-                ) sub
-                GROUP BY sub.period, sub.driver_id
-                ORDER BY sub.period;
-            """
-            cur.execute(query_orders, params)
-            data_orders = cur.fetchall()
-            colnames_orders = [desc[0] for desc in cur.description]
-
-            df_orders = pd.DataFrame(data_orders, columns=colnames_orders)
-            
-            query_delivered_percentage = f"""
-                SELECT 
-                    date_trunc('day', d.created_at) AS period,
+        # Build the new driver condition based on the selected driver IDs
+        driver_condition = ""
+        params = {'start_date': start_date, 'end_date': end_date}
+
+        if driver_ids:
+            driver_condition = "AND d.driver_id = ANY(%(driver_ids)s::uuid[])"
+
+            params['driver_ids'] = driver_ids
+
+        # Every per (period, driver) metric in one statement: one scan of
+        # routes, one of delivery_tracks and one of the driver rollup,
+        # joined on the key instead of merged in pandas afterwards.
+        fresh = fresh_derived_tables()
+        track_counts = source("daily_driver_track_counts", fresh)
+        driver_deliveries = source("daily_driver_deliveries", fresh, start_date, end_date)
+        query_driver_metrics = f"""
+            WITH route_days AS (
+                SELECT
+                    date_trunc('day', r.start_time) AS period,
                     d.driver_id,
-                    ((SELECT COUNT(id) FROM delivery_tracks WHERE delivered IS NOT NULL AND driver_id = d.driver_id )::float / 
-                     NULLIF((SELECT COUNT(id) FROM delivery_tracks WHERE assigned IS NOT NULL AND driver_id = d.driver_id ), 0)) * 100 AS delivered_percentage
-                FROM delivery_tracks d
-                WHERE date_trunc('day', d.created_at) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
+                    r.distance,
+                    r.location_ids,
+                    r.weight
+                FROM routes r
+                JOIN delivery_tracks d ON r.id = d.route_id
+                WHERE {date_range('r.start_time', '%(start_date)s', '%(end_date)s')}
                 {driver_condition}
-                GROUP BY period, d.driver_id
-                ORDER BY period;
-            """
-
-            cur.execute(query_delivered_percentage, params)
-            data_delivered_percentage = cur.fetchall()
-            colnames_delivered_percentage = [desc[0] for desc in cur.description]
-            df_delivered_percentage = pd.DataFrame(data_delivered_percentage, columns=colnames_delivered_percentage)
-            # query for Delivered Percentage per Driver (DELIVERED VS ASSIGNED) based on the selected ferquency
-            
-            query_delivered_percentage_each_day = f"""
-                WITH daily_counts AS (
-                    SELECT 
-                        date_trunc('day', d.in_transit) AS period,
-                        d.driver_id,
-                        COUNT(*) FILTER (WHERE d.delivered IS NOT NULL) AS daily_delivered_count,
-                        COUNT(*) FILTER (WHERE d.assigned IS NOT NULL ) AS daily_assigned_count
-                    FROM delivery_tracks d
-                    WHERE date_trunc('day', d.in_transit) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-                    
-                    {driver_condition}
-                    GROUP BY period, d.driver_id
-                )
-                SELECT 
+                GROUP BY period, d.driver_id, r.distance, r.location_ids, r.weight
+            ),
+            route_metrics AS (
+                SELECT
                     period,
                     driver_id,
-                    (daily_delivered_count::float / NULLIF(daily_assigned_count, 0)) * 100 AS delivered_percentage_per_day
-                FROM daily_counts
-                ORDER BY period;
-            """
-            
-
-            cur.execute(query_delivered_percentage_each_day,params)
-            data_delivered_percentage_each_day = cur.fetchall()
-            colnames_delivered_percentage_each_day = [desc[0] for desc in cur.description]
-            df_delivered_percentage_each_day = pd.DataFrame(data_delivered_percentage_each_day, columns=colnames_delivered_percentage_each_day)
-            
-            query_returned_percentage_each_day = f"""
-                WITH daily_counts AS (
-                    SELECT 
-                        date_trunc('day', d.in_transit) AS period,
-                        d.driver_id,
-                        COUNT(*) FILTER (WHERE d.status = 'RETURNED') AS daily_returned_count,
-                        COUNT(*) FILTER (WHERE d.assigned IS NOT NULL ) AS daily_assigned_count
+                    SUM(distance) AS total_distance_without_return,
+                    SUM(jsonb_array_length(location_ids::jsonb)) AS total_drop_offs,
+                    SUM(weight) AS total_operational_capacity_utilized
+                FROM route_days
+                GROUP BY period, driver_id
+            ),
+            capacity_metrics AS (
+                SELECT
+                    rd.period,
+                    rd.driver_id,
+                    AVG(DISTINCT rd.weight / v.size) * 100 AS average_capacity_used
+                FROM route_days rd
+                JOIN vehicles v ON rd.driver_id = v.driver_id
+                GROUP BY rd.period, rd.driver_id
+            ),
+            driver_lifetime AS (
+                -- Lifetime delivered vs assigned per driver, summed from
+                -- the daily rollup rather than rescanning delivery_tracks
+                SELECT
+                    d.driver_id,
+                    SUM(d.delivered_count) AS delivered_count,
+                    SUM(d.assigned_count) AS assigned_count
+                FROM {track_counts} d
+                WHERE d.driver_id IS NOT NULL
+                {driver_condition}
+                GROUP BY d.driver_id
+            ),
+            track_metrics AS (
+                SELECT
+                    t.period,
+                    t.driver_id,
+                    (dl.delivered_count::float / NULLIF(dl.assigned_count, 0)) * 100 AS delivered_percentage
+                FROM (
+                    SELECT DISTINCT date_trunc('day', d.created_at) AS period, d.driver_id
                     FROM delivery_tracks d
-                    WHERE date_trunc('day', d.in_transit) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-                    
+                    WHERE {date_range('d.created_at', '%(start_date)s', '%(end_date)s')}
                     {driver_condition}
-                    GROUP BY period, d.driver_id
-                )
-                SELECT 
-                    period,
-                    driver_id,
-                    (daily_returned_count::float / NULLIF(daily_assigned_count, 0)) * 100 AS returned_percentage_per_day
-                FROM daily_counts
-                ORDER BY period;
-            """
-            
-
-            cur.execute(query_returned_percentage_each_day,params)
-            data_returned_percentage_each_day = cur.fetchall()
-            colnames_returned_percentage_each_day = [desc[0] for desc in cur.description]
-            df_returned_percentage_each_day = pd.DataFrame(data_returned_percentage_each_day, columns=colnames_returned_percentage_each_day)
-
-            # Query for top delivery locations by number of deliveries
-            query_top_locations = f"""
-                SELECT 
-                    date_trunc('day', d.created_at) AS period,
-                    dl.name,
-                    COUNT(*) AS delivery_count,
-                    (dl.location[0])::float AS longitude,
-                    (dl.location[1])::float AS latitude,
-                    STRING_AGG(DISTINCT u.name, ', ') AS driver_names
-                FROM delivery_tracks d
-                JOIN groups_carts gc ON d.group_cart_id = gc.id
-                JOIN orders o ON gc.id = o.groups_carts_id
-                JOIN delivery_location dl ON o.location_id = dl.id
-                JOIN drivers dr ON d.driver_id = dr.id
-                JOIN users u ON dr.user_id = u.id
-                WHERE date_trunc('day', d.created_at) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-                {driver_condition}
-                GROUP BY period, dl.name, longitude, latitude
-                ORDER BY delivery_count DESC
-                LIMIT 10;
-            """
-            
-            cur.execute(query_top_locations, params)
-            data_top_locations = cur.fetchall()
-            colnames_top_locations = [desc[0] for desc in cur.description]
-
-            df_top_locations = pd.DataFrame(data_top_locations, columns=colnames_top_locations)
-            df_top_locations['delivery_count'] = df_top_locations['delivery_count'].astype(int)
-
-            # Query for average rating per driver
-            query_avg_rating = f"""
-                SELECT 
+                ) t
+                LEFT JOIN driver_lifetime dl ON dl.driver_id = t.driver_id
+            ),
+            rating_metrics AS (
+                SELECT
                     date_trunc('day', d.created_at) AS period,
                     d.driver_id,
                     AVG(dr.rating) AS average_rating
                 FROM delivery_tracks d
                 JOIN routes r ON d.route_id = r.id
                 JOIN driver_rating dr ON r.id = dr.route_id
-                WHERE date_trunc('day', d.created_at) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
+                WHERE {date_range('d.created_at', '%(start_date)s', '%(end_date)s')}
                 {driver_condition}
                 GROUP BY period, d.driver_id
-                ORDER BY period;
-            """
-            cur.execute(query_avg_rating, params)
-            data_avg_rating = cur.fetchall()
-            colnames_avg_rating = [desc[0] for desc in cur.description]
-            df_avg_rating = pd.DataFrame(data_avg_rating, columns=colnames_avg_rating)
-
-            
-            query_avg_capacity = f"""
-                SELECT 
-                    date_trunc('day', r.start_time) AS period,
-                    d.driver_id,
-                    AVG(r.weight / v.size) * 100 AS average_capacity_used
-                FROM routes r
-                JOIN delivery_tracks d ON r.id = d.route_id
-                JOIN vehicles v ON d.driver_id = v.driver_id
-                WHERE date_trunc('day', r.start_time) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-                {driver_condition}
-                GROUP BY period, d.driver_id, r.weight, v.size
-                ORDER BY period;
-            """
-            cur.execute(query_avg_capacity, params)
-            data_avg_capacity = cur.fetchall()
-            colnames_avg_capacity = [desc[0] for desc in cur.description]
-            df_avg_capacity = pd.DataFrame(data_avg_capacity, columns=colnames_avg_capacity)
-            
-            query_total_deliveries = f"""
-                SELECT  
-                    date_trunc('day', d.in_transit) AS period,   
+            ),
+            delivery_metrics AS (
+                SELECT
+                    d.period,
                     d.driver_id,
-                    COUNT(*) AS total_deliveries_within_date_range
-                FROM delivery_tracks d
-                WHERE date_trunc('day', d.in_transit) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
+                    d.number_of_orders,
+                    d.number_of_group_orders,
+                    d.number_of_personal_orders,
+                    d.number_of_delivered_orders,
+                    d.total_deliveries AS total_deliveries_within_date_range,
+                    (d.number_of_delivered_orders::float / NULLIF(d.assigned_count, 0)) * 100 AS delivered_percentage_per_day,
+                    (d.returned_count::float / NULLIF(d.assigned_count, 0)) * 100 AS returned_percentage_per_day,
+                    CASE WHEN d.number_of_delivered_orders > 0
+                         THEN d.delivery_minutes_total / d.number_of_delivered_orders
+                    END AS average_delivery_time
+                FROM {driver_deliveries} d
+                WHERE d.period BETWEEN %(start_date)s AND %(end_date)s
                 {driver_condition}
-                GROUP BY period,d.driver_id;
-            """
-
-            cur.execute(query_total_deliveries, params)
-            data_total_deliveries = cur.fetchall()
-            colnames_total_deliveries = [desc[0] for desc in cur.description]
+            )
+            SELECT
+                COALESCE(rm.period, dm.period) AS period,
+                COALESCE(rm.driver_id, dm.driver_id) AS driver_id,
+                rm.total_distance_without_return,
+                rm.total_drop_offs,
+                rm.total_operational_capacity_utilized,
+                cm.average_capacity_used,
+                tm.delivered_percentage,
+                ra.average_rating,
+                dm.number_of_orders,
+                dm.number_of_group_orders,
+                dm.number_of_personal_orders,
+                dm.number_of_delivered_orders,
+                dm.total_deliveries_within_date_range,
+                dm.delivered_percentage_per_day,
+                dm.returned_percentage_per_day,
+                dm.average_delivery_time
+            FROM route_metrics rm
+            FULL JOIN delivery_metrics dm ON rm.period = dm.period AND rm.driver_id = dm.driver_id
+            LEFT JOIN capacity_metrics cm ON cm.period = COALESCE(rm.period, dm.period) AND cm.driver_id = COALESCE(rm.driver_id, dm.driver_id)
+            LEFT JOIN track_metrics tm ON tm.period = COALESCE(rm.period, dm.period) AND tm.driver_id = COALESCE(rm.driver_id, dm.driver_id)
+            LEFT JOIN rating_metrics ra ON ra.period = COALESCE(rm.period, dm.period) AND ra.driver_id = COALESCE(rm.driver_id, dm.driver_id)
+            ORDER BY period;
+        """
+        df_driver_metrics = fetch_frame(conn, query_driver_metrics, params)
+
+        # Deliveries per location and day, busiest first. Every location in
+        # the range is returned: the page sums them per location
+        # (location_totals), clusters them for the map and switches to a
+        # heat grid above MAX_MAP_MARKERS locations.
+        query_top_locations = f"""
+            SELECT 
+                date_trunc('day', d.created_at) AS period,
+                dl.name,
+                COUNT(*) AS delivery_count,
+                (dl.location[0])::float AS longitude,
+                (dl.location[1])::float AS latitude,
+                STRING_AGG(DISTINCT u.name, ', ') AS driver_names
+            FROM delivery_tracks d
+            JOIN groups_carts gc ON d.group_cart_id = gc.id
+            JOIN orders o ON gc.id = o.groups_carts_id
+            JOIN delivery_location dl ON o.location_id = dl.id
+            JOIN drivers dr ON d.driver_id = dr.id
+            JOIN users u ON dr.user_id = u.id
+            WHERE {date_range('d.created_at', '%(start_date)s', '%(end_date)s')}
+            {driver_condition}
+            GROUP BY period, dl.name, longitude, latitude
+            ORDER BY delivery_count DESC;
+        """
+        
+        df_top_locations = fetch_frame(conn, query_top_locations, params)
+        df_top_locations['delivery_count'] = df_top_locations['delivery_count'].astype(int)
 
-            df_total_deliveries = pd.DataFrame(data_total_deliveries, columns=colnames_total_deliveries)
-
-            # Query for average delivery time
-            query_avg_delivery_time = f"""
-                SELECT 
-                    date_trunc('day', d.in_transit) AS period, 
-                    d.driver_id,
-                    AVG(EXTRACT(EPOCH FROM (d.delivered - d.in_transit)) / 60) AS average_delivery_time
-                FROM delivery_tracks d
-                WHERE d.in_transit IS NOT NULL AND d.delivered IS NOT NULL
-                AND date_trunc('day', d.in_transit) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
-                {driver_condition}
-                GROUP BY period, d.driver_id
-                ORDER BY period;
-            """
-            cur.execute(query_avg_delivery_time, params)
-            data_avg_delivery_time = cur.fetchall()
-            colnames_avg_delivery_time = [desc[0] for desc in cur.description]
-            df_avg_delivery_time = pd.DataFrame(data_avg_delivery_time, columns=colnames_avg_delivery_time)
-
-            # Merge the dataframes on 'period' and 'driver_id'
-            df_combined = pd.merge(df_routes, df_orders, on=['period', 'driver_id'], how='outer', suffixes=('_route', '_order'))
-            df_combined = pd.merge(df_combined, df_avg_capacity, on=['period', 'driver_id'], how='left')
-            df_combined = pd.merge(df_combined, df_delivered_percentage, on=['period', 'driver_id'], how='left')
-            df_combined = pd.merge(df_combined, df_avg_rating, on=['period', 'driver_id'], how='left')
-            df_combined = df_combined.merge(df_avg_delivery_time, on=['period', 'driver_id'], how='outer')
-            df_combined = pd.merge(df_combined, df_total_deliveries, on=['period', 'driver_id'], how='left')
-            df_combined = pd.merge(df_combined, df_delivered_percentage_each_day, on=['period', 'driver_id'], how='left')
-            df_combined = pd.merge(df_combined, df_returned_percentage_each_day, on=['period', 'driver_id'], how='left')
-            
-            df_distance_traveled = df_combined[['period', 'driver_id', 'total_distance_without_return']].drop_duplicates()
-            df_total_orders = df_combined[['period', 'driver_id', 'number_of_orders', 'number_of_group_orders', 'number_of_personal_orders','number_of_delivered_orders']].drop_duplicates()
-            df_drop_offs = df_combined[['period', 'driver_id', 'total_drop_offs']].drop_duplicates()
-            df_operational_capacity = df_combined[['period', 'driver_id', 'total_operational_capacity_utilized']].drop_duplicates()
-            df_avg_capacity = df_combined[['period', 'driver_id', 'average_capacity_used']].drop_duplicates()
-            df_delivered_percentage = df_combined[['period', 'driver_id', 'delivered_percentage']].drop_duplicates()
-            df_avg_rating = df_combined[['period', 'driver_id', 'average_rating']].drop_duplicates()
-            df_avg_delivery_time = df_combined[['period', 'driver_id', 'average_delivery_time']].drop_duplicates()
-            df_total_deliveries = df_combined[['period', 'driver_id', 'total_deliveries_within_date_range']].drop_duplicates()
-            df_delivered_percentage_each_day = df_combined[['period', 'driver_id', 'delivered_percentage_per_day']].drop_duplicates()
-            df_returned_percentage_each_day = df_combined[['period', 'driver_id', 'returned_percentage_per_day']].drop_duplicates()
-
-            return df_distance_traveled, df_total_orders, df_drop_offs, df_operational_capacity, df_avg_capacity, df_delivered_percentage, df_top_locations, df_avg_rating, df_total_deliveries, df_delivered_percentage_each_day, df_avg_delivery_time, df_returned_percentage_each_day
+        return df_driver_metrics, df_top_locations
 
     finally:
         if conn:
             release_conn(conn)
 
-@st.cache_data
+@cache_data
 def fetch_driver_names_and_ids():
     conn = get_conn()
     try:
@@ -317,26 +212,24 @@ def fetch_driver_names_and_ids():
         if conn:
             release_conn(conn)
     
-@st.cache_data
+@cache_data
 def fetch_report_data(start_date, end_date):
     conn = get_conn()
     try:
         with conn.cursor() as cur:
+            returned_then_delivered = source("daily_returned_then_delivered", fresh_derived_tables())
             #query for delivered vs returned orders
-            query1 = """SELECT 
+            query1 = f"""SELECT 
                             DATE_TRUNC('day', in_transit) AS delivery_date,
                             COUNT(id) FILTER (WHERE in_transit IS NOT NULL) AS orders_total,
                             COUNT(id) FILTER (WHERE delivered IS NOT NULL) AS delivered_orders,
                             COUNT(id) FILTER (WHERE status = 'RETURNED') AS returned_orders,
-                        ((SELECT COUNT (dt1.id) FROM  delivery_tracks AS dt1
-                            JOIN delivery_tracks AS dt2 ON dt1.personal_cart_id = dt2.personal_cart_id
-                            WHERE dt1.status = 'RETURNED' AND dt2.delivered IS NOT NULL) + (SELECT COUNT (dt1.id) FROM  delivery_tracks AS dt1
-                            JOIN delivery_tracks AS dt2 ON dt1.group_cart_id = dt2.group_cart_id
-                            WHERE dt1.status = 'RETURNED' AND dt2.delivered IS NOT NULL)) AS returned_then_delivered
+                        (SELECT COALESCE(SUM(returned_then_delivered), 0)::bigint
+                            FROM {returned_then_delivered} r) AS returned_then_delivered
             FROM 
                             delivery_tracks
                         WHERE 
-                            in_transit BETWEEN %s AND %s + interval '1 day' - interval '1 second'
+                            {date_range('in_transit')}
                         GROUP BY 
                             delivery_date
                         ORDER BY 
@@ -344,7 +237,7 @@ def fetch_report_data(start_date, end_date):
             """
 
             # Query for returned orders per reason
-            query2 = """SELECT 
+            query2 = f"""SELECT 
                 DATE_TRUNC('day', in_transit) AS date,
                 return_reason,
                 COUNT(*) AS count
@@ -352,7 +245,7 @@ def fetch_report_data(start_date, end_date):
                 delivery_tracks
             WHERE 
                 status = 'RETURNED' AND
-                created_at BETWEEN %s AND %s + interval '1 day' - interval '1 second'
+                {date_range('created_at')}
             GROUP BY 
                 created_at,date, return_reason
             ORDER BY 
@@ -376,126 +269,66 @@ def fetch_report_data(start_date, end_date):
     finally:
         if conn:
             release_conn(conn)
-@st.cache_data
+@cache_data
 def fetch_delivery_data(start_date, end_date, driver_ids, frequency):
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            driver_condition = ""
-            params = [start_date, end_date]
-
-            if driver_ids:
-                driver_condition = "AND d.driver_id = ANY(%s::uuid[])"
-                params.append(driver_ids)
-            
-            # Adjust the DATE_TRUNC based on the frequency
-            if frequency == "Daily":
-                date_trunc = "day"
-            elif frequency == "Weekly":
-                date_trunc = "week"
-            elif frequency == "Monthly":
-                date_trunc = "month"
-
-            # Queries for different time frames
-            query_delivered = f"""
-                SELECT
-                    DATE_TRUNC('{date_trunc}', dt.assigned) AS assigned_time,
-                    dt.driver_id,
-                    COUNT(dt.id) AS total_delivered,
-                    CASE
-                        WHEN AGE(dt.delivered, dt.assigned) <= INTERVAL '24 hours' THEN '24 Hours'
-                        WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '24 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '48 hours' THEN '48 Hours'
-                        WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '48 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '72 hours' THEN '72 Hours'
-                        WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '72 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '96 hours' THEN '4_days'
-                        WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '96 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '120 hours' THEN '5_days'
-                        WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '120 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '144 hours' THEN '6_days'
-                        ELSE 'More than 6 Days'
-                    END AS delivery_time_frame
-                FROM delivery_tracks dt
-                WHERE dt.assigned IS NOT NULL
-                AND dt.delivered IS NOT NULL
-                AND dt.assigned BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
-                {driver_condition}
-                GROUP BY DATE_TRUNC('{date_trunc}', dt.assigned), dt.driver_id, delivery_time_frame
-                ORDER BY assigned_time DESC
-            """
+        driver_condition = ""
+        params = [start_date, end_date]
 
-            query_unpicked_1 = f"""
-                SELECT
-                    DATE_TRUNC('{date_trunc}', dt.assigned) AS assigned_time,
-                    dt.driver_id,
-                    COUNT(dt.id) AS total_unpicked
-                FROM delivery_tracks dt
-                WHERE dt.assigned IS NOT NULL
-                AND dt.in_transit IS NULL
-                AND dt.assigned BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
-                {driver_condition}
-                GROUP BY DATE_TRUNC('{date_trunc}', dt.assigned), dt.driver_id
-                ORDER BY assigned_time DESC
-            """
-            query_unpicked = f"""SELECT 
-                    DATE_TRUNC('{date_trunc}', dt.assigned) AS assigned_time,
-                    dt.driver_id,
-                    COUNT(DISTINCT (o.location_id,gc.group_id)) AS total_unpicked
-                FROM 
-                    delivery_tracks dt
-                JOIN 
-                    groups_carts gc ON gc.id = dt.group_cart_id
-                LEFT JOIN 
-                    orders o ON o.groups_carts_id = gc.id
-                    AND o.status = 'COMPLETED'
-                    AND o.deleted_at IS NULL
-                WHERE 
-                    dt.assigned IS NOT NULL
-                    AND dt.in_transit IS NULL
-                    AND dt.assigned BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
-                    {driver_condition}
-                GROUP BY 
-                    DATE_TRUNC('{date_trunc}', dt.assigned), dt.driver_id
-                ORDER BY 
-                    assigned_time DESC;
-
-            """
-            query_unpicked_personal = f"""SELECT 
-                    DATE_TRUNC('{date_trunc}', dt.assigned) AS assigned_time,
-                    dt.driver_id,
-                    COUNT(DISTINCT (o.location_id, pci.cart_id)) AS total_unpicked
-                FROM 
-                    delivery_tracks dt
-                JOIN personal_cart_items pci ON
-                    pci.id = dt.personal_cart_id
-                JOIN carts c ON
-                    c.id = pci.cart_id
-                LEFT JOIN 
-                    orders o ON o.personal_cart_id = c.id
-                    AND o.status = 'COMPLETED'
-                    AND o.deleted_at IS NULL
-                WHERE 
-                    dt.assigned IS NOT NULL
-                    AND dt.in_transit IS NULL
-                    AND dt.assigned BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
-                    {driver_condition}
-                GROUP BY 
-                    DATE_TRUNC('{date_trunc}', dt.assigned), dt.driver_id
-                ORDER BY 
-                    assigned_time DESC;
-
-            """
-
-            query_unassigned_1 = f"""
-                SELECT
-                    DATE_TRUNC('{date_trunc}', dt.created_at) AS accepted_time,
-                    COUNT(dt.id) AS total_unassigned
-                FROM delivery_tracks dt
-                WHERE dt.assigned IS NULL
-                AND dt.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
-                GROUP BY DATE_TRUNC('{date_trunc}', dt.created_at)
-                ORDER BY accepted_time DESC
-            """
-            query_unassigned = f"""SELECT 
-                DATE_TRUNC('{date_trunc}', dt.created_at) AS accepted_time,
-                gc.id AS group_id,
-                COUNT(DISTINCT (o.location_id, gc.group_id)) AS total_unassigned
+        if driver_ids:
+            driver_condition = "AND d.driver_id = ANY(%s::uuid[])"
+            params.append(driver_ids)
+        
+        # Adjust the DATE_TRUNC based on the frequency
+        if frequency == "Daily":
+            date_trunc = "day"
+        elif frequency == "Weekly":
+            date_trunc = "week"
+        elif frequency == "Monthly":
+            date_trunc = "month"
+
+        # Queries for different time frames
+        query_delivered = f"""
+            SELECT
+                DATE_TRUNC('{date_trunc}', dt.assigned) AS assigned_time,
+                dt.driver_id,
+                COUNT(dt.id) AS total_delivered,
+                CASE
+                    WHEN AGE(dt.delivered, dt.assigned) <= INTERVAL '24 hours' THEN '24 Hours'
+                    WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '24 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '48 hours' THEN '48 Hours'
+                    WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '48 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '72 hours' THEN '72 Hours'
+                    WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '72 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '96 hours' THEN '4_days'
+                    WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '96 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '120 hours' THEN '5_days'
+                    WHEN AGE(dt.delivered, dt.assigned) > INTERVAL '120 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '144 hours' THEN '6_days'
+                    ELSE 'More than 6 Days'
+                END AS delivery_time_frame
+            FROM delivery_tracks dt
+            WHERE dt.assigned IS NOT NULL
+            AND dt.delivered IS NOT NULL
+            AND {date_range('dt.assigned')}
+            {driver_condition}
+            GROUP BY DATE_TRUNC('{date_trunc}', dt.assigned), dt.driver_id, delivery_time_frame
+            ORDER BY assigned_time DESC
+        """
+
+        query_unpicked_1 = f"""
+            SELECT
+                DATE_TRUNC('{date_trunc}', dt.assigned) AS assigned_time,
+                dt.driver_id,
+                COUNT(dt.id) AS total_unpicked
+            FROM delivery_tracks dt
+            WHERE dt.assigned IS NOT NULL
+            AND dt.in_transit IS NULL
+            AND {date_range('dt.assigned')}
+            {driver_condition}
+            GROUP BY DATE_TRUNC('{date_trunc}', dt.assigned), dt.driver_id
+            ORDER BY assigned_time DESC
+        """
+        query_unpicked = f"""SELECT 
+                DATE_TRUNC('{date_trunc}', dt.assigned) AS assigned_time,
+                dt.driver_id,
+                COUNT(DISTINCT (o.location_id,gc.group_id)) AS total_unpicked
             FROM 
                 delivery_tracks dt
             JOIN 
@@ -505,17 +338,20 @@ def fetch_delivery_data(start_date, end_date, driver_ids, frequency):
                 AND o.status = 'COMPLETED'
                 AND o.deleted_at IS NULL
             WHERE 
-                dt.assigned IS NULL
-                AND dt.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                dt.assigned IS NOT NULL
+                AND dt.in_transit IS NULL
+                AND {date_range('dt.assigned')}
+                {driver_condition}
             GROUP BY 
-                DATE_TRUNC('{date_trunc}', dt.created_at),gc.id
+                DATE_TRUNC('{date_trunc}', dt.assigned), dt.driver_id
             ORDER BY 
-                accepted_time DESC;
-                """
-            query_unassigned_personal = f"""SELECT 
-                DATE_TRUNC('{date_trunc}', dt.created_at) AS accepted_time,
-                --gc.id AS group_id,
-                COUNT(DISTINCT (o.location_id, pci.cart_id)) AS total_unassigned
+                assigned_time DESC;
+
+        """
+        query_unpicked_personal = f"""SELECT 
+                DATE_TRUNC('{date_trunc}', dt.assigned) AS assigned_time,
+                dt.driver_id,
+                COUNT(DISTINCT (o.location_id, pci.cart_id)) AS total_unpicked
             FROM 
                 delivery_tracks dt
             JOIN personal_cart_items pci ON
@@ -527,51 +363,86 @@ def fetch_delivery_data(start_date, end_date, driver_ids, frequency):
                 AND o.status = 'COMPLETED'
                 AND o.deleted_at IS NULL
             WHERE 
-                dt.assigned IS NULL
-                AND dt.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                dt.assigned IS NOT NULL
+                AND dt.in_transit IS NULL
+                AND {date_range('dt.assigned')}
+                {driver_condition}
             GROUP BY 
-                DATE_TRUNC('{date_trunc}', dt.created_at)
+                DATE_TRUNC('{date_trunc}', dt.assigned), dt.driver_id
             ORDER BY 
-                accepted_time DESC;
-                """
+                assigned_time DESC;
 
-            cur.execute(query_delivered, params)
-            data_delivered = cur.fetchall()
-            colnames_delivered = [desc[0] for desc in cur.description]
-            df_delivered = pd.DataFrame(data_delivered, columns=colnames_delivered)
-            
-            cur.execute(query_unpicked_1, params)
-            data_unpicked_1 = cur.fetchall()
-            colnames_unpicked_1 = [desc[0] for desc in cur.description]
-            df_unpicked_1 = pd.DataFrame(data_unpicked_1, columns=colnames_unpicked_1)
-
-            cur.execute(query_unassigned_1, params)
-            data_unassigned_1 = cur.fetchall()
-            colnames_unassigned_1 = [desc[0] for desc in cur.description]
-            df_unassigned_1 = pd.DataFrame(data_unassigned_1, columns=colnames_unassigned_1)
-
-            cur.execute(query_unpicked, params)
-            data_unpicked = cur.fetchall()
-            colnames_unpicked = [desc[0] for desc in cur.description]
-            df_unpicked = pd.DataFrame(data_unpicked, columns=colnames_unpicked)
-
-            cur.execute(query_unassigned, params)
-            data_unassigned = cur.fetchall()
-            colnames_unassigned = [desc[0] for desc in cur.description]
-            df_unassigned = pd.DataFrame(data_unassigned, columns=colnames_unassigned)
-            
-            cur.execute(query_unassigned_personal, params)
-            data_unassigned_personal = cur.fetchall()
-            colnames_unassigned_personal = [desc[0] for desc in cur.description]
-            df_unassigned_personal = pd.DataFrame(data_unassigned_personal, columns=colnames_unassigned_personal)
-         
-            cur.execute(query_unpicked_personal, params)
-            data_unpicked_personal = cur.fetchall()
-            colnames_unpicked_personal = [desc[0] for desc in cur.description]
-            df_unpicked_personal = pd.DataFrame(data_unpicked_personal, columns=colnames_unpicked_personal)
+        """
+
+        query_unassigned_1 = f"""
+            SELECT
+                DATE_TRUNC('{date_trunc}', dt.created_at) AS accepted_time,
+                COUNT(dt.id) AS total_unassigned
+            FROM delivery_tracks dt
+            WHERE dt.assigned IS NULL
+            AND {date_range('dt.created_at')}
+            GROUP BY DATE_TRUNC('{date_trunc}', dt.created_at)
+            ORDER BY accepted_time DESC
+        """
+        query_unassigned = f"""SELECT 
+            DATE_TRUNC('{date_trunc}', dt.created_at) AS accepted_time,
+            gc.id AS group_id,
+            COUNT(DISTINCT (o.location_id, gc.group_id)) AS total_unassigned
+        FROM 
+            delivery_tracks dt
+        JOIN 
+            groups_carts gc ON gc.id = dt.group_cart_id
+        LEFT JOIN 
+            orders o ON o.groups_carts_id = gc.id
+            AND o.status = 'COMPLETED'
+            AND o.deleted_at IS NULL
+        WHERE 
+            dt.assigned IS NULL
+            AND {date_range('dt.created_at')}
+        GROUP BY 
+            DATE_TRUNC('{date_trunc}', dt.created_at),gc.id
+        ORDER BY 
+            accepted_time DESC;
+            """
+        query_unassigned_personal = f"""SELECT 
+            DATE_TRUNC('{date_trunc}', dt.created_at) AS accepted_time,
+            --gc.id AS group_id,
+            COUNT(DISTINCT (o.location_id, pci.cart_id)) AS total_unassigned
+        FROM 
+            delivery_tracks dt
+        JOIN personal_cart_items pci ON
+            pci.id = dt.personal_cart_id
+        JOIN carts c ON
+            c.id = pci.cart_id
+        LEFT JOIN 
+            orders o ON o.personal_cart_id = c.id
+            AND o.status = 'COMPLETED'
+            AND o.deleted_at IS NULL
+        WHERE 
+            dt.assigned IS NULL
+            AND {date_range('dt.created_at')}
+        GROUP BY 
+            DATE_TRUNC('{date_trunc}', dt.created_at)
+        ORDER BY 
+            accepted_time DESC;
+            """
+
+        df_delivered = fetch_frame(conn, query_delivered, params)
         
-            
-            return df_delivered, df_unpicked, df_unassigned, df_unpicked_1, df_unassigned_1,  df_unpicked_personal,  df_unassigned_personal
+        df_unpicked_1 = fetch_frame(conn, query_unpicked_1, params)
+
+        df_unassigned_1 = fetch_frame(conn, query_unassigned_1, params)
+
+        df_unpicked = fetch_frame(conn, query_unpicked, params)
+
+        df_unassigned = fetch_frame(conn, query_unassigned, params)
+        
+        df_unassigned_personal = fetch_frame(conn, query_unassigned_personal, params)
+     
+        df_unpicked_personal = fetch_frame(conn, query_unpicked_personal, params)
+    
+        
+        return df_delivered, df_unpicked, df_unassigned, df_unpicked_1, df_unassigned_1,  df_unpicked_personal,  df_unassigned_personal
         
         
     finally:
@@ -579,67 +450,62 @@ def fetch_delivery_data(start_date, end_date, driver_ids, frequency):
             release_conn(conn)
 
 
-@st.cache_data
+@cache_data
 def fetch_summary_data(start_date, end_date, driver_ids, frequency):
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            driver_condition = ""
-            params = [start_date, end_date]
-
-            if driver_ids:
-                driver_condition = "AND d.driver_id = ANY(%s::uuid[])"
-                params.append(driver_ids)
-
-            # Adjust the DATE_TRUNC based on the frequency
-            if frequency == "Daily":
-                date_trunc = "day"
-            elif frequency == "Weekly":
-                date_trunc = "week"
-            elif frequency == "Monthly":
-                date_trunc = "month"
-
-            query_summary = f"""
-                SELECT 
-                    DATE_TRUNC('{date_trunc}', dt.assigned) as assigned_day,
-                    COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) <= INTERVAL '24 hours') as delivered_24_hr,
-                    COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '24 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '48 hours') as delivered_2_days,
-                    COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '48 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '72 hours') as delivered_3_days,
-                    COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '72 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '96 hours') as delivered_4_days,
-                    COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '96 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '120 hours') as delivered_5_days,
-                    COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '120 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '144 hours') as delivered_6_days,
-                    COUNT(dt.id) as total_assigned,
-                    -- Additional counts for each status
-                    COUNT(dt.id) FILTER (WHERE dt.status = 'REJECTED_BY_VENDOR') as rejected_by_vendor,
-                    COUNT(dt.id) FILTER (WHERE dt.status = 'RETURNED') as returned,
-                    COUNT(dt.id) FILTER (WHERE dt.status ='IN_TRANSIT') as in_transit,
-                    COUNT(dt.id) FILTER (WHERE dt.status ='IN_PROGRESS')as in_progress,
-                    --COUNT(dt.id) FILTER (WHERE dt.assigned IS NULL) as total_unassigned
-                     -- New count for returned orders that were delivered again
-                    COUNT(dt.id) FILTER (
-                        WHERE dt.status = 'RETURNED' 
-                        AND dt.return_reason IS NOT NULL
-                        AND EXISTS (
-                            SELECT 1 FROM delivery_tracks dt2 
-                            WHERE dt2.id = dt.id 
-                            AND dt2.delivered IS NOT NULL
-                            AND dt2.created_at > dt.created_at -- ensuring it's delivered after being returned
-                        )
-                    ) AS returned_and_delivered_again
-                FROM delivery_tracks dt
-                WHERE dt.assigned IS NOT NULL
-                AND dt.delivered IS NOT NULL
-                AND dt.assigned BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
-                {driver_condition}
-                GROUP BY assigned_day
-                ORDER BY assigned_day DESC;
-            """
-            cur.execute(query_summary, params)
-            data_summary = cur.fetchall()
-            colnames_summary = [desc[0] for desc in cur.description]
-
-            df_summary = pd.DataFrame(data_summary, columns=colnames_summary)
-            return df_summary  
+        driver_condition = ""
+        params = [start_date, end_date]
+
+        if driver_ids:
+            driver_condition = "AND d.driver_id = ANY(%s::uuid[])"
+            params.append(driver_ids)
+
+        # Adjust the DATE_TRUNC based on the frequency
+        if frequency == "Daily":
+            date_trunc = "day"
+        elif frequency == "Weekly":
+            date_trunc = "week"
+        elif frequency == "Monthly":
+            date_trunc = "month"
+
+        query_summary = f"""
+            SELECT 
+                DATE_TRUNC('{date_trunc}', dt.assigned) as assigned_day,
+                COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) <= INTERVAL '24 hours') as delivered_24_hr,
+                COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '24 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '48 hours') as delivered_2_days,
+                COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '48 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '72 hours') as delivered_3_days,
+                COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '72 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '96 hours') as delivered_4_days,
+                COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '96 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '120 hours') as delivered_5_days,
+                COUNT(dt.id) FILTER (WHERE AGE(dt.delivered, dt.assigned) > INTERVAL '120 hours' AND AGE(dt.delivered, dt.assigned) <= INTERVAL '144 hours') as delivered_6_days,
+                COUNT(dt.id) as total_assigned,
+                -- Additional counts for each status
+                COUNT(dt.id) FILTER (WHERE dt.status = 'REJECTED_BY_VENDOR') as rejected_by_vendor,
+                COUNT(dt.id) FILTER (WHERE dt.status = 'RETURNED') as returned,
+                COUNT(dt.id) FILTER (WHERE dt.status ='IN_TRANSIT') as in_transit,
+                COUNT(dt.id) FILTER (WHERE dt.status ='IN_PROGRESS')as in_progress,
+                --COUNT(dt.id) FILTER (WHERE dt.assigned IS NULL) as total_unassigned
+                 -- New count for returned orders that were delivered again
+                COUNT(dt.id) FILTER (
+                    WHERE dt.status = 'RETURNED' 
+                    AND dt.return_reason IS NOT NULL
+                    AND EXISTS (
+                        SELECT 1 FROM delivery_tracks dt2 
+                        WHERE dt2.id = dt.id 
+                        AND dt2.delivered IS NOT NULL
+                        AND dt2.created_at > dt.created_at -- ensuring it's delivered after being returned
+                    )
+                ) AS returned_and_delivered_again
+            FROM delivery_tracks dt
+            WHERE dt.assigned IS NOT NULL
+            AND dt.delivered IS NOT NULL
+            AND {date_range('dt.assigned')}
+            {driver_condition}
+            GROUP BY assigned_day
+            ORDER BY assigned_day DESC;
+        """
+        df_summary = fetch_frame(conn, query_summary, params)
+        return df_summary  
     finally:
         if conn:
             release_conn(conn)
@@ -945,56 +811,93 @@ def show_trend_view(metric_data_dict, frequency, start_date, end_date):
 
   
 # Streamlit application code
+profile = start_profile("5_logistic")
+profile.phase("widgets", "title and sidebar filters")
 st.title('Logistics KPI Dashboard')
 
 # Sidebar filters
 default_start_date = datetime.datetime.today() - datetime.timedelta(days=7)
-start_date = st.sidebar.date_input("Start date", default_start_date)
-end_date = st.sidebar.date_input("End date", datetime.datetime.today())
-start_date = pd.to_datetime(start_date)
-end_date = pd.to_datetime(end_date)
 
-# Fetch driver names and IDs for the dropdown
-driver_dict = fetch_driver_names_and_ids()
+# Fetch driver names and IDs for the dropdown; the list is loaded once per
+# session, everything else waits for Filter
+profile.phase("fetch", "driver names")
+driver_dict = load_requests("5_logistic", {"drivers": (fetch_driver_names_and_ids,)})["drivers"]
+profile.phase("widgets", "driver and frequency filters")
 driver_names = list(driver_dict.values())
 driver_names.insert(0, "All")  # Add "All" option at the beginning
 
-# Driver name filter
-selected_driver_names = st.sidebar.multiselect("Select Driver", driver_names, default=["All"])
+with st.sidebar.form("filters"):
+    start_date = st.date_input("Start date", default_start_date)
+    end_date = st.date_input("End date", datetime.datetime.today())
+
+    # Driver name filter
+    selected_driver_names = st.multiselect("Select Driver", driver_names, default=["All"])
+
+    # Frequency filter
+    frequency = st.selectbox("Frequency", ["Daily", "Weekly", "Monthly"])
+    submitted = st.form_submit_button("Filter")
+start_date = pd.to_datetime(start_date)
+end_date = pd.to_datetime(end_date)
+applied = filters_applied("5_logistic", submitted)
 
 # Convert driver names to IDs
 selected_driver_ids = [key for key, value in driver_dict.items() if value in selected_driver_names and value != "All"]
 
-# Frequency filter
-frequency = st.sidebar.selectbox("Frequency", ["Daily", "Weekly", "Monthly"])
 
+def merge_names(names):
+    # Comma-separated names, each once, sorted
+    return ', '.join(sorted(set(', '.join(names).split(', '))))
 
-def aggregate_locations(df, max_distance_km=3):
-    aggregated_data = []
-
-    while not df.empty:
-        base_location = df.iloc[0]
-        base_coords = (base_location['latitude'], base_location['longitude'])
-
-        close_locations = df[df.apply(
-            lambda row: geodesic(base_coords, (row['latitude'], row['longitude'])).km <= max_distance_km,
-            axis=1
-        )]
-
-        aggregated_row = {
-            'name': ', '.join(close_locations['name']),
-            'latitude': close_locations['latitude'].mean(),
-            'longitude': close_locations['longitude'].mean(),
-            'delivery_count': close_locations['delivery_count'].sum(),
-            'driver_names': ', '.join(sorted(set(', '.join(close_locations['driver_names']).split(', '))))
-        }
+def location_totals(df):
+    # The query returns one row per location and day; sum them into one row
+    # per location across the whole range, busiest first.
+    if df.empty:
+        return df
+    totals = df.groupby(['name', 'latitude', 'longitude'], dropna=False, sort=False).agg(
+        delivery_count=('delivery_count', 'sum'),
+        driver_names=('driver_names', merge_names),
+    ).reset_index()
+    return totals.sort_values('delivery_count', ascending=False, kind='stable', ignore_index=True)
 
-        aggregated_data.append(aggregated_row)
-        df = df.drop(close_locations.index)
+def aggregate_locations(df, max_distance_km=3):
+    if df.empty:
+        return pd.DataFrame()
 
-    return pd.DataFrame(aggregated_data)
+    # df holds one row per location (location_totals), busiest first, so
+    # each location joins the busiest seed within max_distance_km
+    labels = cluster_labels(df['latitude'], df['longitude'], max_distance_km)
+
+    aggregated_data = df.groupby(labels, sort=True).agg(
+        # Distinct names, busiest location first
+        name=('name', lambda x: ', '.join(dict.fromkeys(x.dropna()))),
+        latitude=('latitude', 'mean'),
+        longitude=('longitude', 'mean'),
+        delivery_count=('delivery_count', 'sum'),
+        driver_names=('driver_names', merge_names),
+    )
+
+    return aggregated_data.reset_index(drop=True)
+
+# Above this many locations the map switches from markers to a heat grid
+MAX_MAP_MARKERS = 2000
+
+# Rows are [latitude, longitude, delivery_count, name, driver_names]
+LOCATION_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.divIcon({
+            className: '',
+            html: '<div style="font-family: sans-serif; color: white; background-color: rgba(0, 0, 0, 0.6); padding: 2px 20px; border-radius: 3px;">' + row[2] + '</div>'
+        })
+    });
+    marker.bindPopup('<strong>Location:</strong> ' + row[3] + '<br><strong>Delivery Count:</strong> ' + row[2] + '<br><strong>Driver Names:</strong> ' + row[4]);
+    return marker;
+}
+"""
 
-def visualize_top_locations_on_heatmap(df):
+def visualize_top_locations_on_heatmap(df, locations):
+    # df holds the clustered locations shown as markers, locations the
+    # per-location totals (location_totals) the heat grid is built from.
     if df.empty:
         st.markdown("No data available for the selected filters.")
         return
@@ -1008,26 +911,20 @@ def visualize_top_locations_on_heatmap(df):
     center_lon = df['longitude'].mean()
     m = folium.Map(location=[center_lat, center_lon], zoom_start=8)
 
-    # Add marker cluster for better visualization
-    marker_cluster = MarkerCluster().add_to(m)
-
-    # Add markers for each location
-    for index, row in df.iterrows():
-        lat = row['latitude']
-        lon = row['longitude']
-        delivery_count = row['delivery_count']
-
-        # Create marker with popup showing delivery count
-        popup_content = f"<strong>Location:</strong> {row['name']}<br><strong>Delivery Count:</strong> {delivery_count}<br><strong>Driver Names:</strong> {row['driver_names']}"
-        marker = folium.Marker(
-            location=(lat, lon),
-            popup=popup_content,
-            icon=folium.DivIcon(html=f"""
-                <div style="font-family: sans-serif; color: white; background-color: rgba(0, 0, 0, 0.6); padding: 2px 20px; border-radius: 3px;">
-                    {delivery_count}
-                </div>""")
-        )
-        marker.add_to(marker_cluster)
+    # Decided on the locations themselves: clustering folds them into far
+    # fewer points, which would always fit under the limit
+    if len(locations) <= MAX_MAP_MARKERS:
+        # One compact data array rendered client-side, instead of a separate
+        # Marker/DivIcon object in the page HTML for every location
+        points = df[['latitude', 'longitude', 'delivery_count', 'name', 'driver_names']].astype(
+            {'latitude': float, 'longitude': float, 'delivery_count': int, 'name': str, 'driver_names': str}
+        ).values.tolist()
+        FastMarkerCluster(points, callback=LOCATION_MARKER_CALLBACK).add_to(m)
+    else:
+        # Too many locations for individual markers: ship a bounded heat grid
+        grid = heat_grid(locations)
+        HeatMap(grid[['latitude', 'longitude', 'delivery_count']].values.tolist(), radius=15).add_to(m)
+        st.caption(f"Showing a delivery heat map for {len(locations)} locations.")
 
     # Display map
     folium_static(m)
@@ -1044,10 +941,8 @@ def process_dataframe(df, frequency):
     df['date'] = df['period'].dt.date
     
     # Add 'frequency' column based on the selected frequency
-    if frequency == 'Weekly':
-        df['frequency'] = df['period'].dt.to_period('W').apply(lambda r: r.start_time.date())
-    elif frequency == 'Monthly':
-        df['frequency'] = df['period'].dt.to_period('M').apply(lambda r: r.start_time.date())
+    if frequency in ('Weekly', 'Monthly'):
+        df['frequency'] = bucket_start(df['period'], frequency).dt.date
     else:
         df['frequency'] = df['date']
     
@@ -1186,8 +1081,10 @@ def visualize_data(df, date_column, value_column, index_column, column_order=Non
         )
     except Exception as e:
         st.error(f"An error occurred: {e}")
-# Fetch the aggregated data
-df_distance_traveled, df_total_orders, df_drop_offs, df_operational_capacity,df_avg_capacity,df_delivered_percentage,df_top_locations,df_avg_rating,df_total_deliveries, df_delivered_percentage_each_day,df_avg_delivery_time,df_returned_percentage_each_day = fetch_aggregated_data(start_date, end_date, selected_driver_ids)
+
+# One frame per metric group, sliced from the per (period, driver) metrics
+def metric_frame(df, columns):
+    return df[['period', 'driver_id'] + columns].copy()
 
 # Replace driver IDs with names in dataframes
 def map_driver_id(df, driver_dict):
@@ -1202,46 +1099,73 @@ def map_driver_id(df, driver_dict):
     
     return df
 
-# Apply the function to each DataFrame
-df_distance_traveled = map_driver_id(df_distance_traveled, driver_dict)
-df_total_orders = map_driver_id(df_total_orders, driver_dict)
-df_drop_offs = map_driver_id(df_drop_offs, driver_dict)
-df_operational_capacity = map_driver_id(df_operational_capacity, driver_dict)
-df_avg_capacity = map_driver_id(df_avg_capacity, driver_dict)
-df_delivered_percentage = map_driver_id(df_delivered_percentage, driver_dict)
-df_avg_rating = map_driver_id(df_avg_rating, driver_dict)
-df_total_deliveries = map_driver_id(df_total_deliveries, driver_dict)
-df_delivered_percentage_each_day = map_driver_id(df_delivered_percentage_each_day, driver_dict)
-df_returned_percentage_each_day = map_driver_id(df_returned_percentage_each_day, driver_dict)
-# Fetch data
-df_delivered, df_unpicked, df_unassigned, df_unpicked_1, df_unassigned_1,  df_unpicked_personal,  df_unassigned_personal  = fetch_delivery_data(start_date, end_date, selected_driver_ids,frequency)
-# Apply the function to each DataFrame
-df_delivered = map_driver_id(df_delivered, driver_dict)
-
-df_unpicked = map_driver_id(df_unpicked, driver_dict)
-
-df_unpicked_1 = map_driver_id(df_unpicked_1, driver_dict)
-
-df_unpicked_personal = map_driver_id(df_unpicked_personal, driver_dict)
-
-
-# Fetch summary data
-df_summary = fetch_summary_data(start_date, end_date, selected_driver_ids,frequency)
-df_summary = df_summary.rename(columns={
+if applied:
+    # Fetch the aggregated data
+    profile.phase("fetch", "driver metrics and top locations")
+    df_driver_metrics, df_top_locations = load_requests("5_logistic", {
+        "driver_metrics": (fetch_aggregated_data, start_date, end_date, selected_driver_ids),
+    }, submitted)["driver_metrics"]
+
+    profile.phase("transform", "driver metric frames")
+    df_distance_traveled = metric_frame(df_driver_metrics, columns_dict['df_distance_traveled'])
+    df_total_orders = metric_frame(df_driver_metrics, columns_dict['df_total_orders'])
+    df_drop_offs = metric_frame(df_driver_metrics, columns_dict['df_drop_offs'])
+    df_operational_capacity = metric_frame(df_driver_metrics, columns_dict['df_operational_capacity'])
+    df_avg_capacity = metric_frame(df_driver_metrics, columns_dict['df_avg_capacity'])
+    df_delivered_percentage = metric_frame(df_driver_metrics, columns_dict['df_delivered_percentage'])
+    df_avg_rating = metric_frame(df_driver_metrics, columns_dict['df_avg_rating'])
+    df_total_deliveries = metric_frame(df_driver_metrics, columns_dict['df_total_deliveries'])
+    df_delivered_percentage_each_day = metric_frame(df_driver_metrics, columns_dict['df_delivered_percentage_each_day'])
+    df_returned_percentage_each_day = metric_frame(df_driver_metrics, columns_dict['df_returned_percentage_each_day'])
+
+    # Apply the function to each DataFrame
+    df_distance_traveled = map_driver_id(df_distance_traveled, driver_dict)
+    df_total_orders = map_driver_id(df_total_orders, driver_dict)
+    df_drop_offs = map_driver_id(df_drop_offs, driver_dict)
+    df_operational_capacity = map_driver_id(df_operational_capacity, driver_dict)
+    df_avg_capacity = map_driver_id(df_avg_capacity, driver_dict)
+    df_delivered_percentage = map_driver_id(df_delivered_percentage, driver_dict)
+    df_avg_rating = map_driver_id(df_avg_rating, driver_dict)
+    df_total_deliveries = map_driver_id(df_total_deliveries, driver_dict)
+    df_delivered_percentage_each_day = map_driver_id(df_delivered_percentage_each_day, driver_dict)
+    df_returned_percentage_each_day = map_driver_id(df_returned_percentage_each_day, driver_dict)
+    # Fetch data
+    profile.phase("fetch", "delivery data")
+    deliveries = load_requests("5_logistic", {
+        "deliveries": (fetch_delivery_data, start_date, end_date, selected_driver_ids, frequency),
+    }, submitted)["deliveries"]
+    df_delivered, df_unpicked, df_unassigned, df_unpicked_1, df_unassigned_1,  df_unpicked_personal,  df_unassigned_personal  = deliveries
+    # Apply the function to each DataFrame
+    profile.phase("transform", "delivery driver names")
+    df_delivered = map_driver_id(df_delivered, driver_dict)
+
+    df_unpicked = map_driver_id(df_unpicked, driver_dict)
+
+    df_unpicked_1 = map_driver_id(df_unpicked_1, driver_dict)
+
+    df_unpicked_personal = map_driver_id(df_unpicked_personal, driver_dict)
+
+
+    # Fetch summary data
+    profile.phase("fetch", "delivery summary")
+    df_summary = load_requests("5_logistic", {
+        "summary": (fetch_summary_data, start_date, end_date, selected_driver_ids, frequency),
+    }, submitted)["summary"]
+    df_summary = df_summary.rename(columns={
          
-        "total_assigned" : "total orders assigned",
-        "rejected_by_vendor": "orders rejected by vendors",
-        "returned": "returned orders",
-        "in_transit": "orders accepted by vendors",
-        "in_progress": "orders pending vendor acceptance"
-    })
+            "total_assigned" : "total orders assigned",
+            "rejected_by_vendor": "orders rejected by vendors",
+            "returned": "returned orders",
+            "in_transit": "orders accepted by vendors",
+            "in_progress": "orders pending vendor acceptance"
+        })
 
-tab1, tab2 = st.tabs(["Logistics performance", "Delivery performance"])
+    profile.phase("widgets", "tabs")
+    tab1, tab2 = st.tabs(["Logistics performance", "Delivery performance"])
 
-# Apply filters button
-if st.sidebar.button("Filter"):
     with tab1:
         try:# Process each DataFrame with the function
+            profile.phase("transform", "driver metric aggregation")
             df_distance_traveled = process_dataframe(df_distance_traveled, frequency)
             df_total_orders = process_dataframe(df_total_orders, frequency)
             df_drop_offs = process_dataframe(df_drop_offs, frequency)
@@ -1298,6 +1222,7 @@ if st.sidebar.button("Filter"):
             if not df_top_locations.empty:
                 
                 # Convert delivery_count to numeric (if not already)
+                profile.phase("transform", "top locations")
                 df_top_locations['delivery_count'] = pd.to_numeric(df_top_locations['delivery_count'], errors='coerce')
 
                 # Group by frequency, name, latitude, and longitude to combine driver names and sum delivery counts
@@ -1315,11 +1240,14 @@ if st.sidebar.button("Filter"):
                     'driver_names': lambda x: ', '.join(sorted(set(driver for drivers in x for driver in drivers.split(', ')))),
                     'delivery_count': 'sum'
                 }).reset_index()
-                aggregated_top_locations_2 = aggregate_locations(df_top_locations)
+                top_location_totals = location_totals(df_top_locations)
+                aggregated_top_locations_2 = aggregate_locations(top_location_totals)
                 
-                visualize_top_locations_on_heatmap(aggregated_top_locations_2)
+                profile.phase("chart", "top locations map")
+                visualize_top_locations_on_heatmap(aggregated_top_locations_2, top_location_totals)
 
                 # Define the columns to keep
+                profile.phase("widgets", "top locations table")
                 desired_columns = ['name', 'driver_names', 'delivery_count']
 
                 # Select only the desired columns
@@ -1344,6 +1272,7 @@ if st.sidebar.button("Filter"):
                     <p>Please select a different date range.</p>      
                 </div>
                 """, unsafe_allow_html=True)
+            profile.phase("widgets", "operational capacity grid")
             st.header("Driver Efficiency")
             st.subheader(f"Operational Capacity Utilized"" "
                          f"from {start_date.date()} to {end_date.date()} with {frequency} frequency")
@@ -1357,6 +1286,7 @@ if st.sidebar.button("Filter"):
                            value_column='Total Weight (kg)',
                            )
             
+            profile.phase("chart", "operational capacity")
             if not aggregated_operational_capacity.empty:
                 line_chart_operational_capacity = alt.Chart(aggregated_operational_capacity).mark_line(point=True).encode(
                     x='frequency:T',
@@ -1369,6 +1299,7 @@ if st.sidebar.button("Filter"):
                 st.altair_chart(line_chart_operational_capacity, use_container_width=True)
                 
             
+            profile.phase("widgets", "average capacity grid")
             st.subheader(f"Average Capacity Used"" "
                          f"from {start_date.date()} to {end_date.date()} with {frequency} frequency")
             st.write("The average percentage of the vehicle capacity utilized by each driver during the specified date range.This is calculated by dividing the total weight of deliveries by the size of the vehicle assigned to the driver.")
@@ -1379,6 +1310,7 @@ if st.sidebar.button("Filter"):
                 value_column='Average Capacity Used',
             )
          
+            profile.phase("chart", "average capacity")
             if not aggregated_avg_capacity.empty:
                 avg_capacity_chart = alt.Chart(aggregated_avg_capacity).mark_line(point=True).encode(
                     x='frequency:T',
@@ -1389,6 +1321,7 @@ if st.sidebar.button("Filter"):
                     title='Average Capacity Used (%)'
                 ).interactive()
                 st.altair_chart(avg_capacity_chart, use_container_width=True)
+            profile.phase("widgets", "total orders table")
             st.header("Delivery Performance")
             # Total orders
             st.subheader(f"Total Orders"" "
@@ -1397,6 +1330,7 @@ if st.sidebar.button("Filter"):
             df_to = aggregated_total_orders.rename(columns={'frequency': 'Date','driver_name':'Driver name',  'number_of_orders': 'Total Orders', 'number_of_delivered_orders':'Total Delivered Orders','number_of_group_orders': 'Total Group Orders','number_of_personal_orders': 'Total Personal Orders'})
             st.write(df_to)
             
+            profile.phase("chart", "total orders")
             if not aggregated_total_orders.empty:
                 line_chart_total_orders = alt.Chart(aggregated_total_orders).mark_line(point=True).encode(
                     x='frequency:T',
@@ -1408,6 +1342,7 @@ if st.sidebar.button("Filter"):
                 ).interactive()
                 st.altair_chart(line_chart_total_orders, use_container_width=True)
             # Number of Drop-offs
+            profile.phase("widgets", "drop-offs grid")
             st.subheader(f"Number of Drop-offs"" "
                          f"from {start_date.date()} to {end_date.date()} with {frequency} frequency")
             st.write("This KPI measures the total number of delivery locations visited within the selected date range. It's calculated by summing up the number of locations for each route within the selected date range. The data is displayed in a line chart with 'Date' on the x-axis and 'Total Drop-offs' on the y-axis.")
@@ -1419,6 +1354,7 @@ if st.sidebar.button("Filter"):
                            value_column='Total Drop-offs',
                            )
 
+            profile.phase("chart", "drop-offs")
             if not aggregated_drop_offs.empty:
                 line_chart_drop_offs = alt.Chart(aggregated_drop_offs).mark_line(point=True).encode(
                     x='frequency:T',
@@ -1430,6 +1366,7 @@ if st.sidebar.button("Filter"):
                 ).interactive()
                 st.altair_chart(line_chart_drop_offs, use_container_width=True) 
             # Distance Traveled Without Return
+            profile.phase("widgets", "distance traveled grid")
             st.subheader(f"Distance Traveled Without Return"" "
                       f"from {start_date.date()} to {end_date.date()} with {frequency} frequency")
             st.write("This KPI measures the total distance traveled by vehicles during deliveries, excluding any return trips. It's calculated by summing up the distances for each route within the selected date range. The data is displayed in a line chart with 'Date' on the x-axis and 'Total Distance (km)' on the y-axis.")
@@ -1439,6 +1376,7 @@ if st.sidebar.button("Filter"):
                            index_column='Driver name',
                            value_column='Total Distance (km)',
                            )
+            profile.phase("chart", "distance traveled")
             if not aggregated_distance_traveled.empty:
                 line_chart_distance_traveled = alt.Chart(aggregated_distance_traveled).mark_line(point=True).encode(
                     x='frequency:T',
@@ -1452,6 +1390,7 @@ if st.sidebar.button("Filter"):
                 st.altair_chart(line_chart_distance_traveled, use_container_width=True)
            
             # Visualization for Total Deliveries This Month
+            profile.phase("widgets", "total deliveries grid")
             st.subheader(f"Total Deliveries by each Driver" " " 
                          f"from {start_date.date()} to {end_date.date()} with {frequency} frequency")
 
@@ -1461,6 +1400,7 @@ if st.sidebar.button("Filter"):
                            index_column='Driver name',
                            value_column='Total Deliveries',
                            )
+            profile.phase("chart", "total deliveries")
             total_deliveries_chart = alt.Chart(aggregated_total_deliveries).mark_line(point=True).encode(
                 x='frequency:T',
                 y='total_deliveries_within_date_range:Q',
@@ -1471,6 +1411,7 @@ if st.sidebar.button("Filter"):
             ).interactive()
             st.altair_chart(total_deliveries_chart, use_container_width=True) 
             
+            profile.phase("widgets", "delivered percentage grid")
             st.subheader("Delivered Percentage per Driver (DELIVERED VS ASSIGNED) based on the selected ferquency") 
             st.write("The percentage of orders delivered by each driver out of the total number of assigned orders during the specified date range. This is computed based on a selected frequency basis.")
             df_dp = aggregated_delivered_percentage_each_day.rename(columns={'frequency': 'Date','driver_name':'Driver name',  'delivered_percentage_per_day': 'Delivered Percentage'})
@@ -1479,6 +1420,7 @@ if st.sidebar.button("Filter"):
                            index_column='Driver name',
                            value_column='Delivered Percentage',
                            )
+            profile.phase("chart", "delivered percentage")
             if not df_delivered_percentage_each_day.empty:
                 delivered_percentage_each_day_chart = alt.Chart(aggregated_delivered_percentage_each_day).mark_line(point=True).encode(
                     x='frequency:T',
@@ -1491,6 +1433,7 @@ if st.sidebar.button("Filter"):
             
                 st.altair_chart(delivered_percentage_each_day_chart, use_container_width=True) 
             
+            profile.phase("widgets", "returned percentage grid")
             st.subheader("Returned Percentage per Driver (RETURNED VS ASSIGNED) based on the selected ferquency") 
             st.write("The percentage of orders returned by each driver out of the total number of assigned orders during the specified date range. This is computed based on a selected frequency basis.")
             df_rp = aggregated_returned_percentage_each_day.rename(columns={'frequency': 'Date','driver_name':'Driver name',  'returned_percentage_per_day': 'Returned Percentage'})
@@ -1499,6 +1442,7 @@ if st.sidebar.button("Filter"):
                            index_column='Driver name',
                            value_column='Returned Percentage',
                            )
+            profile.phase("chart", "returned percentage")
             if not df_returned_percentage_each_day.empty:
                 returned_percentage_each_day_chart = alt.Chart(aggregated_returned_percentage_each_day).mark_line(point=True).encode(
                     x='frequency:T',
@@ -1512,11 +1456,13 @@ if st.sidebar.button("Filter"):
                 st.altair_chart(returned_percentage_each_day_chart, use_container_width=True) 
             
             
+            profile.phase("widgets", "overall efficiency table")
             st.subheader("Delivered Percentage (Overall Efficiency) per Driver (DELIVERED VS ASSIGNED)") 
             st.write("This metric shows the percentage of deliveries successfully completed by the driver over the entire dataset. It provides an aggregate view of the driver’s delivery efficiency, helping you assess overall performance without breaking it down by individual days or frequency.")
             
             df_dp = final_aggregated_data.rename(columns={'frequency': 'Date','driver_name':'Driver name',  'delivered_percentage': 'Delivered Percentage'})
             st.write(df_dp)
+            profile.phase("chart", "overall efficiency")
             if not final_aggregated_data.empty:
                 delivered_percentage_chart = alt.Chart(final_aggregated_data).mark_bar(size=5).encode(
                     x='driver_name:N',
@@ -1528,6 +1474,7 @@ if st.sidebar.button("Filter"):
                 ).interactive()
                 st.altair_chart(delivered_percentage_chart, use_container_width=True)
                 
+            profile.phase("widgets", "average rating grid")
             st.header("Driver Quality")
             st.subheader(f"Average Rating"" "
                          f"from {start_date.date()} to {end_date.date()} with {frequency} frequency")
@@ -1542,6 +1489,7 @@ if st.sidebar.button("Filter"):
                            value_column='Average Rating',
                           )
             
+            profile.phase("chart", "average rating")
             if not aggregated_avg_rating.empty:
                 avg_rating_chart = alt.Chart(aggregated_avg_rating).mark_line(point=True).encode(
                     x='frequency:T',
@@ -1565,11 +1513,13 @@ if st.sidebar.button("Filter"):
     with tab2:
        
         # Reshape data for line chart visualization
+        profile.phase("transform", "delivery summary reshape")
         df_summary_melted = df_summary.melt(id_vars=["assigned_day"], 
                                     value_vars=["total orders assigned", "delivered_24_hr", "delivered_2_days", "delivered_3_days", "delivered_4_days", "delivered_5_days", "delivered_6_days","orders rejected by vendors", "returned orders", "orders accepted by vendors", "orders pending vendor acceptance","returned_and_delivered_again"],
                                     var_name="delivery_time_frame", value_name="count")
     
         # Visualization for the summary
+        profile.phase("widgets", "delivery summary grid")
         st.subheader("Order Delivery Summary")
         st.write("""
                  Delivery Time Metrics:
@@ -1584,6 +1534,7 @@ if st.sidebar.button("Filter"):
  
         visualize_data(df_summary_melted, date_column="assigned_day", value_column="count", index_column="delivery_time_frame")
 
+        profile.phase("chart", "delivery summary")
         fig_summary = px.line(
             df_summary_melted,
             x="assigned_day",
@@ -1602,6 +1553,7 @@ if st.sidebar.button("Filter"):
         time_frames = ["24 Hours", "48 Hours", "72 Hours","4_days", "5_days","6_days", "More than 6 Days"]
 
         # Iterate over each time frame and create an expandable section
+        profile.phase("chart", "deliveries per time frame")
         for time_frame in time_frames:
             with st.expander(f"Orders Delivered within {time_frame}", expanded=False):
                 # Filter the data for the current time frame
@@ -1622,9 +1574,11 @@ if st.sidebar.button("Filter"):
                 st.plotly_chart(fig_delivered)
         
         # Unpicked Orders Visualization
+        profile.phase("widgets", "unpicked orders grid")
         st.subheader("Total Unpicked Orders by Driver and Date")
         st.write("This metric tracks the total number of unpicked deliveries assigned to drivers within the selected time frame. Unpicked deliveries refer to orders that have been assigned to drivers but have not yet begun transit.  The data is grouped by the assignment date and driver, offering insights into individual driver performance and overall operational efficiency.")
         visualize_data(df_unpicked_1, date_column="assigned_time", value_column="total_unpicked", index_column="driver_name")
+        profile.phase("chart", "unpicked orders")
         fig_unpicked = px.line(
             df_unpicked_1, 
             x='assigned_time', 
@@ -1636,9 +1590,11 @@ if st.sidebar.button("Filter"):
         )
         st.plotly_chart(fig_unpicked)
 
+        profile.phase("widgets", "unpicked group orders grid")
         st.subheader("Unpicked Group Orders Locations by Driver and Date")
         st.write("This query tracks the efficiency of drivers by counting the number of unique locations where Group orders have been assigned but not yet picked up. The data is grouped by driver and date, helping identify potential delays in the delivery process and monitor overall driver performance.")
         visualize_data(df_unpicked, date_column="assigned_time", value_column="total_unpicked", index_column="driver_name")
+        profile.phase("chart", "unpicked group orders")
         fig_unpicked = px.line(
             df_unpicked, 
             x='assigned_time', 
@@ -1650,9 +1606,11 @@ if st.sidebar.button("Filter"):
         )
         st.plotly_chart(fig_unpicked)
 
+        profile.phase("widgets", "unpicked personal orders grid")
         st.subheader("Unpicked Personal Orders Locations by Driver and Date")
         st.write("This query tracks the efficiency of drivers by counting the number of unique locations where Personal orders have been assigned but not yet picked up. The data is grouped by driver and date, helping identify potential delays in the delivery process and monitor overall driver performance.")
         visualize_data(df_unpicked_personal, date_column="assigned_time", value_column="total_unpicked", index_column="driver_name")
+        profile.phase("chart", "unpicked personal orders")
         fig_unpicked_personal = px.line(
             df_unpicked_personal, 
             x='assigned_time', 
@@ -1665,6 +1623,7 @@ if st.sidebar.button("Filter"):
         st.plotly_chart(fig_unpicked_personal)
         # Unassigned Orders Visualization
 
+        profile.phase("chart", "unassigned orders")
         st.subheader("Total Unassigned Orders")
         st.write("This metric tracks the number of unique locations with orders that were created but never assigned to a driver. It highlights potential gaps in resource management or bottlenecks in the assignment process, which could lead to delayed deliveries or unfulfilled orders.")
         fig_unassigned_1 = px.line(
@@ -1701,8 +1660,10 @@ if st.sidebar.button("Filter"):
         )
         st.plotly_chart(fig_unassigned_personal)
         st.subheader("Delivered vs Returned orders ")
+        profile.phase("fetch", "delivered vs returned")
         delivered_vs_returned_df,returned_orders_reason_df=fetch_report_data(start_date, end_date)
         
+        profile.phase("chart", "delivered vs returned trends")
         data_frames = {
             'Delivered vs Returned': delivered_vs_returned_df,
             'Returned Orders per Reasons': returned_orders_reason_df
@@ -1713,3 +1674,8 @@ if st.sidebar.button("Filter"):
         
         
         
+
+else:
+    st.info("Choose the dates, drivers and frequency and press Filter to load the logistics KPIs.")
+
+profile.finish()
@@ -1,10 +1,13 @@
 import streamlit as st 
 import pandas as pd 
 import datetime
-from db_pool import get_conn, release_conn
+from db_pool import fresh_derived_tables, get_conn, release_conn
+from derived_tables import source
+from query_metrics import cache_data
+from render_profile import start_profile
 
 # function to fetch data 
-@st.cache_data
+@cache_data
 def fetch_aggregated_data(start_date, end_date, frequency):
     conn = get_conn()
     try:
@@ -18,21 +21,25 @@ def fetch_aggregated_data(start_date, end_date, frequency):
            
             params = [start_date, end_date]
             
+            # All queries read the per-day rating histogram kept by
+            # rollups.py (daily_product_ratings): one row per product, day
+            # and star value with its count.
+            ratings = source("daily_product_ratings", fresh_derived_tables(), start_date, end_date)
+            
             query_combined = f"""SELECT 
-                DATE_TRUNC('{date_trunc}', pr.created_at)::date AS period, 
+                DATE_TRUNC('{date_trunc}', pr.rating_date)::date AS period, 
                 p.id AS product_id, 
                 pn.name AS product_name, 
-                AVG(pr.rating) AS average_rating,
-                COUNT(pr.id) AS review_count
+                SUM(pr.rating * pr.rating_count)::numeric / SUM(pr.rating_count) AS average_rating,
+                SUM(pr.rating_count)::bigint AS review_count
             FROM 
                 products p
             JOIN 
-                product_ratings pr ON p.id = pr.product_id
+                {ratings} pr ON p.id = pr.product_id
             JOIN 
                 product_names pn ON p.name_id = pn.id
             WHERE 
-                pr.deleted_at IS NULL 
-                AND pr.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                pr.rating_date BETWEEN %s AND %s
             GROUP BY 
                 period, p.id, pn.name
             ORDER BY 
@@ -49,14 +56,13 @@ def fetch_aggregated_data(start_date, end_date, frequency):
             
             # Product Rating Distribution
             query_rating_dist = f"""SELECT 
-                DATE_TRUNC('{date_trunc}', created_at)::date AS period,
+                DATE_TRUNC('{date_trunc}', rating_date)::date AS period,
                 rating, 
-                COUNT(*) AS count
+                SUM(rating_count)::bigint AS count
             FROM 
-                product_ratings
+                {ratings} pr
             WHERE 
-                deleted_at IS NULL
-                AND created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                rating_date BETWEEN %s AND %s
             GROUP BY 
                 rating, period
             ORDER BY 
@@ -69,19 +75,18 @@ def fetch_aggregated_data(start_date, end_date, frequency):
             df_rating_dist = pd.DataFrame(data_rating_dist, columns=colnames_rating_dist)
             # Products with the Most Reviews
             query_most_review = f"""SELECT 
-                    DATE_TRUNC('{date_trunc}', pr.created_at)::date AS period,
+                    DATE_TRUNC('{date_trunc}', pr.rating_date)::date AS period,
                     p.id AS product_id, 
                     pn.name AS product_name, 
-                    COUNT(pr.id) AS review_count
+                    SUM(pr.rating_count)::bigint AS review_count
                 FROM 
                     products p
                 JOIN 
-                    product_ratings pr ON p.id = pr.product_id
+                    {ratings} pr ON p.id = pr.product_id
                 JOIN 
                     product_names pn ON p.name_id = pn.id
                 WHERE 
-                    pr.deleted_at IS NULL 
-                    AND pr.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                    pr.rating_date BETWEEN %s AND %s
                 GROUP BY 
                     period, p.id, pn.name
                 ORDER BY 
@@ -95,21 +100,30 @@ def fetch_aggregated_data(start_date, end_date, frequency):
             df_most_review = pd.DataFrame(data_most_review,columns = colnames_most_review)
             # Products with the Highest Rating Variability / inconsistancy
             query_high_variablity = f"""SELECT 
-                    DATE_TRUNC('{date_trunc}', pr.created_at)::date AS period,
-                    p.id AS product_id, 
-                    pn.name AS product_name, 
-                    STDDEV(pr.rating) AS rating_stddev
-                FROM 
-                    products p
-                JOIN 
-                    product_ratings pr ON p.id = pr.product_id
-                JOIN 
-                    product_names pn ON p.name_id = pn.id
-                WHERE 
-                    pr.deleted_at IS NULL 
-                    AND pr.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
-                GROUP BY 
-                    period,p.id, pn.name
+                    period,
+                    product_id, 
+                    product_name, 
+                    -- Sample standard deviation from count, sum and sum of squares
+                    CASE WHEN n > 1 THEN SQRT(GREATEST(total_sq - total * total / n, 0) / (n - 1)) END AS rating_stddev
+                FROM (
+                    SELECT 
+                        DATE_TRUNC('{date_trunc}', pr.rating_date)::date AS period,
+                        p.id AS product_id, 
+                        pn.name AS product_name, 
+                        SUM(pr.rating_count)::bigint AS n,
+                        SUM(pr.rating * pr.rating_count)::numeric AS total,
+                        SUM(pr.rating * pr.rating * pr.rating_count)::numeric AS total_sq
+                    FROM 
+                        products p
+                    JOIN 
+                        {ratings} pr ON p.id = pr.product_id
+                    JOIN 
+                        product_names pn ON p.name_id = pn.id
+                    WHERE 
+                        pr.rating_date BETWEEN %s AND %s
+                    GROUP BY 
+                        period,p.id, pn.name
+                ) product_stats
                 ORDER BY 
                     rating_stddev DESC;
                 --LIMIT 10;
@@ -122,19 +136,18 @@ def fetch_aggregated_data(start_date, end_date, frequency):
             
             # Product Performance Over Time
             query_performance = f"""SELECT
-                DATE_TRUNC('{date_trunc}', pr.created_at)::date AS period, 
+                DATE_TRUNC('{date_trunc}', pr.rating_date)::date AS period, 
                 p.id AS product_id, 
                 pn.name AS product_name, 
-                AVG(pr.rating) AS average_rating
+                SUM(pr.rating * pr.rating_count)::numeric / SUM(pr.rating_count) AS average_rating
             FROM 
                 products p
             JOIN 
-                product_ratings pr ON p.id = pr.product_id
+                {ratings} pr ON p.id = pr.product_id
             JOIN 
                 product_names pn ON p.name_id = pn.id
             WHERE 
-                pr.deleted_at IS NULL 
-                AND pr.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                pr.rating_date BETWEEN %s AND %s
             GROUP BY 
                 period, p.id, pn.name
             ORDER BY 
@@ -148,23 +161,22 @@ def fetch_aggregated_data(start_date, end_date, frequency):
             
             # Top Products by Vendor
             query_by_vendor = f"""SELECT 
-                DATE_TRUNC('{date_trunc}', pr.created_at)::date AS period,
+                DATE_TRUNC('{date_trunc}', pr.rating_date)::date AS period,
                 v.id AS vendor_id, 
                 v.name AS vendor_name, 
                 p.id AS product_id, 
                 pn.name AS product_name, 
-                AVG(pr.rating) AS average_rating
+                SUM(pr.rating * pr.rating_count)::numeric / SUM(pr.rating_count) AS average_rating
             FROM 
                 vendors v
             JOIN 
                 products p ON v.id = p.vendor_id
             JOIN 
-                product_ratings pr ON p.id = pr.product_id
+                {ratings} pr ON p.id = pr.product_id
             JOIN 
                 product_names pn ON p.name_id = pn.id
             WHERE 
-                pr.deleted_at IS NULL 
-                AND pr.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                pr.rating_date BETWEEN %s AND %s
             GROUP BY 
                 period,v.id, v.name, p.id, pn.name
             ORDER BY 
@@ -183,15 +195,19 @@ def fetch_aggregated_data(start_date, end_date, frequency):
         if conn:
             release_conn(conn)
 
+profile = start_profile("6_product_kpi")
+profile.phase("widgets", "date filters")
 default_start_date = datetime.datetime.today() - datetime.timedelta(days=7)
 start_date = st.sidebar.date_input("Start date", default_start_date)
 end_date = st.sidebar.date_input("End date", datetime.datetime.today())
 start_date = pd.to_datetime(start_date).date()
 end_date = pd.to_datetime(end_date).date()
 frequency = st.sidebar.selectbox("Frequency", ["Daily", "Weekly", "Monthly"])
+profile.phase("fetch", "product ratings")
 df_rating_dist, df_most_review, df_high_variablity, df_performance, df_by_vendor, df_combined = fetch_aggregated_data(start_date,end_date,frequency)
 
 
+profile.phase("transform", "drop id columns")
 df_rating_dist=df_rating_dist.drop(columns=['product_id'], errors='ignore')
 df_most_review=df_most_review.drop(columns=['product_id'], errors='ignore')
 df_high_variablity=df_high_variablity.drop(columns=['product_id'], errors='ignore')
@@ -199,6 +215,7 @@ df_performance=df_performance.drop(columns=['product_id'], errors='ignore')
 df_by_vendor=df_by_vendor.drop(columns=['product_id','vendor_id'], errors='ignore')
 df_combined = df_combined.drop(columns=['product_id'], errors='ignore')
 
+profile.phase("widgets", "rating tables")
 st.subheader(f"Worst Performing Products by Average Rating and Review Volume {frequency} report from {start_date} to {end_date}")
 st.write("This KPI identifies the products with the lowest average customer ratings while prioritizing those with the highest number of reviews. By focusing on these products, the metric highlights items that not only perform poorly in customer satisfaction but also attract significant attention (high in review counts), making them critical targets for quality improvement initiatives. This KPI helps in pinpointing products that may require immediate attention to improve overall customer experience and satisfaction.")
 df_combined.index = df_combined.index + 1
@@ -231,3 +248,4 @@ st.write(df_performance)
 
     
 
+profile.finish()
@@ -6,13 +6,20 @@ import plotly.express as px
 import plotly.graph_objects as go
 import seaborn as sns
 import matplotlib.pyplot as plt
-from db_pool import get_conn, release_conn
+from db_pool import QUERY_CACHE_TTL, get_conn, release_conn
+from deferred_loads import filters_applied, load_requests
+from query_metrics import cache_data
+from sql_filters import date_range
 import numpy as np
 from st_aggrid import AgGrid, GridOptionsBuilder
+from render_profile import start_profile
 
+profile = start_profile("7_group_failurity")
+profile.phase("widgets", "title")
 st.title("Group Failure KPI Dashboard")
 
 # Query and calculate metrics
+@cache_data(ttl=QUERY_CACHE_TTL)
 def get_kpi_data(start_date,end_date):
     conn = get_conn()
     
@@ -30,7 +37,7 @@ def get_kpi_data(start_date,end_date):
                 JOIN groups_carts gc ON g.id = gc.group_id
                 JOIN group_deals gd ON g.group_deals_id = gd.id
                 WHERE g.status = 'FAILED' 
-                AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                AND {date_range('g.created_at')}
                 GROUP BY g.id, gd.max_group_member, g.created_at, g.updated_at
             )
             SELECT 
@@ -57,7 +64,7 @@ def get_kpi_data(start_date,end_date):
             SELECT COUNT(DISTINCT user_id) AS failed_unique_group_members
             FROM groups_carts gc
             JOIN groups g ON gc.group_id = g.id
-            WHERE g.status = 'FAILED' AND gc.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second';
+            WHERE g.status = 'FAILED' AND {date_range('gc.created_at')};
             """
             
             query_returned_leaders_as_members = f"""WITH leader_failures AS (
@@ -66,7 +73,7 @@ def get_kpi_data(start_date,end_date):
                         g.created_at AS group_created_at
                     FROM groups g
                     WHERE g.status = 'FAILED'
-                    AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second' -- Date filter in CTE
+                    AND {date_range('g.created_at')} -- Date filter in CTE
                 )
                 SELECT 
                     COUNT(DISTINCT gc.user_id) AS returned_leaders_as_members,
@@ -90,7 +97,7 @@ def get_kpi_data(start_date,end_date):
                 WHERE 
                     g.created_at > lf.group_created_at
                     AND g.status = 'FAILED'
-                    AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                    AND {date_range('g.created_at')}
                 GROUP BY time_interval;
                 """
             query_returned_members_as_leaders = f"""WITH member_failures AS (
@@ -100,7 +107,7 @@ def get_kpi_data(start_date,end_date):
                 FROM groups_carts gc
                 JOIN groups g ON gc.group_id = g.id
                 WHERE g.status = 'FAILED'
-                AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                AND {date_range('g.created_at')}
             )
             SELECT 
                 COUNT(DISTINCT g.created_by) AS returned_members_as_leaders,
@@ -123,7 +130,7 @@ def get_kpi_data(start_date,end_date):
             WHERE 
                 g.created_at > mf.group_created_at 
                 AND g.status = 'FAILED'
-                AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                AND {date_range('g.created_at')}
             GROUP BY time_interval;
             """
             
@@ -131,7 +138,7 @@ def get_kpi_data(start_date,end_date):
                     SELECT created_by AS leader_id, created_at
                     FROM groups
                     WHERE status = 'FAILED'
-                    AND created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                    AND {date_range('created_at')}
                 )
                 SELECT 
                     COUNT(DISTINCT g.created_by) AS returned_leaders_again,
@@ -153,7 +160,7 @@ def get_kpi_data(start_date,end_date):
                 JOIN leader_failures lf ON g.created_by = lf.leader_id
                 WHERE g.created_at > lf.created_at
                 AND g.status = 'FAILED'
-                AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                AND {date_range('g.created_at')}
                 GROUP BY time_interval;"""
             
             # Query for Returned Members as Members:
@@ -166,7 +173,7 @@ def get_kpi_data(start_date,end_date):
                     FROM groups_carts gc
                     JOIN groups g ON gc.group_id = g.id
                     WHERE g.status = 'FAILED'
-                    AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                    AND {date_range('g.created_at')}
                 )
                 SELECT 
                     COUNT(DISTINCT gc.user_id) AS returned_members_as_members,
@@ -190,7 +197,7 @@ def get_kpi_data(start_date,end_date):
                 WHERE 
                     g.created_at > mf.group_failed_at -- Returned after failing in a previous group
                     AND g.status != 'FAILED' -- The group they returned to should not have failed
-                    AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                    AND {date_range('g.created_at')}
                 GROUP BY time_interval
                 ORDER BY time_interval;
             """
@@ -204,7 +211,7 @@ def get_kpi_data(start_date,end_date):
                 LEFT JOIN groups prev_groups ON g.created_by = prev_groups.created_by 
                     AND prev_groups.created_at < g.created_at
                 WHERE g.status = 'FAILED'
-                AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                AND {date_range('g.created_at')}
                 GROUP BY g.created_by
             )
             SELECT 
@@ -229,7 +236,7 @@ def get_kpi_data(start_date,end_date):
                 JOIN group_deals gd ON g.group_deals_id = gd.id
                 LEFT JOIN groups_carts gc ON g.id = gc.group_id
                 WHERE g.status = 'FAILED'
-                AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+                AND {date_range('g.created_at')}
                 GROUP BY g.id, gd.max_group_member
             )
             SELECT 
@@ -240,7 +247,7 @@ def get_kpi_data(start_date,end_date):
             JOIN leader_failures lf ON g.created_by = lf.leader_id
             WHERE g.created_at > lf.group_created_at
             AND g.status = 'FAILED'
-            AND g.created_at BETWEEN %s AND %s + INTERVAL '1 day' - INTERVAL '1 second'
+            AND {date_range('g.created_at')}
             GROUP BY lf.max_group_member, lf.group_size_at_failure;
 
             """
@@ -263,7 +270,7 @@ def get_kpi_data(start_date,end_date):
                 JOIN
                     group_deals gd ON g.group_deals_id = gd.id  -- Join groups with group deals to get product and group size info
                 WHERE
-                    DATE(g.created_at) BETWEEN %s AND %s + interval '1 day' - interval '1 second'
+                    {date_range('g.created_at')}
                     AND gc.status ='COMPLETED'
                     AND o.status ='COMPLETED'
                     AND o.deleted_at is null
@@ -407,42 +414,48 @@ def visualize_data(df, date_column, value_column, index_column, column_order=Non
         st.error(f"An error occurred: {e}")
 
 # Sidebar for time frame selection
+profile.phase("widgets", "date filters")
 default_start_date = datetime.datetime.today() - datetime.timedelta(days=7)
-start_date = st.sidebar.date_input("Start date", default_start_date)
-end_date = st.sidebar.date_input("End date", datetime.datetime.today())
+# Nothing is queried until Generate Report is pressed
+with st.sidebar.form("filters"):
+    start_date = st.date_input("Start date", default_start_date)
+    end_date = st.date_input("End date", datetime.datetime.today())
+    submitted = st.form_submit_button("Generate Report")
 start_date = pd.to_datetime(start_date)
 end_date = pd.to_datetime(end_date)
+applied = filters_applied("7_group_failurity", submitted)
 
-df_data_failed_group, df_failed_unique_group_leader, df_failed_unique_group_memeber, df_returned_leaders_as_members, df_returned_members_as_leaders, df_returned_leaders_again, df_returned_members_as_members, df_returned_leaders_failed_size, df_failure_product = get_kpi_data(start_date,end_date)
+if applied:
+    profile.phase("fetch", "group failure KPIs")
+    kpis = load_requests("7_group_failurity", {"kpis": (get_kpi_data, start_date, end_date)}, submitted)["kpis"]
+    df_data_failed_group, df_failed_unique_group_leader, df_failed_unique_group_memeber, df_returned_leaders_as_members, df_returned_members_as_leaders, df_returned_leaders_again, df_returned_members_as_members, df_returned_leaders_failed_size, df_failure_product = kpis
 
-data = {
-    "Failed Group": f"{df_data_failed_group['failed_groups'].sum()}",
-    "Failed Unique Group Leaders": f"{df_failed_unique_group_leader['failed_unique_group_leaders'].sum()}",
-    "Failed Unique Group Members": f"{df_failed_unique_group_memeber['failed_unique_group_members'].sum()}" ,
-    "Returned Members as Group Leaders": f"{df_returned_leaders_as_members['returned_leaders_as_members'].sum()}",
-    "Returned Group Leaders as Members": f"{df_returned_members_as_leaders['returned_members_as_leaders'].sum()}",
-    "Returned Group Leaders as Leaders Again":f"{df_returned_leaders_again['returned_leaders_again'].sum()}",
-    "Returned Group Members as Members Again ":f"{df_returned_members_as_members['returned_members_as_members'].sum()}" 
-}
+    profile.phase("transform", "returning member summary")
+    data = {
+        "Failed Group": f"{df_data_failed_group['failed_groups'].sum()}",
+        "Failed Unique Group Leaders": f"{df_failed_unique_group_leader['failed_unique_group_leaders'].sum()}",
+        "Failed Unique Group Members": f"{df_failed_unique_group_memeber['failed_unique_group_members'].sum()}" ,
+        "Returned Members as Group Leaders": f"{df_returned_leaders_as_members['returned_leaders_as_members'].sum()}",
+        "Returned Group Leaders as Members": f"{df_returned_members_as_leaders['returned_members_as_leaders'].sum()}",
+        "Returned Group Leaders as Leaders Again":f"{df_returned_leaders_again['returned_leaders_again'].sum()}",
+        "Returned Group Members as Members Again ":f"{df_returned_members_as_members['returned_members_as_members'].sum()}" 
+    }
 
-import pandas as pd
-
-combined_df_1 = pd.merge(df_returned_leaders_as_members, df_returned_members_as_leaders, on='time_interval', how='outer', suffixes=('_members_as_leader', '_members_as_leaders'))
-combined_df_2 = pd.merge( df_returned_leaders_again, df_returned_members_as_members, on='time_interval', how='outer', suffixes=('_leader_again', '_members_as_members') )
-combined_df = pd.merge(combined_df_1, combined_df_2, on='time_interval', how='outer')
+    combined_df_1 = pd.merge(df_returned_leaders_as_members, df_returned_members_as_leaders, on='time_interval', how='outer', suffixes=('_members_as_leader', '_members_as_leaders'))
+    combined_df_2 = pd.merge( df_returned_leaders_again, df_returned_members_as_members, on='time_interval', how='outer', suffixes=('_leader_again', '_members_as_members') )
+    combined_df = pd.merge(combined_df_1, combined_df_2, on='time_interval', how='outer')
 
-# Rename columns for clarity
-combined_df.columns = ['Returned Members as Group Leaders', 
-                       'Time Frame',
-                       'Returned Group Leaders as Members', 
-                       'Returned Group Leaders as Leaders Again',
-                       'Returned Group Members as Members Again'
-                       ]
-df = combined_df[['Time Frame','Returned Members as Group Leaders',  'Returned Group Leaders as Members', 'Returned Group Leaders as Leaders Again', 'Returned Group Members as Members Again']]
-pivot_df = df.pivot_table(index=None, columns='Time Frame', values=['Returned Members as Group Leaders', 'Returned Group Leaders as Members', 'Returned Group Leaders as Leaders Again', 'Returned Group Members as Members Again'], aggfunc='sum')
+    # Rename columns for clarity
+    combined_df.columns = ['Returned Members as Group Leaders', 
+                           'Time Frame',
+                           'Returned Group Leaders as Members', 
+                           'Returned Group Leaders as Leaders Again',
+                           'Returned Group Members as Members Again'
+                           ]
+    df = combined_df[['Time Frame','Returned Members as Group Leaders',  'Returned Group Leaders as Members', 'Returned Group Leaders as Leaders Again', 'Returned Group Members as Members Again']]
+    pivot_df = df.pivot_table(index=None, columns='Time Frame', values=['Returned Members as Group Leaders', 'Returned Group Leaders as Members', 'Returned Group Leaders as Leaders Again', 'Returned Group Members as Members Again'], aggfunc='sum')
 
-# Button to generate the report
-if st.sidebar.button("Generate Report"):
+    profile.phase("widgets", "report")
     # Display the KPIs
     st.write()
     col1, col2, col3 = st.columns(3)
@@ -528,3 +541,4 @@ if st.sidebar.button("Generate Report"):
 else:
     st.info("Please enter a time frame and click 'Generate Report' to view the KPIs.")
 
+profile.finish()
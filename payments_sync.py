@@ -0,0 +1,100 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Local copy of the order -> payment method mapping that used to be streamed
+# over dblink on every request. One row per payments transaction so joins
+# behave exactly like the old dblink scan.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS order_payment_methods (
+    transaction_id VARCHAR PRIMARY KEY,
+    order_id VARCHAR NOT NULL,
+    status VARCHAR,
+    name VARCHAR,
+    updated_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS order_payment_methods_completed_order_id_idx
+    ON order_payment_methods (order_id) WHERE status = 'COMPLETED';
+
+CREATE TABLE IF NOT EXISTS payments_sync_state (
+    source VARCHAR PRIMARY KEY,
+    last_updated_at TIMESTAMPTZ NOT NULL,
+    last_synced_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Runs on the payments database; %L is filled with the watermark so only
+# changed transactions cross the dblink. Transactions that were never
+# updated have no updated_at, so their created_at stands in for it, both in
+# the filter and in the local copy the watermark is taken from.
+REMOTE_QUERY = """
+SELECT t.id::varchar, pi2.third_party_payment_id, t.status, pm.name,
+       COALESCE(t.updated_at, t.created_at) AS updated_at
+FROM payment_intents pi2
+JOIN transactions t ON t.payment_intent_id = pi2.id
+JOIN payment_methods pm ON pm.id = t.payment_method_id
+WHERE COALESCE(t.updated_at, t.created_at) >= %L
+"""
+
+UPSERT_SQL = """
+WITH upserted AS (
+INSERT INTO order_payment_methods (transaction_id, order_id, status, name, updated_at)
+SELECT transaction_id, order_id, status, name, updated_at
+FROM dblink($1, format($2, COALESCE($3::timestamptz, '-infinity')))
+    AS r(transaction_id VARCHAR, order_id VARCHAR, status VARCHAR, name VARCHAR, updated_at TIMESTAMPTZ)
+WHERE order_id IS NOT NULL
+ON CONFLICT (transaction_id) DO UPDATE SET
+    order_id = EXCLUDED.order_id,
+    status = EXCLUDED.status,
+    name = EXCLUDED.name,
+    updated_at = EXCLUDED.updated_at
+RETURNING updated_at
+)
+SELECT COUNT(*) AS synced, MAX(updated_at) AS max_updated_at FROM upserted
+"""
+
+# Arbitrary key so only one API worker runs the sync at a time.
+SYNC_LOCK_KEY = 740212
+
+async def ensure_schema(pool):
+    async with pool.acquire() as conn:
+        await conn.execute(SCHEMA_SQL)
+
+async def sync_payment_methods(pool, dbname: str, full: bool = False) -> int:
+    # Copies new and changed transactions, by COALESCE(updated_at,
+    # created_at) against the watermark, so transactions that never had an
+    # updated_at are synced as well. full re-reads every transaction
+    # regardless of the watermark. Transactions deleted on the payments
+    # database are never removed from order_payment_methods, not even by a
+    # full sync.
+    source = f"dbname={dbname}"
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            locked = await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", SYNC_LOCK_KEY)
+            if not locked:
+                logger.info("Payments sync already running in another worker; skipping.")
+                return 0
+
+            watermark = None if full else await conn.fetchval(
+                "SELECT last_updated_at FROM payments_sync_state WHERE source = $1", source
+            )
+            # The boundary row is re-read on purpose (>=): transactions that
+            # share the watermark timestamp but committed later are not lost,
+            # and the upsert makes the overlap harmless.
+            row = await conn.fetchrow(UPSERT_SQL, source, REMOTE_QUERY, watermark)
+            synced = row["synced"]
+
+            if row["max_updated_at"] is not None:
+                await conn.execute(
+                    """
+                    INSERT INTO payments_sync_state (source, last_updated_at, last_synced_at)
+                    VALUES ($1, $2, now())
+                    ON CONFLICT (source) DO UPDATE SET
+                        last_updated_at = GREATEST(payments_sync_state.last_updated_at, EXCLUDED.last_updated_at),
+                        last_synced_at = EXCLUDED.last_synced_at
+                    """,
+                    source, row["max_updated_at"],
+                )
+
+    logger.info(f"Synced {synced} payment rows from {dbname}.")
+    return synced
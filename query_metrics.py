@@ -0,0 +1,333 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import streamlit as st
+from psycopg2 import extensions
+
+# Per-query instrumentation shared by the Streamlit pages and the API.
+#
+# Every connection handed out by db_pool uses InstrumentedCursor, so each
+# statement is timed where it runs and attributed to a query id: the fetch
+# function that issued it plus a fingerprint of its SQL with the literals
+# stripped, e.g. "3_group_kpi.fetch_data:1c9e4a02". Pool wait and
+# st.cache_data hits/misses are attributed to the same fetch function.
+#
+# Streamlit and the API are separate processes, so the Streamlit side writes
+# its counters to SNAPSHOT_FILE every SNAPSHOT_INTERVAL seconds and the
+# API's /metrics endpoint exports both.
+
+SNAPSHOT_FILE = os.environ.get(
+    "QUERY_METRICS_FILE", os.path.join(tempfile.gettempdir(), "kpi_query_metrics.json")
+)
+SNAPSHOT_INTERVAL = 10.0
+
+# Frames in these files are plumbing; the query belongs to whoever called them
+_PLUMBING = {os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_fetch.py")}
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\?(?:\s*,\s*\?)+"), "?"),  # IN lists of any length
+    (re.compile(r"\bfetch_[0-9a-f]{32}\b"), "fetch_?"),  # db_fetch cursor names
+    (re.compile(r"\s+"), " "),
+]
+
+def fingerprint(sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    elif not isinstance(sql, str):
+        sql = str(sql)  # psycopg2.sql.Composed
+    for pattern, replacement in _LITERALS:
+        sql = pattern.sub(replacement, sql)
+    sql = sql.strip()
+    return hashlib.blake2b(sql.encode(), digest_size=4).hexdigest(), sql
+
+def caller_source(depth=2):
+    # "<module file>.<function>" of the first frame outside psycopg2/pandas,
+    # this module and db_fetch; private helpers (_execute, ...) are
+    # attributed to the function that called them.
+    frame = sys._getframe(depth)
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.abspath(code.co_filename)
+        if (filename not in _PLUMBING and "site-packages" not in filename
+                and not code.co_name.startswith("_")):
+            return f"{os.path.splitext(os.path.basename(filename))[0]}.{code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+def estimate_bytes(rows):
+    # Text size of the first row times the row count; close enough to rank
+    # queries by transfer volume without walking every value.
+    if not rows:
+        return 0
+    sample = rows[0]
+    if not isinstance(sample, (tuple, list)):
+        sample = (sample,)
+    return len(rows) * sum(len(str(value)) for value in sample if value is not None)
+
+
+class QueryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.snapshot_file = None
+        self._last_flush = 0.0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._queries = {}  # (source, fingerprint) -> counters
+            self._sources = {}  # source -> pool wait and cache counters
+
+    def _source(self, source):
+        entry = self._sources.get(source)
+        if entry is None:
+            entry = self._sources[source] = {
+                "checkouts": 0, "pool_wait_seconds": 0.0, "pool_wait_max": 0.0,
+                "cache_hits": 0, "cache_misses": 0,
+            }
+        return entry
+
+    def record_query(self, key, text, seconds, rows=0, nbytes=0, executions=0, errors=0):
+        with self._lock:
+            entry = self._queries.get(key)
+            if entry is None:
+                entry = self._queries[key] = {
+                    "text": text, "executions": 0, "errors": 0, "seconds": 0.0,
+                    "max_seconds": 0.0, "rows": 0, "bytes": 0,
+                }
+            entry["executions"] += executions
+            entry["errors"] += errors
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["rows"] += rows
+            entry["bytes"] += nbytes
+        self.maybe_flush()
+
+    def record_pool_wait(self, source, seconds):
+        with self._lock:
+            entry = self._source(source)
+            entry["checkouts"] += 1
+            entry["pool_wait_seconds"] += seconds
+            entry["pool_wait_max"] = max(entry["pool_wait_max"], seconds)
+
+    def record_cache(self, source, hit):
+        with self._lock:
+            self._source(source)["cache_hits" if hit else "cache_misses"] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "started_at": self.started_at,
+                "written_at": time.time(),
+                "queries": [
+                    {"source": source, "query": query, **entry}
+                    for (source, query), entry in self._queries.items()
+                ],
+                "sources": [{"source": source, **entry} for source, entry in self._sources.items()],
+            }
+
+    def maybe_flush(self, force=False):
+        if self.snapshot_file is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < SNAPSHOT_INTERVAL:
+            return
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_flush = now
+            temp = f"{self.snapshot_file}.{os.getpid()}.tmp"
+            with open(temp, "w") as file:
+                json.dump(self.snapshot(), file)
+            os.replace(temp, self.snapshot_file)
+        except OSError:
+            pass  # metrics must never break a page
+        finally:
+            self._flush_lock.release()
+
+
+query_stats = QueryStats()
+
+def load_snapshot(path=SNAPSHOT_FILE):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# Opt-in log of every statement run through InstrumentedCursor as
+# (fetch function, SQL with its parameters bound); `db_indexes.py check`
+# sets it to a list and EXPLAINs what the pages actually ran.
+statement_log = None
+
+class InstrumentedCursor(extensions.cursor):
+    # Fetch time is added to the statement's own time: for server-side
+    # cursors the rows only cross the wire while fetching.
+    _query_key = None
+    _query_text = None
+
+    def _log(self, query):
+        if statement_log is not None:
+            statement_log.append((self._query_key[0], query))
+
+    def _record(self, started, rows=0, nbytes=0, executions=0, errors=0):
+        if self._query_key is not None:
+            query_stats.record_query(self._query_key, self._query_text, time.perf_counter() - started,
+                                     rows, nbytes, executions, errors)
+
+    def _begin(self, query):
+        query, text = fingerprint(query)
+        self._query_key = (caller_source(3), query)
+        self._query_text = text
+
+    def execute(self, query, vars=None):
+        self._begin(query)
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            self._record(started, executions=1, errors=1)
+            raise
+        self._record(started, executions=1)
+        self._log(self.query)
+        return result
+
+    def executemany(self, query, vars_list):
+        self._begin(query)
+        started = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except Exception:
+            self._record(started, executions=1, errors=1)
+            raise
+        self._record(started, executions=1)
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        self._begin(sql)
+        position = file.tell() if hasattr(file, "tell") else None
+        started = time.perf_counter()
+        try:
+            result = super().copy_expert(sql, file, size)
+        except Exception:
+            self._record(started, executions=1, errors=1)
+            raise
+        nbytes = file.tell() - position if position is not None else 0
+        self._log(sql)
+        self._record(started, rows=max(self.rowcount, 0), nbytes=nbytes, executions=1)
+        return result
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        if row is not None:
+            self._record(started, rows=1, nbytes=estimate_bytes([row]))
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._record(started, rows=len(rows), nbytes=estimate_bytes(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._record(started, rows=len(rows), nbytes=estimate_bytes(rows))
+        return rows
+
+
+_cache_state = threading.local()
+
+def cache_data(func=None, **kwargs):
+    # Drop-in for @st.cache_data that also counts hits and misses. The
+    # wrapped function only runs on a miss, which is how the two are told
+    # apart; the previous flag is restored so nested cached calls (a cached
+    # function calling another) are counted separately.
+    if func is None:
+        return lambda func: cache_data(func, **kwargs)
+    source = f"{os.path.splitext(os.path.basename(func.__code__.co_filename))[0]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def compute(*args, **kw):
+        _cache_state.missed = True
+        return func(*args, **kw)
+
+    cached = st.cache_data(**kwargs)(compute)
+
+    @functools.wraps(func)
+    def lookup(*args, **kw):
+        outer = getattr(_cache_state, "missed", False)
+        _cache_state.missed = False
+        try:
+            result = cached(*args, **kw)
+            query_stats.record_cache(source, hit=not _cache_state.missed)
+            return result
+        finally:
+            _cache_state.missed = outer
+
+    lookup.clear = cached.clear
+    return lookup
+
+
+# Prometheus text exposition (version 0.0.4)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+QUERY_METRICS = [
+    ("kpi_query_executions_total", "counter", "executions", "Statements executed."),
+    ("kpi_query_errors_total", "counter", "errors", "Statements that raised an error."),
+    ("kpi_query_seconds_total", "counter", "seconds", "Wall time spent executing and fetching."),
+    ("kpi_query_seconds_max", "gauge", "max_seconds", "Slowest single execute or fetch call."),
+    ("kpi_query_rows_total", "counter", "rows", "Rows returned to the client."),
+    ("kpi_query_bytes_total", "counter", "bytes", "Bytes transferred (exact for COPY, estimated otherwise)."),
+]
+
+SOURCE_METRICS = [
+    ("kpi_pool_checkouts_total", "counter", "checkouts", "Connections checked out of the pool."),
+    ("kpi_pool_wait_seconds_total", "counter", "pool_wait_seconds", "Time spent waiting for a pooled connection."),
+    ("kpi_pool_wait_seconds_max", "gauge", "pool_wait_max", "Longest wait for a pooled connection."),
+    ("kpi_cache_hits_total", "counter", "cache_hits", "Cached function calls served from the cache."),
+    ("kpi_cache_misses_total", "counter", "cache_misses", "Cached function calls that ran the function."),
+]
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def prometheus_text(snapshots):
+    # snapshots: process label -> snapshot dict (or None if unavailable)
+    lines = []
+    snapshots = {process: snapshot for process, snapshot in snapshots.items() if snapshot}
+
+    for families, section, label in ((QUERY_METRICS, "queries", True), (SOURCE_METRICS, "sources", False)):
+        for name, kind, field, help_text in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for process, snapshot in snapshots.items():
+                for entry in snapshot[section]:
+                    labels = {"process": process, "source": entry["source"]}
+                    if label:
+                        labels["query"] = entry["query"]
+                    lines.append(f"{name}{_labels(**labels)} {entry[field]}")
+
+    lines.append("# HELP kpi_metrics_snapshot_timestamp_seconds When each process's counters were read.")
+    lines.append("# TYPE kpi_metrics_snapshot_timestamp_seconds gauge")
+    for process, snapshot in snapshots.items():
+        lines.append(f"kpi_metrics_snapshot_timestamp_seconds{_labels(process=process)} {snapshot['written_at']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,128 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import altair as alt
+import pandas as pd
+import streamlit as st
+
+# Opt-in render profiler for the dashboard pages. Pages mark where each
+# named phase starts:
+#
+#     profile = start_profile("5_logistic")
+#     profile.phase("fetch", "driver metrics")
+#     ...
+#     profile.phase("chart", "delivery trend")
+#     ...
+#     profile.finish()
+#
+# A phase runs until the next mark (or finish), so the module-level page
+# code needs no re-indenting. Profiling is enabled per render with
+# ?profile in the URL, or for every render with KPI_PROFILE=1; otherwise
+# the marks do nothing. finish() draws a waterfall at the bottom of the
+# page and appends the timings to PROFILE_FILE (JSON lines) so renders can
+# be compared over time.
+
+PHASE_KINDS = ["fetch", "transform", "chart", "widgets"]
+PHASE_COLORS = ["#4c78a8", "#f58518", "#54a24b", "#b279a2"]
+
+PROFILE_FILE = os.environ.get("KPI_PROFILE_FILE", "render_profiles.jsonl")
+TREND_RUNS = 20
+
+
+class RenderProfile:
+    def __init__(self, page, enabled):
+        self.page = page
+        self.enabled = enabled
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self._current = None
+        self.phases = []
+
+    def _close(self, now):
+        if self._current is None:
+            return
+        kind, label, began = self._current
+        self.phases.append({
+            "kind": kind,
+            "label": label,
+            "start_ms": (began - self._started) * 1000,
+            "ms": (now - began) * 1000,
+        })
+        self._current = None
+
+    def phase(self, kind, label):
+        if not self.enabled:
+            return
+        if kind not in PHASE_KINDS:
+            raise ValueError(f"unknown phase kind {kind!r}, expected one of {PHASE_KINDS}")
+        now = time.perf_counter()
+        self._close(now)
+        self._current = (kind, label, now)
+
+    def record(self):
+        return {
+            "page": self.page,
+            "started_at": self.started_at.isoformat(),
+            "total_ms": (time.perf_counter() - self._started) * 1000,
+            "phases": self.phases,
+        }
+
+    def finish(self):
+        if not self.enabled:
+            return
+        self._close(time.perf_counter())
+        record = self.record()
+        try:
+            with open(PROFILE_FILE, "a") as file:
+                file.write(json.dumps(record) + "\n")
+        except OSError as e:
+            st.warning(f"Could not save render profile: {e}")
+        show_profile(record, load_profiles(self.page))
+
+
+def start_profile(page):
+    enabled = "profile" in st.query_params or os.environ.get("KPI_PROFILE") == "1"
+    return RenderProfile(page, enabled)
+
+def load_profiles(page, limit=TREND_RUNS):
+    # The last `limit` saved renders of one page, oldest first
+    try:
+        with open(PROFILE_FILE) as file:
+            records = [json.loads(line) for line in file if line.strip()]
+    except (OSError, ValueError):
+        return []
+    return [record for record in records if record["page"] == page][-limit:]
+
+def kind_totals(record):
+    totals = dict.fromkeys(PHASE_KINDS, 0.0)
+    for phase in record["phases"]:
+        totals[phase["kind"]] += phase["ms"]
+    totals["unmarked"] = record["total_ms"] - sum(totals.values())
+    totals["total"] = record["total_ms"]
+    return totals
+
+def show_profile(record, history):
+    st.divider()
+    st.subheader(f"Render profile: {record['total_ms']:,.0f} ms")
+
+    phases = pd.DataFrame(record["phases"], columns=["kind", "label", "start_ms", "ms"])
+    phases["end_ms"] = phases["start_ms"] + phases["ms"]
+    phases["step"] = [f"{i + 1:02d} {label}" for i, label in enumerate(phases["label"])]
+    chart = alt.Chart(phases).mark_bar().encode(
+        x=alt.X("start_ms:Q", title="ms since the page started"),
+        x2="end_ms:Q",
+        y=alt.Y("step:N", sort=None, title=None),
+        color=alt.Color("kind:N", scale=alt.Scale(domain=PHASE_KINDS, range=PHASE_COLORS)),
+        tooltip=["kind", "label", alt.Tooltip("start_ms:Q", format=",.1f"), alt.Tooltip("ms:Q", format=",.1f")],
+    ).properties(height=max(120, 22 * len(phases)))
+    st.altair_chart(chart, use_container_width=True)
+
+    # This render against the median of the saved renders of the page
+    trend = pd.DataFrame([kind_totals(run) for run in history])
+    summary = pd.DataFrame({"this render (ms)": pd.Series(kind_totals(record))})
+    if len(trend) > 1:
+        summary[f"median of last {len(trend)} (ms)"] = trend.median()
+    st.dataframe(summary.round(1), use_container_width=True)
+    st.caption(f"Timings are appended to {os.path.abspath(PROFILE_FILE)}")
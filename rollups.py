@@ -0,0 +1,472 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Daily fact tables that the KPI pages read instead of re-aggregating raw
+# orders, groups and delivery tracks on every view. Each rollup is rebuilt
+# one day at a time: a refresh finds the days touched since its watermark
+# (plus a short lookback for changes that carry no timestamp), deletes those
+# days and re-inserts them from the source tables.
+#
+# Not every change moves a timestamp: a track flipping to RETURNED, a driver
+# reassignment or an edited group deal leaves the days it affects untouched.
+# Every rebuild_interval seconds a refresh therefore rebuilds the whole
+# rollup from scratch. A change shows up in the rollups
+#   - at the next refresh (refresh_interval) if it carries a timestamp or
+#     falls within the last lookback_days days,
+#   - otherwise at the next full rebuild, at most rebuild_interval later.
+# The rollups over delivery_tracks do not rely on timestamps at all: a
+# trigger queues every inserted, updated or deleted track for them (see
+# TRACK_CHANGES_SQL), so they are exact as of their last refresh.
+#
+# "select" is the per-day aggregate; {days} is replaced with a predicate on
+# the source timestamp that limits it to the days being rebuilt.
+# "changes" lists (day, changed_at) for source rows changed since {since}.
+# "change_log" names the queue a rollup's changes are read from instead; a
+# refresh deletes what it has consumed.
+
+SINCE = "COALESCE($1::timestamp, '-infinity')"
+
+def day_filter(column: str) -> str:
+    # Range bounds let the planner use an index on the timestamp; the array
+    # check then keeps only the touched days inside that range.
+    return f"({column} >= $2::date AND {column} < $3::date + 1 AND DATE({column}) = ANY($1::date[]))"
+
+ORDER_CHANGES = """
+    SELECT DATE(o.created_at) AS day, GREATEST(o.created_at, o.updated_at) AS changed_at
+    FROM orders o
+    WHERE o.created_at >= {since} OR o.updated_at >= {since}
+"""
+
+ROLLUPS = [
+    {
+        # Per-day order counts and accepted orders (orders with at least one
+        # delivery track event).
+        "table": "daily_order_totals",
+        "day_column": "order_date",
+        "select": """
+            SELECT
+                DATE(o.created_at) AS order_date,
+                COUNT(*) AS total_received_orders,
+                COUNT(CASE WHEN o.groups_carts_id IS NOT NULL THEN 1 END) AS group_order_recieved,
+                COUNT(CASE WHEN o.personal_cart_id IS NOT NULL THEN 1 END) AS personal_order_recieved,
+                COUNT(*) FILTER (WHERE
+                    EXISTS (SELECT 1 FROM delivery_tracks dt
+                            WHERE dt.group_cart_id = o.groups_carts_id AND dt.created_at IS NOT NULL)
+                    OR EXISTS (SELECT 1 FROM delivery_tracks dt
+                               WHERE dt.personal_cart_id = o.personal_cart_id AND dt.created_at IS NOT NULL)
+                ) AS total_accepted_orders
+            FROM orders o
+            WHERE o.status = 'COMPLETED'
+              AND {days}
+            GROUP BY DATE(o.created_at)
+        """,
+        "day_source": "o.created_at",
+        "changes": ORDER_CHANGES + """
+            UNION ALL
+            SELECT DATE(o.created_at), dt.created_at
+            FROM delivery_tracks dt
+            JOIN orders o ON o.groups_carts_id = dt.group_cart_id
+            WHERE dt.created_at >= {since}
+            UNION ALL
+            SELECT DATE(o.created_at), dt.created_at
+            FROM delivery_tracks dt
+            JOIN orders o ON o.personal_cart_id = dt.personal_cart_id
+            WHERE dt.created_at >= {since}
+        """,
+    },
+    {
+        # Orders by type and payment method; payment names come from the
+        # local copy kept by payments_sync.py.
+        "table": "daily_order_payment_facts",
+        "day_column": "order_date",
+        "select": """
+            SELECT
+                DATE(o.created_at) AS order_date,
+                COALESCE(payments.name, o.payment_method) AS payment_method,
+                COUNT(*) AS total_orders,
+                COUNT(CASE WHEN o.groups_carts_id IS NOT NULL THEN 1 END) AS group_order_count,
+                COUNT(CASE WHEN o.groups_carts_id IS NOT NULL AND g.status = 'COMPLETED' THEN 1 END) AS completed_group_order_count,
+                COUNT(CASE WHEN o.personal_cart_id IS NOT NULL THEN 1 END) AS personal_order_count
+            FROM orders o
+            LEFT JOIN groups_carts gc ON o.groups_carts_id = gc.id
+            LEFT JOIN groups g ON gc.group_id = g.id
+            LEFT JOIN order_payment_methods payments
+                ON o.id::VARCHAR = payments.order_id AND payments.status = 'COMPLETED'
+            WHERE o.status = 'COMPLETED'
+              AND {days}
+            GROUP BY DATE(o.created_at), COALESCE(payments.name, o.payment_method)
+        """,
+        "day_source": "o.created_at",
+        "changes": ORDER_CHANGES,
+    },
+    {
+        # Volume and revenue by product. The two halves keep the joins of the
+        # original queries (revenue also joins single_deals).
+        "table": "daily_product_sales",
+        "day_column": "order_date",
+        "select": """
+            WITH volume AS (
+                SELECT DATE(o.created_at) AS order_date, pn.name AS product_name,
+                       COALESCE(SUM(pci.quantity * p.weight), 0) AS personal_volume_sold,
+                       COALESCE(SUM(gc.quantity * p.weight), 0) AS group_volume_sold
+                FROM orders o
+                LEFT JOIN personal_cart_items pci ON o.personal_cart_id = pci.cart_id
+                LEFT JOIN groups_carts gc ON o.groups_carts_id = gc.id
+                LEFT JOIN groups g ON gc.group_id = g.id
+                LEFT JOIN group_deals gd ON g.group_deals_id = gd.id
+                LEFT JOIN products p ON COALESCE(pci.product_id, gd.product_id) = p.id
+                JOIN product_names pn ON p.name_id = pn.id
+                WHERE o.status = 'COMPLETED'
+                  AND {days}
+                GROUP BY DATE(o.created_at), pn.name
+            ),
+            revenue AS (
+                SELECT DATE(o.created_at) AS order_date, pn.name AS product_name,
+                       COALESCE(SUM(pci.quantity * sd.original_price), 0) AS personal_revenue,
+                       COALESCE(SUM(gc.quantity * gd.group_price), 0) AS group_revenue
+                FROM orders o
+                LEFT JOIN personal_cart_items pci ON o.personal_cart_id = pci.cart_id
+                LEFT JOIN groups_carts gc ON o.groups_carts_id = gc.id
+                LEFT JOIN groups g ON gc.group_id = g.id
+                LEFT JOIN group_deals gd ON g.group_deals_id = gd.id
+                LEFT JOIN products p ON COALESCE(pci.product_id, gd.product_id) = p.id
+                LEFT JOIN single_deals sd ON p.id = sd.product_id
+                JOIN product_names pn ON p.name_id = pn.id
+                WHERE o.status = 'COMPLETED'
+                  AND {days}
+                GROUP BY DATE(o.created_at), pn.name
+            )
+            SELECT
+                COALESCE(v.order_date, r.order_date) AS order_date,
+                COALESCE(v.product_name, r.product_name) AS product_name,
+                v.personal_volume_sold,
+                v.group_volume_sold,
+                r.personal_revenue,
+                r.group_revenue
+            FROM volume v
+            FULL JOIN revenue r ON r.order_date = v.order_date AND r.product_name = v.product_name
+        """,
+        "day_source": "o.created_at",
+        "changes": ORDER_CHANGES,
+    },
+    {
+        # Group outcomes per leader and day, at the grain of the group_stats
+        # step in the Group KPI page.
+        "table": "daily_group_stats",
+        "day_column": "group_created_date",
+        "select": """
+            WITH aggregated_groups AS (
+                SELECT
+                    DATE(g.created_at) AS group_created_date,
+                    g.id AS group_id,
+                    g.created_by AS group_leader,
+                    gd.max_group_member AS max_group_member,
+                    g.status,
+                    LEAST(GREATEST(EXTRACT(EPOCH FROM (g.updated_at - g.created_at)) / 3600, 0), 24) AS completion_duration_hours
+                FROM groups g
+                JOIN group_deals gd ON g.group_deals_id = gd.id
+                WHERE {days}
+            ),
+            new_group_leaders_cte AS (
+                -- First group per leader, maintained in user_firsts.py
+                SELECT uf.user_id AS group_leader, uf.first_led_at::DATE AS first_group_date
+                FROM user_firsts uf
+                WHERE uf.user_id IN (SELECT group_leader FROM aggregated_groups)
+            )
+            SELECT
+                ag.group_created_date,
+                ag.group_leader,
+                ag.status,
+                ag.max_group_member,
+                ag.completion_duration_hours,
+                COUNT(*) FILTER (WHERE ag.status = 'COMPLETED') AS completed_groups,
+                COUNT(*) FILTER (WHERE ag.status = 'FAILED') AS failed_groups,
+                COUNT(DISTINCT ag.group_id) AS number_of_orders,
+                CASE WHEN ngl.first_group_date = ag.group_created_date THEN 1 ELSE 0 END AS is_new_group_leader
+            FROM aggregated_groups ag
+            LEFT JOIN new_group_leaders_cte ngl ON ag.group_leader = ngl.group_leader
+            GROUP BY ag.group_created_date, ag.group_leader, ag.status, ag.max_group_member,
+                     ag.completion_duration_hours, ngl.first_group_date
+        """,
+        "day_source": "g.created_at",
+        "changes": """
+            SELECT DATE(g.created_at) AS day, GREATEST(g.created_at, g.updated_at) AS changed_at
+            FROM groups g
+            WHERE g.created_at >= {since} OR g.updated_at >= {since}
+        """,
+    },
+    {
+        # Deliveries per driver, bucketed by the day they went in transit.
+        "table": "daily_driver_deliveries",
+        "day_column": "period",
+        "select": """
+            SELECT
+                date_trunc('day', d.in_transit) AS period,
+                d.driver_id,
+                COUNT(DISTINCT d.id) AS number_of_orders,
+                COUNT(DISTINCT d.group_cart_id) AS number_of_group_orders,
+                COUNT(DISTINCT d.personal_cart_id) AS number_of_personal_orders,
+                COUNT(*) FILTER (WHERE d.delivered IS NOT NULL) AS number_of_delivered_orders,
+                COUNT(*) FILTER (WHERE d.assigned IS NOT NULL) AS assigned_count,
+                COUNT(*) FILTER (WHERE d.status = 'RETURNED') AS returned_count,
+                COUNT(*) AS total_deliveries,
+                SUM(EXTRACT(EPOCH FROM (d.delivered - d.in_transit)) / 60) AS delivery_minutes_total
+            FROM delivery_tracks d
+            WHERE d.in_transit IS NOT NULL
+              AND {days}
+            GROUP BY date_trunc('day', d.in_transit), d.driver_id
+        """,
+        "day_source": "d.in_transit",
+        "change_log": "delivery_track_changes",
+        "changes": """
+            SELECT DATE(c.in_transit) AS day, NULL::timestamp AS changed_at
+            FROM delivery_track_changes c
+            WHERE c.rollup = 'daily_driver_deliveries'
+        """,
+    },
+    {
+        # Assigned/delivered tracks per driver and creation day. Summed over
+        # all days these give each driver's lifetime delivered percentage.
+        "table": "daily_driver_track_counts",
+        "day_column": "track_date",
+        "select": """
+            SELECT
+                DATE(d.created_at) AS track_date,
+                d.driver_id,
+                COUNT(d.id) FILTER (WHERE d.assigned IS NOT NULL) AS assigned_count,
+                COUNT(d.id) FILTER (WHERE d.delivered IS NOT NULL) AS delivered_count
+            FROM delivery_tracks d
+            WHERE d.driver_id IS NOT NULL
+              AND {days}
+            GROUP BY DATE(d.created_at), d.driver_id
+        """,
+        "day_source": "d.created_at",
+        "change_log": "delivery_track_changes",
+        "changes": """
+            SELECT DATE(c.created_at) AS day, NULL::timestamp AS changed_at
+            FROM delivery_track_changes c
+            WHERE c.rollup = 'daily_driver_track_counts'
+        """,
+    },
+    {
+        # Returned tracks paired with a delivered track of the same personal
+        # or group cart, counted on the day the returned track was created.
+        "table": "daily_returned_then_delivered",
+        "day_column": "return_date",
+        "select": """
+            SELECT
+                DATE(r.created_at) AS return_date,
+                COUNT(*) AS returned_then_delivered
+            FROM delivery_tracks r
+            JOIN delivery_tracks dt ON dt.personal_cart_id = r.personal_cart_id
+            WHERE r.status = 'RETURNED' AND dt.delivered IS NOT NULL
+              AND {days}
+            GROUP BY DATE(r.created_at)
+            UNION ALL
+            SELECT
+                DATE(r.created_at) AS return_date,
+                COUNT(*) AS returned_then_delivered
+            FROM delivery_tracks r
+            JOIN delivery_tracks dt ON dt.group_cart_id = r.group_cart_id
+            WHERE r.status = 'RETURNED' AND dt.delivered IS NOT NULL
+              AND {days}
+            GROUP BY DATE(r.created_at)
+        """,
+        "day_source": "r.created_at",
+        "change_log": "delivery_track_changes",
+        "changes": """
+            -- A changed track moves its own return day (it was or is
+            -- RETURNED) and those of the returned tracks of its carts.
+            SELECT DATE(c.created_at) AS day, NULL::timestamp AS changed_at
+            FROM delivery_track_changes c
+            WHERE c.rollup = 'daily_returned_then_delivered' AND c.status = 'RETURNED'
+            UNION ALL
+            SELECT DATE(r.created_at), NULL
+            FROM delivery_track_changes c
+            JOIN delivery_tracks r ON r.personal_cart_id = c.personal_cart_id
+            WHERE c.rollup = 'daily_returned_then_delivered' AND r.status = 'RETURNED'
+            UNION ALL
+            SELECT DATE(r.created_at), NULL
+            FROM delivery_track_changes c
+            JOIN delivery_tracks r ON r.group_cart_id = c.group_cart_id
+            WHERE c.rollup = 'daily_returned_then_delivered' AND r.status = 'RETURNED'
+        """,
+    },
+    {
+        # Rating histogram per product and day; averages, counts and
+        # standard deviations for any period can be derived from it.
+        "table": "daily_product_ratings",
+        "day_column": "rating_date",
+        "select": """
+            SELECT
+                DATE(pr.created_at) AS rating_date,
+                pr.product_id,
+                pr.rating,
+                COUNT(*) AS rating_count
+            FROM product_ratings pr
+            WHERE pr.deleted_at IS NULL
+              AND {days}
+            GROUP BY DATE(pr.created_at), pr.product_id, pr.rating
+        """,
+        "day_source": "pr.created_at",
+        "changes": """
+            SELECT DATE(pr.created_at) AS day, GREATEST(pr.created_at, pr.deleted_at) AS changed_at
+            FROM product_ratings pr
+            WHERE pr.created_at >= {since} OR pr.deleted_at >= {since}
+        """,
+    },
+]
+
+STATE_SQL = """
+CREATE TABLE IF NOT EXISTS rollup_state (
+    rollup VARCHAR PRIMARY KEY,
+    last_changed_at TIMESTAMP,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+ALTER TABLE rollup_state ADD COLUMN IF NOT EXISTS rebuilt_at TIMESTAMPTZ;
+"""
+
+SAVE_STATE_SQL = """
+INSERT INTO rollup_state (rollup, last_changed_at, refreshed_at, rebuilt_at)
+VALUES ($1, $2, now(), CASE WHEN $3 THEN now() END)
+ON CONFLICT (rollup) DO UPDATE SET
+    last_changed_at = GREATEST(rollup_state.last_changed_at, EXCLUDED.last_changed_at),
+    refreshed_at = EXCLUDED.refreshed_at,
+    rebuilt_at = COALESCE(EXCLUDED.rebuilt_at, rollup_state.rebuilt_at)
+"""
+
+TOUCHED_DAYS_SQL = """
+WITH changes AS ({changes})
+SELECT
+    ARRAY(
+        SELECT day FROM changes WHERE day IS NOT NULL
+        UNION
+        SELECT CURRENT_DATE - i FROM generate_series(0, $2::int - 1) AS i
+    ) AS days,
+    -- Never behind the current watermark, and capped at the current time
+    -- so a future-dated row cannot push it past changes that have not
+    -- happened yet.
+    LEAST(GREATEST((SELECT MAX(changed_at) FROM changes)::timestamp, $1::timestamp), LOCALTIMESTAMP) AS changed_at
+"""
+
+# Every version of a delivery track that is inserted, updated or deleted is
+# queued once per rollup named in the trigger's arguments, with the columns
+# those rollups need to find the days it touches. A refresh consumes its
+# rows; until one runs (or a full rebuild clears it) the queue keeps growing.
+TRACK_CHANGES_SQL = """
+CREATE TABLE IF NOT EXISTS delivery_track_changes AS
+    SELECT ''::varchar AS rollup, status, created_at, in_transit, personal_cart_id, group_cart_id
+    FROM delivery_tracks
+    WITH NO DATA;
+CREATE INDEX IF NOT EXISTS delivery_track_changes_rollup_idx ON delivery_track_changes (rollup);
+
+CREATE OR REPLACE FUNCTION log_delivery_track_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO delivery_track_changes
+        SELECT rollup, OLD.status, OLD.created_at, OLD.in_transit, OLD.personal_cart_id, OLD.group_cart_id
+        FROM unnest(TG_ARGV) AS rollup;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO delivery_track_changes
+        SELECT rollup, NEW.status, NEW.created_at, NEW.in_transit, NEW.personal_cart_id, NEW.group_cart_id
+        FROM unnest(TG_ARGV) AS rollup;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Created once; re-creating them on every start would lock delivery_tracks.
+-- Drop both to change the list of rollups.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'delivery_tracks'::regclass AND tgname = 'delivery_tracks_log_change') THEN
+        CREATE TRIGGER delivery_tracks_log_change AFTER INSERT OR DELETE ON delivery_tracks
+            FOR EACH ROW EXECUTE FUNCTION log_delivery_track_change({rollups});
+        CREATE TRIGGER delivery_tracks_log_update AFTER UPDATE ON delivery_tracks
+            FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+            EXECUTE FUNCTION log_delivery_track_change({rollups});
+    END IF;
+END
+$$;
+"""
+
+# Arbitrary key so only one API worker refreshes the rollups at a time.
+REFRESH_LOCK_KEY = 740213
+
+async def ensure_schema(pool):
+    async with pool.acquire() as conn:
+        await conn.execute(STATE_SQL)
+        consumers = [rollup["table"] for rollup in ROLLUPS if rollup.get("change_log") == "delivery_track_changes"]
+        async with conn.transaction():
+            await conn.execute(TRACK_CHANGES_SQL.format(rollups=", ".join(f"'{table}'" for table in consumers)))
+        for rollup in ROLLUPS:
+            table = rollup["table"]
+            # Column types are taken from the source tables.
+            select = rollup["select"].format(days="FALSE")
+            await conn.execute(f"CREATE TABLE IF NOT EXISTS {table} AS {select} WITH NO DATA")
+            await conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_{rollup['day_column']}_idx ON {table} ({rollup['day_column']})"
+            )
+
+async def consume_change_log(conn, rollup: dict):
+    # The refresh transaction is REPEATABLE READ, so this deletes exactly the
+    # queued rows the refresh has seen; changes committed since stay queued.
+    if "change_log" in rollup:
+        await conn.execute(f"DELETE FROM {rollup['change_log']} WHERE rollup = $1", rollup["table"])
+
+async def rebuild_rollup(conn, rollup: dict):
+    table = rollup["table"]
+    await consume_change_log(conn, rollup)
+    await conn.execute(f"DELETE FROM {table}")
+    status = await conn.execute(f"INSERT INTO {table} {rollup['select'].format(days='TRUE')}")
+    # Changes from here on are picked up incrementally again.
+    changed_at = await conn.fetchval("SELECT LOCALTIMESTAMP")
+    await conn.execute(SAVE_STATE_SQL, table, changed_at, True)
+    logger.info(f"Rebuilt {table} ({status}).")
+
+async def refresh_rollup(conn, rollup: dict, lookback_days: int, rebuild_interval: float) -> int:
+    table = rollup["table"]
+    state = await conn.fetchrow(
+        """
+        SELECT last_changed_at, rebuilt_at > now() - make_interval(secs => $2) AS rebuilt_recently
+        FROM rollup_state WHERE rollup = $1
+        """,
+        table, rebuild_interval,
+    )
+    if state is None or not state["rebuilt_recently"]:
+        await rebuild_rollup(conn, rollup)
+        return 0
+
+    touched = await conn.fetchrow(
+        TOUCHED_DAYS_SQL.format(changes=rollup["changes"].format(since=SINCE)),
+        state["last_changed_at"], lookback_days,
+    )
+    days = sorted(touched["days"])
+    if days:
+        bounds = (days, days[0], days[-1])
+        await conn.execute(f"DELETE FROM {table} WHERE {day_filter(rollup['day_column'])}", *bounds)
+        status = await conn.execute(
+            f"INSERT INTO {table} {rollup['select'].format(days=day_filter(rollup['day_source']))}", *bounds
+        )
+        logger.info(f"Refreshed {len(days)} day(s) of {table} ({status}).")
+    await consume_change_log(conn, rollup)
+    await conn.execute(SAVE_STATE_SQL, table, touched["changed_at"], False)
+    return len(days)
+
+async def refresh_rollups(pool, lookback_days: int = 2, rebuild_interval: float = 86400):
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", REFRESH_LOCK_KEY):
+            logger.info("Rollup refresh already running in another worker; skipping.")
+            return
+        try:
+            for rollup in ROLLUPS:
+                # One transaction per rollup so readers never see a day
+                # deleted but not yet re-inserted; one snapshot for reading
+                # and consuming the change queue.
+                async with conn.transaction(isolation="repeatable_read"):
+                    await refresh_rollup(conn, rollup, lookback_days, rebuild_interval)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", REFRESH_LOCK_KEY)
@@ -0,0 +1,7 @@
+# Shared SQL fragments for the dashboard queries.
+
+def date_range(column: str, start: str = "%s", end: str = "%s") -> str:
+    # Every instant from the start day through the end day, as a half-open
+    # range on the bare column. Wrapping the column in date_trunc()/DATE()
+    # instead would stop Postgres from using an index on it.
+    return f"{column} >= {start} AND {column} < {end} + interval '1 day'"
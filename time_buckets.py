@@ -0,0 +1,29 @@
+import pandas as pd
+
+# Shared date bucketing for the pages. Everything is plain datetime
+# arithmetic on the whole column, so the cost no longer grows with a Python
+# call per row the way .to_period(...).apply(lambda r: r.start_time) did.
+
+WEEKDAYS = {"MON": 0, "TUE": 1, "WED": 2, "THU": 3, "FRI": 4, "SAT": 5, "SUN": 6}
+
+def bucket_start(dates, frequency, week_start="MON") -> pd.Series:
+    # Start (midnight) of the Daily/Weekly/Monthly/Yearly bucket each value
+    # falls in. Weekly buckets start on Monday by default, like pandas' 'W'
+    # periods; pass week_start="WED" for Wednesday-anchored weeks.
+    dates = pd.to_datetime(pd.Series(dates))
+    if dates.dt.tz is not None:
+        # Bucket on local wall-clock dates, as Period conversion did
+        dates = dates.dt.tz_localize(None)
+    day = dates.dt.normalize()
+
+    frequency = frequency.lower()
+    if frequency == "daily":
+        return day
+    if frequency == "weekly":
+        offset = (day.dt.dayofweek - WEEKDAYS[week_start.upper()]) % 7
+        return day - pd.to_timedelta(offset, unit="D")
+    if frequency == "monthly":
+        return day - pd.to_timedelta(day.dt.day - 1, unit="D")
+    if frequency == "yearly":
+        return day - pd.to_timedelta(day.dt.dayofyear - 1, unit="D")
+    raise ValueError(f"Unknown frequency: {frequency}")
@@ -0,0 +1,175 @@
+import logging
+
+from rollups import STATE_SQL
+
+logger = logging.getLogger(__name__)
+
+# One row per user with the "firsts" the group KPIs used to find with
+# ROW_NUMBER() / MIN() over the whole order history on every query:
+#
+#   first_order_id                   earliest completed group order
+#   first_group_cart_id/_group_id    earliest group cart with a completed order
+#   first_admin_order_id             earliest completed order in a group the
+#                                    user leads, preferring completed groups,
+#                                    then failed ones (the GLAC admin order)
+#   first_incentivized_order_id      earliest completed order in a group whose
+#                                    leader ordered with a discount
+#   first_led_at                     when the user first created a group
+#
+# Only users whose orders, carts or groups changed since the watermark are
+# recomputed, each from their own rows.
+
+SINCE = "COALESCE($1::timestamp, '-infinity')"
+
+COMPLETED_ORDER = "o.status = 'COMPLETED' AND o.deleted_at IS NULL"
+
+FIRSTS_SELECT = f"""
+SELECT
+    u.user_id,
+    fo.order_id AS first_order_id,
+    fo.created_at AS first_order_at,
+    fc.group_cart_id AS first_group_cart_id,
+    fc.group_id AS first_group_id,
+    fa.order_id AS first_admin_order_id,
+    fi.order_id AS first_incentivized_order_id,
+    fl.first_led_at
+FROM ({{users}}) u
+LEFT JOIN LATERAL (
+    SELECT o.id AS order_id, o.created_at
+    FROM groups_carts gc
+    JOIN groups g ON g.id = gc.group_id
+    JOIN orders o ON gc.id = o.groups_carts_id AND {COMPLETED_ORDER}
+    WHERE gc.user_id = u.user_id
+    ORDER BY o.created_at, o.id
+    LIMIT 1
+) fo ON TRUE
+LEFT JOIN LATERAL (
+    SELECT gc.id AS group_cart_id, gc.group_id
+    FROM groups_carts gc
+    WHERE gc.user_id = u.user_id
+      AND EXISTS (SELECT 1 FROM orders o WHERE o.groups_carts_id = gc.id AND {COMPLETED_ORDER})
+    ORDER BY gc.created_at, gc.id
+    LIMIT 1
+) fc ON TRUE
+LEFT JOIN LATERAL (
+    SELECT o.id AS order_id
+    FROM groups g
+    JOIN groups_carts gc ON g.id = gc.group_id AND g.created_by = gc.user_id
+    JOIN orders o ON gc.id = o.groups_carts_id AND {COMPLETED_ORDER}
+    WHERE gc.user_id = u.user_id
+    ORDER BY CASE WHEN g.status = 'COMPLETED' THEN 1 WHEN g.status = 'FAILED' THEN 2 ELSE 3 END,
+             o.created_at, o.id
+    LIMIT 1
+) fa ON TRUE
+LEFT JOIN LATERAL (
+    SELECT o.id AS order_id
+    FROM groups_carts gc
+    JOIN orders o ON gc.id = o.groups_carts_id AND {COMPLETED_ORDER}
+    WHERE gc.user_id = u.user_id
+      AND EXISTS (
+          SELECT 1
+          FROM groups g
+          JOIN groups_carts lc ON lc.group_id = g.id AND lc.user_id = g.created_by
+          JOIN orders lo ON lo.groups_carts_id = lc.id
+              AND lo.status = 'COMPLETED' AND lo.deleted_at IS NULL
+              AND lo.discount_rule_id IS NOT NULL
+          WHERE g.id = gc.group_id
+      )
+    ORDER BY gc.created_at, gc.id, o.created_at, o.id
+    LIMIT 1
+) fi ON TRUE
+LEFT JOIN LATERAL (
+    SELECT MIN(g.created_at) AS first_led_at
+    FROM groups g
+    WHERE g.created_by = u.user_id
+) fl ON TRUE
+"""
+
+# Every user's firsts at once; what readers use while the table is missing
+# or stale (see derived_tables.py).
+ALL_FIRSTS_SQL = FIRSTS_SELECT.format(users="SELECT user_id FROM groups_carts UNION SELECT created_by FROM groups")
+
+# Users whose firsts may have moved, with when their rows changed. A group
+# changing status or gaining a discounted leader order affects every member.
+CHANGES_SQL = f"""
+SELECT gc.user_id, GREATEST(o.created_at, o.updated_at) AS changed_at
+FROM orders o
+JOIN groups_carts gc ON gc.id = o.groups_carts_id
+WHERE o.created_at >= {SINCE} OR o.updated_at >= {SINCE}
+UNION ALL
+SELECT gc.user_id, GREATEST(g.created_at, g.updated_at)
+FROM groups g
+JOIN groups_carts gc ON gc.group_id = g.id
+WHERE g.created_at >= {SINCE} OR g.updated_at >= {SINCE}
+UNION ALL
+SELECT gc.user_id, lo.updated_at
+FROM orders lo
+JOIN groups_carts lc ON lc.id = lo.groups_carts_id
+JOIN groups g ON g.id = lc.group_id AND g.created_by = lc.user_id
+JOIN groups_carts gc ON gc.group_id = g.id
+WHERE lo.discount_rule_id IS NOT NULL AND (lo.created_at >= {SINCE} OR lo.updated_at >= {SINCE})
+UNION ALL
+SELECT g.created_by, GREATEST(g.created_at, g.updated_at)
+FROM groups g
+WHERE g.created_at >= {SINCE} OR g.updated_at >= {SINCE}
+"""
+
+REFRESH_SQL = f"""
+WITH changes AS ({CHANGES_SQL}),
+upserted AS (
+INSERT INTO user_firsts
+{FIRSTS_SELECT.format(users="SELECT DISTINCT user_id FROM changes WHERE user_id IS NOT NULL")}
+ON CONFLICT (user_id) DO UPDATE SET
+    first_order_id = EXCLUDED.first_order_id,
+    first_order_at = EXCLUDED.first_order_at,
+    first_group_cart_id = EXCLUDED.first_group_cart_id,
+    first_group_id = EXCLUDED.first_group_id,
+    first_admin_order_id = EXCLUDED.first_admin_order_id,
+    first_incentivized_order_id = EXCLUDED.first_incentivized_order_id,
+    first_led_at = EXCLUDED.first_led_at
+RETURNING 1
+)
+SELECT
+    (SELECT COUNT(*) FROM upserted) AS refreshed,
+    -- Capped like the rollup watermark so future-dated rows cannot skip changes
+    LEAST((SELECT MAX(changed_at) FROM changes)::timestamp, LOCALTIMESTAMP) AS changed_at
+"""
+
+# Arbitrary key so only one API worker refreshes the table at a time.
+REFRESH_LOCK_KEY = 740214
+
+async def ensure_schema(pool):
+    async with pool.acquire() as conn:
+        # Column types are taken from the source tables.
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS user_firsts AS "
+            f"{FIRSTS_SELECT.format(users='SELECT user_id FROM groups_carts WHERE FALSE')} WITH NO DATA"
+        )
+        await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS user_firsts_user_id_idx ON user_firsts (user_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS user_firsts_first_group_id_idx ON user_firsts (first_group_id)")
+        # The watermark is kept alongside the rollups'.
+        await conn.execute(STATE_SQL)
+
+async def refresh_user_firsts(pool) -> int:
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if not await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", REFRESH_LOCK_KEY):
+                logger.info("User firsts refresh already running in another worker; skipping.")
+                return 0
+
+            watermark = await conn.fetchval(
+                "SELECT last_changed_at FROM rollup_state WHERE rollup = 'user_firsts'"
+            )
+            row = await conn.fetchrow(REFRESH_SQL, watermark)
+            await conn.execute(
+                """
+                INSERT INTO rollup_state (rollup, last_changed_at, refreshed_at)
+                VALUES ('user_firsts', $1, now())
+                ON CONFLICT (rollup) DO UPDATE SET
+                    last_changed_at = GREATEST(rollup_state.last_changed_at, EXCLUDED.last_changed_at),
+                    refreshed_at = EXCLUDED.refreshed_at
+                """,
+                row["changed_at"],
+            )
+            logger.info(f"Refreshed firsts for {row['refreshed']} user(s).")
+            return row["refreshed"]
@@ -0,0 +1,157 @@
+import json
+
+import pandas as pd
+import streamlit as st
+from psycopg2 import errors
+
+from db_pool import QUERY_CACHE_TTL, get_conn, release_conn
+from query_metrics import cache_data
+from sql_filters import date_range
+
+# Data access for pages/4_users_kpi.py. The five user queries are prepared
+# once per pooled connection as a single statement taking the date range as
+# $1/$2, and each result comes back as a JSON array, so the page is served by
+# one EXECUTE round trip and Postgres reuses the plan.
+
+AGE_BRACKET = """
+    CASE
+        WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, user_birthday)) BETWEEN 18 AND 25 THEN '18-25'
+        WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, user_birthday)) BETWEEN 26 AND 35 THEN '26-35'
+        WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, user_birthday)) BETWEEN 36 AND 45 THEN '36-45'
+        ELSE '46+'
+    END"""
+
+# query id -> (query, result columns, ORDER BY applied when aggregating its rows)
+USER_QUERIES = {
+    "loyalty": (f"""
+        SELECT
+            u.id AS user_id,
+            u.name,
+            u.phone,
+            u.user_status,
+            SUM(o.total_amount)::float8 AS total_spent,
+            COUNT(o.id) AS total_orders
+        FROM
+            users u
+        LEFT JOIN
+            groups_carts gc ON u.id = gc.user_id
+        LEFT JOIN
+            orders o ON gc.id = o.groups_carts_id
+        WHERE
+            {date_range('o.created_at', '$1', '$2')}
+            AND u.user_status = 'VERIFIED'
+            AND o.status = 'COMPLETED'
+        GROUP BY
+            u.id, u.name, u.phone
+        ORDER BY
+            total_spent DESC
+        LIMIT 10
+    """, ["user_id", "name", "phone", "user_status", "total_spent", "total_orders"], "total_spent DESC"),
+    "gender": (f"""
+        SELECT
+            gender,
+            COUNT(*) AS count
+        FROM
+            users
+        WHERE
+            {date_range('created_at', '$1', '$2')}
+            AND user_status = 'VERIFIED'
+        GROUP BY
+            gender
+    """, ["gender", "count"], None),
+    "age": (f"""
+        SELECT
+            {AGE_BRACKET} AS age_bracket,
+            COUNT(*) AS count
+        FROM
+            users
+        WHERE
+            {date_range('created_at', '$1', '$2')}
+            AND user_status = 'VERIFIED'
+        GROUP BY
+            age_bracket
+    """, ["age_bracket", "count"], None),
+    "gender_age": (f"""
+        SELECT
+            gender,
+            {AGE_BRACKET} AS age_bracket,
+            COUNT(*) AS count
+        FROM
+            users
+        WHERE
+            {date_range('created_at', '$1', '$2')}
+            AND user_status = 'VERIFIED'
+        GROUP BY
+            gender, age_bracket
+    """, ["gender", "age_bracket", "count"], None),
+    "device": (f"""
+        SELECT
+            user_id,
+            os,
+            -- Local wall time without an offset: json_agg renders timestamptz
+            -- with one, which the datetime64[ns] restore below rejects, and
+            -- the page compares against naive dates
+            created_at::timestamp AS created_at
+        FROM
+            devices
+        WHERE
+            {date_range('created_at', '$1', '$2')}
+    """, ["user_id", "os", "created_at"], None),
+}
+
+# JSON has no float/timestamp distinction, so these columns are restored after parsing
+COLUMN_TYPES = {
+    "loyalty": {"total_spent": "float64"},
+    "device": {"created_at": "datetime64[ns]"},
+}
+
+STATEMENT = "users_kpi"
+
+def _statement_sql(statement):
+    results = ",\n".join(
+        f"'{query_id}', (SELECT COALESCE(json_agg(q{' ORDER BY ' + order if order else ''}), '[]') FROM ({query}) q)"
+        for query_id, (query, _, order) in USER_QUERIES.items()
+    )
+    return f"PREPARE {statement} (date, date) AS SELECT json_build_object({results})"
+
+def _execute(conn, statement, params):
+    with conn.cursor() as cur:
+        try:
+            cur.execute(f"EXECUTE {statement} (%s, %s)", params)
+        except errors.InvalidSqlStatementName:
+            # First use on this connection; prepared statements outlive the
+            # rollback, so this happens once per pooled connection.
+            conn.rollback()
+            cur.execute(_statement_sql(statement))
+            cur.execute(f"EXECUTE {statement} (%s, %s)", params)
+        results = cur.fetchone()[0]
+    if isinstance(results, str):
+        results = json.loads(results)
+    return results
+
+def _empty_frames():
+    return {query_id: pd.DataFrame(columns=columns) for query_id, (_, columns, _) in USER_QUERIES.items()}
+
+@cache_data(ttl=QUERY_CACHE_TTL)
+def fetch_prepared(statement, params):
+    # Cached on (statement, params) only; see get_user_kpis
+    conn = get_conn()
+    if not conn:
+        return _empty_frames()
+    try:
+        results = _execute(conn, statement, params)
+        frames = {}
+        for query_id, (_, columns, _) in USER_QUERIES.items():
+            frames[query_id] = pd.DataFrame(results[query_id], columns=columns).astype(COLUMN_TYPES.get(query_id, {}))
+        return frames
+    except Exception as e:
+        st.error(f"Error fetching data: {e}")
+        return _empty_frames()
+    finally:
+        release_conn(conn)
+
+def get_user_kpis(start_date, end_date):
+    # Dates are normalized to plain dates so any datetime/Timestamp for the
+    # same day hits the same cache entry.
+    params = (pd.Timestamp(start_date).date(), pd.Timestamp(end_date).date())
+    return fetch_prepared(STATEMENT, params)